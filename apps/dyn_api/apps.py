@@ -8,3 +8,8 @@ from django.apps import AppConfig
 class DynApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.dyn_api'
+
+    def ready(self):
+        # Resolve the DYNAMIC_API models and serializers once
+        from apps.dyn_api.helpers import registry
+        registry.build()
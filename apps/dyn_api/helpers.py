@@ -3,19 +3,419 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
-import datetime, sys, inspect, importlib
+import copy, datetime, sys, inspect, importlib, json
 
-from functools import wraps
+from functools import lru_cache, wraps
+from threading import Lock
+from typing import NamedTuple
 
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.db import connections, models
+from django.db.models.signals import post_save, pre_save
 from django.http import HttpResponseRedirect, HttpResponse
+from django.utils import timezone
 
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import BaseParser
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+class CachedFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer that introspects the model once per class: the fields
+    built on first use are kept on the class and every instance gets a copy.
+    An optional `fields` argument restricts the output to those field names.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        self._only_fields = fields
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        cls = type(self)
+        if '_cached_fields' not in cls.__dict__:
+            cls._cached_fields = super().get_fields()
+        if self._only_fields is None:
+            return copy.deepcopy(cls._cached_fields)
+        return {name: copy.deepcopy(cls._cached_fields[name]) for name in self._only_fields}
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    many=True serializer of the bulk endpoints. For updates, `instance` is a
+    dict of pk -> object and every item is validated against the object of
+    its 'id' (kept in `matched_instances`, in item order). An 'id' repeated in
+    the batch is an error of the later items, so no object is written twice.
+    """
+
+    def to_internal_value(self, data):
+        self.matched_instances = []
+        self._seen_pks = set()
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return self.child.run_validation(data)
+        pk = BulkWriter.item_pk(self.child.Meta.model, data)
+        if pk not in self.instance:
+            raise serializers.ValidationError({'id': ['object with given id not found.']})
+        if pk in self._seen_pks:
+            raise serializers.ValidationError({'id': ['duplicate id in the batch.']})
+        self._seen_pks.add(pk)
+        self.child.instance = self.instance[pk]
+        self.child.initial_data = data
+        try:
+            validated = self.child.run_validation(data)
+        finally:
+            self.child.instance = None
+        self.matched_instances.append(self.instance[pk])
+        return validated
+
+
+class ApiRoute(NamedTuple):
+    model: type
+    serializer: type
+    # Relation fields whose serializer field reads the related object (not just its pk)
+    select_related: tuple
+    # Many-to-many fields, one query each per page instead of one per row
+    prefetch_related: tuple
+
+
+class ApiRegistry:
+    """
+    Model and serializer classes of the DYNAMIC_API routes, resolved once
+    (in DynApiConfig.ready(), and again whenever DYNAMIC_API changes) instead
+    of on every request.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = Lock()
+
+    def build(self, config=None):
+        config = settings.DYNAMIC_API if config is None else config
+        routes = {name: self.resolve(path) for name, path in config.items()}
+        with self._lock:
+            self._routes = routes
+
+    def __iter__(self):
+        return iter(self._routes)
+
+    def get(self, name: str) -> ApiRoute:
+        """Returns the route of a model name; raises KeyError if it is not in DYNAMIC_API."""
+        return self._routes[name]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def resolve(path: str) -> ApiRoute:
+        """Imports the model of an import path and builds its serializer class (cached per path)."""
+        model = Utils.model_name_to_class(path)
+        meta = type('Meta', (), {'model': model, 'fields': '__all__', 'list_serializer_class': BulkListSerializer})
+        serializer = type(f'{model.__name__}Serializer', (CachedFieldsModelSerializer,), {'Meta': meta})
+        fields = serializer().fields
+        select_related = tuple(
+            name for name, field in fields.items()
+            if isinstance(field, RelatedField) and not field.use_pk_only_optimization()
+        )
+        prefetch_related = tuple(name for name, field in fields.items() if isinstance(field, ManyRelatedField))
+        return ApiRoute(model, serializer, select_related, prefetch_related)
+
+
+registry = ApiRegistry()
+
+
+def rebuild_registry(setting, **kwargs):
+    if setting == 'DYNAMIC_API':
+        registry.build()
+
+
+setting_changed.connect(rebuild_registry)
+
+
+class QueryParamError(ValueError):
+    """Invalid list query parameter; the message is returned to the client."""
+
+
+class ListQuery:
+    """
+    Applies the list query parameters of DynamicAPI to a queryset:
+
+        ?fields=id,name           Sparse fieldset
+        ?ordering=-price          Ordering field (pk is always the tie-breaker)
+        ?name__icontains=abc      Filters as <field>[__<op>]=<value>
+        ?cursor=...&page_size=N   Cursor pagination (see DynamicCursorPagination)
+
+    Every name is validated against the model's concrete fields, so only
+    plain column lookups reach the database.
+    """
+
+    RESERVED = ('fields', 'ordering', 'cursor', 'page_size', 'format')
+    LOOKUPS = (
+        'exact', 'iexact', 'contains', 'icontains', 'startswith', 'istartswith',
+        'gt', 'gte', 'lt', 'lte', 'in', 'isnull',
+    )
+    BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+    @staticmethod
+    def get_field(model, name):
+        """Concrete field by name or attname (e.g. 'caja' or 'caja_id')."""
+        for field in model._meta.concrete_fields:
+            if name in (field.name, field.attname):
+                return field
+        raise QueryParamError(f"unknown field '{name}'")
+
+    @staticmethod
+    def parse_fields(route, value):
+        """
+        Returns the requested serializer field names, or None for all of them.
+        """
+        if not value:
+            return None
+        available = route.serializer().fields
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        for name in names:
+            if name not in available:
+                raise QueryParamError(f"unknown field '{name}' in fields")
+        return list(dict.fromkeys(names))
+
+    @staticmethod
+    def parse_ordering(model, value):
+        """
+        Returns the ordering tuple for the cursor paginator: the requested
+        field followed by pk, or ('pk',) by default.
+        """
+        if not value:
+            return ('pk',)
+        descending = value.startswith('-')
+        field = ListQuery.get_field(model, value.lstrip('-'))
+        if field.null:
+            # The cursor position of a NULL value cannot be compared
+            raise QueryParamError(f"cannot order by nullable field '{field.name}'")
+        if field.primary_key:
+            return ('-pk',) if descending else ('pk',)
+        return (f"{'-' if descending else ''}{field.attname}", '-pk' if descending else 'pk')
+
+    @staticmethod
+    def parse_filters(model, params):
+        """
+        Builds the filter kwargs from the non reserved query parameters.
+
+        Args:
+            model: Django model class
+            params: QueryDict of the request
+
+        Returns:
+            Dict of lookup -> python value
+        """
+        filters = {}
+        for key, value in params.items():
+            if key in ListQuery.RESERVED:
+                continue
+            name, _, lookup = key.partition('__')
+            lookup = lookup or 'exact'
+            if lookup not in ListQuery.LOOKUPS:
+                raise QueryParamError(f"unsupported lookup '{lookup}' in '{key}'")
+            field = ListQuery.get_field(model, name)
+            filters[f'{field.attname}__{lookup}'] = ListQuery.to_python(field, lookup, value, key)
+        return filters
+
+    @staticmethod
+    def to_python(field, lookup, value, key):
+        if lookup == 'isnull':
+            if value.lower() not in ListQuery.BOOLEANS:
+                raise QueryParamError(f"'{key}' expects true or false")
+            return ListQuery.BOOLEANS[value.lower()]
+        if lookup in ('iexact', 'contains', 'icontains', 'startswith', 'istartswith'):
+            return value
+        target = field.target_field if field.is_relation else field
+        try:
+            if lookup == 'in':
+                return [ListQuery.convert(target, item) for item in value.split(',') if item]
+            return ListQuery.convert(target, value)
+        except ValidationError as e:
+            raise QueryParamError(f"invalid value for '{key}': {' '.join(e.messages)}")
+
+    @staticmethod
+    def convert(field, value):
+        value = field.to_python(value)
+        if isinstance(field, models.DateTimeField) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    @staticmethod
+    def get_queryset(route, params, fields, ordering):
+        """
+        Filtered queryset of a route restricted to the columns the response
+        and the cursor ordering need.
+
+        Args:
+            route: ApiRoute of the model
+            params: QueryDict of the request
+            fields: Serializer field names from parse_fields(), or None
+            ordering: Ordering tuple from parse_ordering()
+
+        Returns:
+            QuerySet (not ordered, the paginator orders it)
+        """
+        model = route.model
+        queryset = model.objects.filter(**ListQuery.parse_filters(model, params))
+        related = [name for name in route.select_related if fields is None or name in fields]
+        if related:
+            queryset = queryset.select_related(*related)
+        prefetch = [name for name in route.prefetch_related if fields is None or name in fields]
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if fields is not None:
+            columns = {ListQuery.get_field(model, name).name for name in fields if name not in route.prefetch_related}
+            columns |= {ListQuery.get_field(model, name.lstrip('-')).name for name in ordering if name.lstrip('-') != 'pk'}
+            # Columns of the related objects the serializer reads
+            columns |= {
+                f'{name}__{field.name}'
+                for name in related
+                for field in model._meta.get_field(name).related_model._meta.concrete_fields
+            }
+            queryset = queryset.only(*columns)
+        return queryset
+
+
+class DynamicCursorPagination(CursorPagination):
+    """Cursor pagination of the DynamicAPI list, sized by DYNAMIC_API_PAGINATION."""
+
+    page_size_query_param = 'page_size'
+
+    def __init__(self, ordering):
+        options = getattr(settings, 'DYNAMIC_API_PAGINATION', {})
+        self.ordering = ordering
+        self.page_size = options.get('PAGE_SIZE', 100)
+        self.max_page_size = options.get('MAX_PAGE_SIZE', 1000)
+
+
+class NDJSONParser(BaseParser):
+    """Newline delimited JSON: one object per line, parsed into a list."""
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        for number, line in enumerate(stream.read().decode(encoding).splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                raise ParseError(f'NDJSON parse error on line {number} - {e}')
+        return items
+
+
+class BulkWriter:
+    """
+    Writes of the bulk endpoints. Every batch is validated as a whole (nothing
+    is written if one item is invalid) and written in one transaction, with
+    bulk_create/bulk_update when no per-object code would be skipped: the
+    model does not override save(), has no pre_save/post_save receivers, is
+    not multi-table and the items have no many-to-many values. Otherwise each
+    object is saved on its own, still inside the same transaction.
+    """
+
+    @staticmethod
+    def item_pk(model, item):
+        """Primary key of an item (an object with 'id', or the id itself), or None if invalid."""
+        value = item.get('id') if isinstance(item, dict) else item
+        try:
+            return model._meta.pk.to_python(value)
+        except ValidationError:
+            return None
+
+    @staticmethod
+    def options():
+        options = getattr(settings, 'DYNAMIC_API_BULK', {})
+        return options.get('MAX_ITEMS', 5000), options.get('BATCH_SIZE', 500)
+
+    @staticmethod
+    def get_serializer(route, data, instances=None):
+        max_items, _ = BulkWriter.options()
+        return route.serializer(
+            instance=instances, data=data, many=True, partial=instances is not None,
+            allow_empty=False, max_length=max_items
+        )
+
+    @staticmethod
+    def errors(serializer):
+        """
+        Per-item results of an invalid batch, or None if the error is about the
+        batch itself (not a list, empty, too long).
+        """
+        if not isinstance(serializer.errors, list):
+            return None
+        return [
+            {'index': index, 'success': False, 'errors': errors} if errors else {'index': index, 'success': True}
+            for index, errors in enumerate(serializer.errors)
+        ]
+
+    @staticmethod
+    def can_bulk_write(model, validated_data):
+        many_to_many = {field.name for field in model._meta.many_to_many}
+        return (
+            model.save is models.Model.save
+            and not pre_save.has_listeners(model)
+            and not post_save.has_listeners(model)
+            and not model._meta.parents
+            and not any(many_to_many & set(data) for data in validated_data)
+        )
+
+    @staticmethod
+    def create(route, serializer, using):
+        """Creates the validated items. Returns the new objects."""
+        model = route.model
+        _, batch_size = BulkWriter.options()
+        if BulkWriter.can_bulk_write(model, serializer.validated_data) and connections[using].features.can_return_rows_from_bulk_insert:
+            objects = [model(**data) for data in serializer.validated_data]
+            return model.objects.using(using).bulk_create(objects, batch_size=batch_size)
+        return serializer.save()
+
+    @staticmethod
+    def update(route, serializer, using):
+        """Updates the validated items on the objects of their 'id'. Returns the objects."""
+        model = route.model
+        _, batch_size = BulkWriter.options()
+        objects = serializer.matched_instances
+        if not BulkWriter.can_bulk_write(model, serializer.validated_data):
+            child = serializer.child
+            return [child.update(obj, data) for obj, data in zip(objects, serializer.validated_data)]
+
+        fields = set()
+        for obj, data in zip(objects, serializer.validated_data):
+            for name, value in data.items():
+                setattr(obj, name, value)
+            fields.update(data)
+        if fields:
+            model.objects.using(using).bulk_update(objects, sorted(fields), batch_size=batch_size)
+        return objects
+
+    @staticmethod
+    def delete(route, ids, using):
+        """
+        Deletes the objects of ids. A queryset delete still sends the delete
+        signals and cascades; models overriding delete() are deleted one by one.
+        """
+        model = route.model
+        queryset = model.objects.using(using).filter(pk__in=ids)
+        if model.delete is models.Model.delete:
+            queryset.delete()
+        else:
+            for obj in queryset:
+                obj.delete()
+
 
 class Utils:
     @staticmethod
     def get_class(config, name: str) -> models.Model:
-        return Utils.model_name_to_class(config[name])
+        return ApiRegistry.resolve(config[name]).model
 
     @staticmethod
     def get_manager(config, name: str) -> models.Manager:
@@ -23,14 +423,10 @@ class Utils:
 
     @staticmethod
     def get_serializer(config, name: str):
-        class Serializer(serializers.ModelSerializer):
-            class Meta:
-                model = Utils.get_class(config, name)
-                fields = '__all__'
-
-        return Serializer
+        return ApiRegistry.resolve(config[name]).serializer
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def model_name_to_class(name: str):
 
         model_name    = name.split('.')[-1]
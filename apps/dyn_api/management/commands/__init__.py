@@ -0,0 +1 @@
+# Este archivo permite que Django reconozca la carpeta como un módulo Python
@@ -0,0 +1,83 @@
+"""
+Comando de gestión Django para medir la latencia de los listados de la API dinámica.
+Uso: python manage.py benchmark_api [--productos 2000] [--repeticiones 10]
+
+Crea una base de datos de pruebas con generar_datos_sinteticos y, para cada ruta de
+DYNAMIC_API, mide el listado serializado como se hacía antes (una clase de serializer
+nueva en cada llamada y un serializer por objeto), con el registro (clase creada una
+vez, campos cacheados y many=True) y la petición GET completa al endpoint.
+"""
+
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework import serializers
+
+from apps.dyn_api.helpers import registry
+
+
+class Command(BaseCommand):
+    help = 'Mide la latencia de los listados de la API dinámica antes y después del registro de serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=2000, help='Productos a generar')
+        parser.add_argument('--movimientos', type=int, default=2000, help='Movimientos sintéticos a generar')
+        parser.add_argument('--repeticiones', type=int, default=10, help='Mediciones por caso')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command(
+                'generar_datos_sinteticos', productos=options['productos'],
+                movimientos=options['movimientos'], stdout=self.stdout
+            )
+            cliente = Client()
+            cliente.force_login(User.objects.create_superuser('benchmark_api', password=None))
+
+            self.stdout.write(f'\n{"Ruta":<16} {"Filas":>7} {"Antes ms":>10} {"Registro ms":>12} {"GET ms":>10} {"Mejora":>8}')
+            for nombre in registry:
+                ruta = registry.get(nombre)
+                filas = ruta.model.objects.count()
+                antes = self.mediana(lambda: self.serializar_antes(ruta.model), options['repeticiones'])
+                despues = self.mediana(
+                    lambda: ruta.serializer(ruta.model.objects.all(), many=True).data, options['repeticiones']
+                )
+                url = reverse('model_api', args=[nombre])
+                peticion = self.mediana(lambda: cliente.get(url), options['repeticiones'])
+                self.stdout.write(
+                    f'{nombre:<16} {filas:>7} {antes:>10.2f} {despues:>12.2f} {peticion:>10.2f} '
+                    f'{antes / despues if despues else 0:>7.1f}x'
+                )
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark de la API completado'))
+
+    @staticmethod
+    def serializar_antes(modelo):
+        """Serialización previa al registro: clase nueva por llamada y un serializer por objeto."""
+        class Serializer(serializers.ModelSerializer):
+            class Meta:
+                model = modelo
+                fields = '__all__'
+
+        return [Serializer(instance=objeto).data for objeto in modelo.objects.all()]
+
+    @staticmethod
+    def mediana(funcion, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return statistics.median(tiempos)
@@ -3,6 +3,318 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import serializers
+
+from apps.dyn_api.helpers import ApiRegistry, ListQuery, QueryParamError, Utils, registry
+from apps.dyn_dt.models import Caja, Campamento, Concepto
+from apps.pages.models import Product
+
+
+class RegistroSerializersTests(TestCase):
+    """Las clases de serializer de la API dinámica se construyen una vez por ruta"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('api', password='x')
+        self.client.force_login(self.usuario)
+        for indice in range(5):
+            Product.objects.create(name=f'Producto {indice}', info='Info', price=indice * 10)
+
+    def test_misma_clase_entre_llamadas(self):
+        self.assertIs(registry.get('product').serializer, registry.get('product').serializer)
+        self.assertIs(Utils.get_serializer({'product': 'apps.pages.models.Product'}, 'product'),
+                      registry.get('product').serializer)
+        self.assertIs(registry.get('product').model, Product)
+
+    def test_ruta_desconocida(self):
+        with self.assertRaises(KeyError):
+            registry.get('no_existe')
+        respuesta = self.client.get(reverse('model_api', args=['no_existe']))
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_segundo_listado_no_introspecciona_el_modelo(self):
+        url = reverse('model_api', args=['product'])
+        self.client.get(url)
+        with mock.patch.object(
+            serializers.ModelSerializer, 'build_field', autospec=True,
+            side_effect=serializers.ModelSerializer.build_field
+        ) as build_field:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(build_field.call_count, 0)
+
+    def test_listado_igual_que_serializar_cada_objeto(self):
+        serializer = registry.get('product').serializer
+        esperado = [serializer(instance=producto).data for producto in Product.objects.all()]
+        respuesta = self.client.get(reverse('model_api', args=['product']))
+        self.assertEqual(respuesta.json()['data'], esperado)
+        self.assertEqual(len(esperado), 5)
+        self.assertEqual(set(esperado[0]), {'id', 'name', 'info', 'price'})
+
+    def test_campos_independientes_por_instancia(self):
+        serializer = registry.get('product').serializer
+        primero, segundo = serializer(), serializer()
+        self.assertIsNot(primero.fields['name'], segundo.fields['name'])
+        self.assertIs(primero.fields['name'].parent, primero)
+
+    def test_crear_y_actualizar_con_el_registro(self):
+        url = reverse('model_api', args=['product'])
+        respuesta = self.client.post(url, {'name': 'Nuevo', 'info': 'x', 'price': 3})
+        self.assertEqual(respuesta.status_code, 200)
+        producto = Product.objects.get(name='Nuevo')
+        respuesta = self.client.put(f'{url}{producto.pk}/', {'price': 7}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        producto.refresh_from_db()
+        self.assertEqual(producto.price, 7)
+
+    def test_override_settings_reconstruye_el_registro(self):
+        with override_settings(DYNAMIC_API={'usuarios': 'django.contrib.auth.models.User'}):
+            self.assertIs(registry.get('usuarios').model, User)
+            with self.assertRaises(KeyError):
+                registry.get('product')
+        self.assertIs(registry.get('product').model, Product)
+        self.assertIsInstance(registry, ApiRegistry)
+
+
+@override_settings(DYNAMIC_API_PAGINATION={'PAGE_SIZE': 3, 'MAX_PAGE_SIZE': 4})
+class ListadoApiTests(TestCase):
+    """Paginación por cursor, campos, ordenación y filtros del listado de la API dinámica"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('api', password='x')
+        self.client.force_login(self.usuario)
+        self.url = reverse('model_api', args=['product'])
+        for indice, nombre in enumerate(['Delta', 'Alfa', 'Charlie', 'Bravo', 'Eco', 'Foxtrot', 'Golf']):
+            Product.objects.create(name=nombre, info=f'Info {indice}', price=indice * 10)
+
+    def recorrer(self, url):
+        """Sigue los enlaces 'next' y devuelve todas las filas."""
+        filas = []
+        while url:
+            datos = self.client.get(url).json()
+            self.assertTrue(datos['success'])
+            filas += datos['data']
+            url = datos['next']
+        return filas
+
+    def test_pagina_por_defecto_ordenada_por_pk(self):
+        datos = self.client.get(self.url).json()
+        self.assertEqual([fila['name'] for fila in datos['data']], ['Delta', 'Alfa', 'Charlie'])
+        self.assertIsNone(datos['previous'])
+        self.assertIn('cursor=', datos['next'])
+
+    def test_recorrido_completo_sin_repetir_filas(self):
+        filas = self.recorrer(self.url)
+        self.assertEqual([fila['id'] for fila in filas], list(Product.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_pagina_anterior(self):
+        siguiente = self.client.get(self.url).json()['next']
+        datos = self.client.get(siguiente).json()
+        anterior = self.client.get(datos['previous']).json()
+        self.assertEqual([fila['name'] for fila in anterior['data']], ['Delta', 'Alfa', 'Charlie'])
+
+    def test_page_size_limitado(self):
+        datos = self.client.get(self.url, {'page_size': 100}).json()
+        self.assertEqual(len(datos['data']), 4)
+
+    def test_ordenacion(self):
+        filas = self.recorrer(f'{self.url}?ordering=-name')
+        self.assertEqual([fila['name'] for fila in filas], sorted(Product.objects.values_list('name', flat=True), reverse=True))
+
+    def test_campos_seleccionados(self):
+        with CaptureQueriesContext(connection) as consultas:
+            datos = self.client.get(self.url, {'fields': 'name'}).json()
+        self.assertEqual(datos['data'][0], {'name': 'Delta'})
+        select = [c['sql'] for c in consultas.captured_queries if 'pages_product' in c['sql']][0]
+        self.assertNotIn('"info"', select)
+        self.assertNotIn('"price"', select)
+
+    def test_filtros(self):
+        filas = self.recorrer(f'{self.url}?price__gte=20&price__lt=50')
+        self.assertEqual([fila['price'] for fila in filas], [20, 30, 40])
+        filas = self.recorrer(f'{self.url}?name__icontains=o&fields=name')
+        self.assertEqual([fila['name'] for fila in filas], ['Bravo', 'Eco', 'Foxtrot', 'Golf'])
+        filas = self.recorrer(f'{self.url}?name__in=Alfa,Eco&fields=name')
+        self.assertEqual([fila['name'] for fila in filas], ['Alfa', 'Eco'])
+        self.assertEqual(self.recorrer(f'{self.url}?price__isnull=true'), [])
+
+    def test_parametros_invalidos(self):
+        for parametros in (
+            {'fields': 'name,no_existe'},
+            {'ordering': 'no_existe'},
+            {'ordering': 'price'},
+            {'no_existe': '1'},
+            {'name__regex': '^A'},
+            {'price': 'abc'},
+            {'price__isnull': 'quizás'},
+            {'cursor': 'invalido'},
+        ):
+            respuesta = self.client.get(self.url, parametros)
+            self.assertEqual(respuesta.status_code, 400, parametros)
+            self.assertFalse(respuesta.json()['success'])
+
+    def test_filtros_validados_contra_el_modelo(self):
+        self.assertEqual(ListQuery.parse_filters(Caja, {'campamento': '3'}), {'campamento_id__exact': 3})
+        self.assertEqual(ListQuery.parse_filters(Caja, {'campamento_id__in': '1,2'}), {'campamento_id__in': [1, 2]})
+        with self.assertRaises(QueryParamError):
+            ListQuery.parse_filters(Caja, {'campamento__nombre': 'x'})
+
+    @override_settings(DYNAMIC_API={'cajas': 'apps.dyn_dt.models.Caja', 'usuarios': 'django.contrib.auth.models.User'})
+    def test_consultas_constantes_con_relaciones(self):
+        campamento = Campamento.objects.create(nombre='Campamento API')
+        for indice in range(4):
+            Caja.objects.create(campamento=campamento, nombre=f'Caja API {indice}')
+        # Sesión + usuario + cajas: los FK se serializan desde su columna, sin consultas por fila
+        with self.assertNumQueries(3):
+            datos = self.client.get(reverse('model_api', args=['cajas']), {'campamento': campamento.pk, 'page_size': 4}).json()
+        self.assertEqual([fila['campamento'] for fila in datos['data']], [campamento.pk] * 4)
+
+        for indice in range(3):
+            User.objects.create_user(f'api{indice}')
+        # Sesión + usuario + usuarios + grupos + permisos, sin importar el número de filas
+        with self.assertNumQueries(5):
+            self.client.get(reverse('model_api', args=['usuarios']), {'page_size': 4})
+
+
+class OperacionesMasivasApiTests(TestCase):
+    """Altas, modificaciones y bajas por lotes en api/<modelo>/bulk/"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('api', password='x')
+        self.client.force_login(self.usuario)
+        self.url = reverse('model_api_bulk', args=['product'])
+
+    def enviar(self, metodo, datos, content_type='application/json'):
+        cuerpo = datos if isinstance(datos, str) else json.dumps(datos)
+        return getattr(self.client, metodo)(self.url, cuerpo, content_type=content_type)
+
+    def test_alta_masiva_en_una_consulta(self):
+        productos = [{'name': f'Producto {indice}', 'price': indice} for indice in range(50)]
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.enviar('post', productos)
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertTrue(datos['success'])
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual([fila['id'] for fila in datos['data']], list(Product.objects.order_by('pk').values_list('pk', flat=True)))
+        inserts = [c for c in consultas.captured_queries if c['sql'].startswith('INSERT INTO "pages_product"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_alta_ndjson(self):
+        cuerpo = '{"name": "Uno", "price": 1}\n\n{"name": "Dos"}\n'
+        respuesta = self.enviar('post', cuerpo, content_type='application/x-ndjson')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)), ['Dos', 'Uno'])
+
+        respuesta = self.enviar('post', '{"name": "Tres"}\n{roto', content_type='application/x-ndjson')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('line 2', respuesta.json()['detail'])
+
+    def test_lote_invalido_no_escribe_nada(self):
+        respuesta = self.enviar('post', [{'name': 'Bien'}, {'price': 'x'}, {'name': 'Bien 2'}])
+        self.assertEqual(respuesta.status_code, 400)
+        datos = respuesta.json()
+        self.assertFalse(datos['success'])
+        self.assertEqual([fila['success'] for fila in datos['data']], [True, False, True])
+        self.assertEqual(set(datos['data'][1]['errors']), {'name', 'price'})
+        self.assertFalse(Product.objects.exists())
+
+        for cuerpo in ({'name': 'Objeto suelto'}, []):
+            respuesta = self.enviar('post', cuerpo)
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertFalse(respuesta.json()['success'])
+
+    @override_settings(DYNAMIC_API_BULK={'MAX_ITEMS': 2, 'BATCH_SIZE': 500})
+    def test_limite_de_elementos(self):
+        respuesta = self.enviar('post', [{'name': 'A'}, {'name': 'B'}, {'name': 'C'}])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(Product.objects.exists())
+
+    def test_modificacion_masiva(self):
+        productos = [Product.objects.create(name=f'P{indice}', price=indice) for indice in range(3)]
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.enviar('put', [
+                {'id': productos[0].pk, 'price': 100},
+                {'id': str(productos[2].pk), 'name': 'Renombrado'},
+            ])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([fila['id'] for fila in respuesta.json()['data']], [productos[0].pk, productos[2].pk])
+        updates = [c for c in consultas.captured_queries if c['sql'].startswith('UPDATE "pages_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('name', 'price')),
+            [('P0', 100), ('P1', 1), ('Renombrado', 2)]
+        )
+
+    def test_modificacion_con_id_inexistente(self):
+        producto = Product.objects.create(name='P', price=1)
+        respuesta = self.enviar('patch', [{'id': producto.pk, 'price': 5}, {'id': 9999, 'price': 6}, {'price': 7}])
+        self.assertEqual(respuesta.status_code, 400)
+        datos = respuesta.json()['data']
+        self.assertEqual([fila['success'] for fila in datos], [True, False, False])
+        self.assertIn('id', datos[1]['errors'])
+        producto.refresh_from_db()
+        self.assertEqual(producto.price, 1)
+
+    def test_modificacion_con_id_repetido(self):
+        producto = Product.objects.create(name='P', price=1)
+        for metodo in ('put', 'patch'):
+            respuesta = self.enviar(metodo, [{'id': producto.pk, 'price': 5}, {'id': str(producto.pk), 'price': 6}])
+            self.assertEqual(respuesta.status_code, 400)
+            datos = respuesta.json()['data']
+            self.assertEqual([fila['success'] for fila in datos], [True, False])
+            self.assertEqual(datos[1]['errors']['id'], ['duplicate id in the batch.'])
+        producto.refresh_from_db()
+        self.assertEqual(producto.price, 1)
+
+    def test_requiere_autenticacion(self):
+        producto = Product.objects.create(name='P', price=1)
+        self.client.logout()
+        for metodo, datos in (
+            ('post', [{'name': 'Anónimo'}]), ('put', [{'id': producto.pk, 'price': 2}]), ('delete', [producto.pk])
+        ):
+            self.assertEqual(self.enviar(metodo, datos).status_code, 403)
+        self.assertEqual(list(Product.objects.values_list('name', 'price')), [('P', 1)])
+
+    def test_baja_masiva(self):
+        productos = [Product.objects.create(name=f'P{indice}') for indice in range(4)]
+        respuesta = self.enviar('delete', [productos[0].pk, {'id': productos[1].pk}, 9999])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(Product.objects.count(), 4)
+
+        respuesta = self.enviar('delete', [productos[0].pk, {'id': productos[1].pk}])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(list(Product.objects.values_list('pk', flat=True)), [productos[2].pk, productos[3].pk])
+
+    @override_settings(DYNAMIC_API={'conceptos': 'apps.dyn_dt.models.Concepto'})
+    def test_modelo_con_save_propio_guarda_objeto_a_objeto(self):
+        """Concepto rellena creado_por en save(): bulk_create se lo saltaría"""
+        url = reverse('model_api_bulk', args=['conceptos'])
+        with mock.patch.object(Concepto, 'save', autospec=True, side_effect=Concepto.save) as save:
+            respuesta = self.client.post(
+                url, json.dumps([{'nombre': 'Cuota'}, {'nombre': 'Material', 'es_gasto': True}]), content_type='application/json'
+            )
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(Concepto.objects.filter(es_gasto=True).count(), 1)
+
+        concepto = Concepto.objects.get(nombre='Cuota')
+        respuesta = self.client.put(url, json.dumps([{'id': concepto.pk, 'nombre': 'Cuota socio'}]), content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        concepto.refresh_from_db()
+        self.assertEqual(concepto.nombre, 'Cuota socio')
+
+    def test_unicidad_en_la_transaccion(self):
+        with override_settings(DYNAMIC_API={'conceptos': 'apps.dyn_dt.models.Concepto'}):
+            url = reverse('model_api_bulk', args=['conceptos'])
+            Concepto.objects.create(nombre='Existente')
+            respuesta = self.client.post(url, json.dumps([{'nombre': 'Nuevo'}, {'nombre': 'Existente'}]), content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(Concepto.objects.filter(nombre='Nuevo').exists())
@@ -9,21 +9,19 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.shortcuts import render, redirect, get_object_or_404
 
+from django.db import IntegrityError, router, transaction
+
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.http import HttpResponse
 
 from django.conf import settings
 
-DYNAMIC_API = {}
-
-try:
-    DYNAMIC_API = getattr(settings, 'DYNAMIC_API') 
-except:     
-    pass 
-
-from .helpers import Utils 
+from .helpers import BulkWriter, DynamicCursorPagination, ListQuery, NDJSONParser, QueryParamError, registry
 
 def index(request):
     
@@ -37,6 +35,7 @@ def index(request):
 class DynamicAPI(APIView):
 
     # READ : GET api/model/id or api/model
+    # The list is cursor paginated and accepts ?fields=, ?ordering= and <field>__<op>= filters (see ListQuery)
     def get(self, request, **kwargs):
 
         model_id = kwargs.get('id', None)
@@ -56,15 +55,11 @@ class DynamicAPI(APIView):
                         'success': False
                     }, status=400)
 
-                thing = get_object_or_404(Utils.get_manager(DYNAMIC_API, kwargs.get('model_name')), id=model_id)
-                model_serializer = Utils.get_serializer(DYNAMIC_API, kwargs.get('model_name'))(instance=thing)
-                output = model_serializer.data
+                route = registry.get(kwargs.get('model_name'))
+                thing = get_object_or_404(route.model.objects, id=model_id)
+                output = route.serializer(instance=thing).data
             else:
-                all_things = Utils.get_manager(DYNAMIC_API, kwargs.get('model_name')).all()
-                thing_serializer = Utils.get_serializer(DYNAMIC_API, kwargs.get('model_name'))
-                output = []
-                for thing in all_things:
-                    output.append(thing_serializer(instance=thing).data)
+                return self.list(request, registry.get(kwargs.get('model_name')))
         except KeyError:
             return Response(data={
                 'message': 'this model is not activated or not exist.',
@@ -80,11 +75,36 @@ class DynamicAPI(APIView):
             'success': True
             }, status=200)
 
+    def list(self, request, route):
+        params = request.query_params
+        try:
+            fields = ListQuery.parse_fields(route, params.get('fields'))
+            ordering = ListQuery.parse_ordering(route.model, params.get('ordering'))
+            queryset = ListQuery.get_queryset(route, params, fields, ordering)
+            paginator = DynamicCursorPagination(ordering)
+            page = paginator.paginate_queryset(queryset, request, view=self)
+        except QueryParamError as e:
+            return Response(data={
+                'message': 'Input Error = ' + str(e),
+                'success': False
+            }, status=400)
+        except NotFound:
+            return Response(data={
+                'message': 'Input Error = invalid cursor',
+                'success': False
+            }, status=400)
+        return Response(data={
+            'data': route.serializer(page, many=True, fields=fields).data,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'success': True
+            }, status=200)
+
     # CREATE : POST api/model/
     #@check_permission
     def post(self, request, **kwargs):
         try:
-            model_serializer = Utils.get_serializer(DYNAMIC_API, kwargs.get('model_name'))(data=request.data)
+            model_serializer = registry.get(kwargs.get('model_name')).serializer(data=request.data)
             if model_serializer.is_valid():
                 model_serializer.save()
             else:
@@ -106,10 +126,9 @@ class DynamicAPI(APIView):
     #@check_permission
     def put(self, request, **kwargs):
         try:
-            thing = get_object_or_404(Utils.get_manager(DYNAMIC_API, kwargs.get('model_name')), id=kwargs.get('id'))
-            model_serializer = Utils.get_serializer(DYNAMIC_API, kwargs.get('model_name'))(instance=thing,
-                                                                                           data=request.data,
-                                                                                           partial=True)
+            route = registry.get(kwargs.get('model_name'))
+            thing = get_object_or_404(route.model.objects, id=kwargs.get('id'))
+            model_serializer = route.serializer(instance=thing, data=request.data, partial=True)
             if model_serializer.is_valid():
                 model_serializer.save()
             else:
@@ -136,15 +155,15 @@ class DynamicAPI(APIView):
     #@check_permission
     def delete(self, request, **kwargs):
         try:
-            model_manager = Utils.get_manager(DYNAMIC_API, kwargs.get('model_name'))
+            route = registry.get(kwargs.get('model_name'))
             to_delete_id = kwargs.get('id')
-            model_manager.get(id=to_delete_id).delete()
+            route.model.objects.get(id=to_delete_id).delete()
         except KeyError:
             return Response(data={
                 'message': 'this model is not activated or not exist.',
                 'success': False
             }, status=400)
-        except Utils.get_class(DYNAMIC_API, kwargs.get('model_name')).DoesNotExist as e:
+        except route.model.DoesNotExist as e:
             return Response(data={
                 'message': 'object with given id not found.',
                 'success': False
@@ -153,3 +172,123 @@ class DynamicAPI(APIView):
             'message': 'Record Deleted.',
             'success': True
         }, status=200)
+
+
+class BulkDynamicAPI(APIView):
+    """
+    Batch variants of the DynamicAPI writes. The body is a JSON array or NDJSON
+    (Content-Type: application/x-ndjson); the whole batch is validated first and
+    written in one transaction (see BulkWriter), and the response has one result
+    per item, in input order.
+    """
+
+    parser_classes = [JSONParser, NDJSONParser]
+    permission_classes = [IsAuthenticated]
+
+    # CREATE : POST api/model/bulk/ with [{...}, ...]
+    def post(self, request, **kwargs):
+        try:
+            route = registry.get(kwargs.get('model_name'))
+        except KeyError:
+            return self.not_activated()
+
+        serializer = BulkWriter.get_serializer(route, request.data)
+        if not serializer.is_valid():
+            return self.invalid(serializer)
+        try:
+            using = router.db_for_write(route.model)
+            with transaction.atomic(using=using):
+                objects = BulkWriter.create(route, serializer, using)
+        except IntegrityError as e:
+            return self.integrity_error(e)
+        return Response(data={
+            'data': [{'index': index, 'id': obj.pk, 'success': True} for index, obj in enumerate(objects)],
+            'message': f'{len(objects)} Records Created.',
+            'success': True
+        }, status=200)
+
+    # UPDATE : PUT api/model/bulk/ with [{"id": 1, ...}, ...]
+    def put(self, request, **kwargs):
+        try:
+            route = registry.get(kwargs.get('model_name'))
+        except KeyError:
+            return self.not_activated()
+
+        items = request.data if isinstance(request.data, list) else []
+        ids = {BulkWriter.item_pk(route.model, item) for item in items} - {None}
+        serializer = BulkWriter.get_serializer(route, request.data, route.model.objects.in_bulk(ids))
+        if not serializer.is_valid():
+            return self.invalid(serializer)
+        try:
+            using = router.db_for_write(route.model)
+            with transaction.atomic(using=using):
+                objects = BulkWriter.update(route, serializer, using)
+        except IntegrityError as e:
+            return self.integrity_error(e)
+        return Response(data={
+            'data': [{'index': index, 'id': obj.pk, 'success': True} for index, obj in enumerate(objects)],
+            'message': f'{len(objects)} Records Updated.',
+            'success': True
+        }, status=200)
+
+    patch = put
+
+    # DELETE : DELETE api/model/bulk/ with [1, 2, ...] or [{"id": 1}, ...]
+    def delete(self, request, **kwargs):
+        try:
+            route = registry.get(kwargs.get('model_name'))
+        except KeyError:
+            return self.not_activated()
+
+        max_items, _ = BulkWriter.options()
+        items = request.data
+        if not isinstance(items, list) or not items or len(items) > max_items:
+            return Response(data={
+                'message': f'Input Error = expected a list of 1 to {max_items} ids',
+                'success': False
+            }, status=400)
+
+        ids = [BulkWriter.item_pk(route.model, item) for item in items]
+        found = set(route.model.objects.filter(pk__in={pk for pk in ids if pk is not None}).values_list('pk', flat=True))
+        results = [
+            {'index': index, 'id': pk, 'success': True} if pk in found else
+            {'index': index, 'success': False, 'errors': {'id': ['object with given id not found.']}}
+            for index, pk in enumerate(ids)
+        ]
+        if not all(result['success'] for result in results):
+            return Response(data={'data': results, 'success': False}, status=400)
+        try:
+            using = router.db_for_write(route.model)
+            with transaction.atomic(using=using):
+                BulkWriter.delete(route, ids, using)
+        except IntegrityError as e:
+            return self.integrity_error(e)
+        return Response(data={
+            'data': results,
+            'message': f'{len(ids)} Records Deleted.',
+            'success': True
+        }, status=200)
+
+    @staticmethod
+    def not_activated():
+        return Response(data={
+            'message': 'this model is not activated or not exist.',
+            'success': False
+        }, status=400)
+
+    @staticmethod
+    def invalid(serializer):
+        results = BulkWriter.errors(serializer)
+        if results is None:
+            return Response(data={
+                **serializer.errors,
+                'success': False
+            }, status=400)
+        return Response(data={'data': results, 'success': False}, status=400)
+
+    @staticmethod
+    def integrity_error(e):
+        return Response(data={
+            'message': 'Integrity Error = ' + str(e),
+            'success': False
+        }, status=400)
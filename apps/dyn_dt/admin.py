@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 from .models import *
 
 # Register your models here.
@@ -139,6 +140,10 @@ class MovimientoCajaAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        # Count the breakdown rows in the listing query instead of once per row
+        return super().get_queryset(request).annotate(num_movimientos_dinero=Count('movimientos_dinero'))
+
     def save_model(self, request, obj, form, change):
         if not change:  # Only on creation
             obj.creado_por = request.user
@@ -167,10 +172,7 @@ class MovimientoCajaAdmin(admin.ModelAdmin):
     tiene_archivo.boolean = False
     
     def tiene_desglose(self, obj):
-        count = MovimientoDinero.objects.filter(
-            content_type__model=obj._meta.model_name,
-            object_id=obj.pk
-        ).count()
+        count = obj.num_movimientos_dinero
         if count > 0:
             return f"✅ ({count})"
         return "❌ Sin desglose"
@@ -325,21 +327,15 @@ class DesgloseCajaAdmin(admin.ModelAdmin):
 @admin.register(MovimientoDinero)
 class MovimientoDineroAdmin(admin.ModelAdmin):
     list_display = (
-        'get_movimiento_caja_display',  # Use a method instead of the GenericForeignKey
+        'movimiento_caja',
         'denominacion', 'cantidad_entrada', 'cantidad_salida',
         'cantidad_neta', 'valor_neto', 'creado_por', 'creado_en',
     )
     list_filter = ('denominacion__es_billete', 'denominacion')
+    list_select_related = ('movimiento_caja__caja', 'movimiento_caja__turno', 'movimiento_caja__concepto', 'denominacion', 'creado_por')
     ordering = ('-creado_en',)
     readonly_fields = ('cantidad_neta', 'valor_neto', 'creado_por', 'creado_en')
 
-    def get_movimiento_caja_display(self, obj):
-        # Return a string representation of the related object
-        if obj.movimiento_caja:
-            return str(obj.movimiento_caja)
-        return "-"
-    get_movimiento_caja_display.short_description = "Movimiento Caja"
-
     def save_model(self, request, obj, form, change):
         if not change:  # Only on creation
             obj.creado_por = request.user
@@ -372,6 +368,10 @@ class EjercicioAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Los saldos acumulados se calculan en la misma consulta del listado
+        return super().get_queryset(request).con_saldos()
+
     def saldo_cajas(self, obj):
         return f"{obj.calcular_saldo_cajas():.2f}€"
     saldo_cajas.short_description = 'Saldo de Cajas'
@@ -442,4 +442,24 @@ class CampamentoAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not change:
             obj.creado_por = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+@admin.register(SaldoSnapshot)
+class SaldoSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('ejercicio', 'campamento', 'tipo', 'ingresos', 'gastos', 'saldo_cierre', 'actualizado_en')
+    list_filter = ('tipo', 'ejercicio', 'campamento')
+    ordering = ('-ejercicio__año', 'campamento__nombre', 'tipo')
+    list_select_related = ('ejercicio', 'campamento')
+    # Se mantienen desde las señales de movimientos; usar rebuild_snapshots para corregirlos
+    readonly_fields = ('ejercicio', 'campamento', 'tipo', 'ingresos', 'gastos', 'saldo_cierre', 'actualizado_en')
+
+@admin.register(TrabajoExportacion)
+class TrabajoExportacionAdmin(admin.ModelAdmin):
+    list_display = ('ruta', 'formato', 'estado', 'filas_procesadas', 'total_filas', 'creado_por', 'creado_en', 'completado_en')
+    list_filter = ('estado', 'formato', 'ruta')
+    list_select_related = ('creado_por',)
+    # Los genera el comando procesar_exportaciones
+    readonly_fields = (
+        'ruta', 'formato', 'parametros', 'estado', 'total_filas', 'filas_procesadas',
+        'archivo', 'error', 'creado_por', 'creado_en', 'iniciado_en', 'latido_en', 'completado_en'
+    )
@@ -3,3 +3,14 @@ from django.apps import AppConfig
 class DynDtConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.dyn_dt'
+
+    def ready(self):
+        # Cache invalidation for the saldo analytics payload
+        from apps.dyn_dt.handlers import saldo_handlers
+        saldo_handlers.connect_signals()
+
+        # Full-text index maintenance for the 'fulltext' datatable search backend
+        from django.db.models.signals import post_migrate
+        from apps.dyn_dt import search
+        search.connect_signals()
+        post_migrate.connect(search.create_missing_indexes, sender=self, dispatch_uid='dyn_dt_search_indexes')
@@ -1,24 +1,42 @@
 """
 AJAX request handlers for the dynamic datatables application.
 """
+import heapq
+import itertools
+
+from django.db.models import F, Q, Sum
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
 from apps.dyn_dt.models import (
-    Ejercicio, MovimientoCaja, MovimientoBanco, Turno, Caja, Campamento, CuentaBancaria, ViaMovimientoBanco
+    Ejercicio, MovimientoCaja, MovimientoBanco, MovimientoDinero, Turno, Caja, Campamento, CuentaBancaria,
+    ViaMovimientoBanco
+)
+from apps.dyn_dt.utils import (
+    MOVEMENT_TYPE_RANK, aggregate_movements_summary, decode_keyset_cursor,
+    encode_keyset_cursor, format_movement_values, movement_values
 )
-from apps.dyn_dt.utils import format_movement_data, calculate_movements_summary
 
 
 class RegistroAjaxHandler:
     """Handles AJAX requests for the registro view."""
     
+    # Page size limits for the keyset-paginated mode of handle_get_ejercicio_movimientos
+    MAX_PAGE_SIZE = 500
+
     @staticmethod
     def handle_get_ejercicio_movimientos(request):
         """
-        Returns all movements for a specific ejercicio (both cash and bank).
+        Returns the movements of a specific ejercicio (both cash and bank).
+        
+        Without a `limit` parameter every movement is returned. With `limit`
+        the merged caja/banco stream is paginated by (fecha, id): pass the
+        `next_cursor` of a response as `cursor` to get the following page.
+        The summary is only computed on the first page.
         
         Args:
-            request: Django request object with ejercicio_id parameter
+            request: Django request object with ejercicio_id and optional
+                campamento_id, limit and cursor parameters
             
         Returns:
             JsonResponse with movements data and summary
@@ -32,53 +50,106 @@ class RegistroAjaxHandler:
         try:
             ejercicio = Ejercicio.objects.get(id=ejercicio_id)
 
+            movimientos_caja = MovimientoCaja.objects.filter(ejercicio=ejercicio)
+            movimientos_banco = MovimientoBanco.objects.filter(ejercicio=ejercicio)
             # Si se especifica campamento, filtrar por cajas de ese campamento
             if campamento_id:
-                # Buscar cajas asociadas al campamento
-                cajas_campamento = Caja.objects.filter(campamento_id=campamento_id)
-                movimientos_caja = MovimientoCaja.objects.filter(
-                    ejercicio=ejercicio,
-                    caja__in=cajas_campamento
-                ).select_related('caja', 'turno', 'concepto').order_by('-fecha')
-                movimientos_banco = MovimientoBanco.objects.filter(
-                    ejercicio=ejercicio,
-                    campamento_id=campamento_id
-                ).select_related('concepto').order_by('-fecha')
+                movimientos_caja = movimientos_caja.filter(caja__campamento_id=campamento_id)
+                movimientos_banco = movimientos_banco.filter(campamento_id=campamento_id)
+
+            limit = request.GET.get('limit')
+            cursor = request.GET.get('cursor')
+            if limit:
+                limit = max(1, min(int(limit), RegistroAjaxHandler.MAX_PAGE_SIZE))
+                pagina, next_cursor = RegistroAjaxHandler._paginate_movements(
+                    movimientos_caja, movimientos_banco, limit, cursor
+                )
             else:
-                # Si no hay campamento, mostrar todos los movimientos del ejercicio
-                movimientos_caja = MovimientoCaja.objects.filter(
-                    ejercicio=ejercicio
-                ).select_related('caja', 'turno', 'concepto').order_by('-fecha')
-                movimientos_banco = MovimientoBanco.objects.filter(
-                    ejercicio=ejercicio
-                ).select_related('concepto').order_by('-fecha')
-
-            movimientos_data = []
-            for mov in movimientos_caja:
-                movimientos_data.append(format_movement_data(mov, 'caja'))
-            for mov in movimientos_banco:
-                movimientos_data.append(format_movement_data(mov, 'banco'))
-
-            movimientos_data.sort(key=lambda x: x['datetime_iso'], reverse=True)
-
-            all_movimientos = list(movimientos_caja) + list(movimientos_banco)
-            resumen = calculate_movements_summary(all_movimientos)
-            resumen['saldo_actual'] = float(ejercicio.saldo_total)
+                pagina = RegistroAjaxHandler._merge_movements(
+                    movement_values(movimientos_caja.order_by('-fecha', '-id'), 'caja'),
+                    movement_values(movimientos_banco.order_by('-fecha', '-id'), 'banco')
+                )
+                next_cursor = None
 
-            return JsonResponse({
+            response = {
                 'success': True,
-                'movimientos': movimientos_data,
-                'resumen': resumen,
+                'movimientos': [format_movement_values(row, tipo) for tipo, row in pagina],
                 'ejercicio': {
                     'id': ejercicio.id,
                     'nombre': ejercicio.nombre,
                     'año': ejercicio.año,
                     'saldo_total': float(ejercicio.saldo_total)
                 }
-            })
+            }
+            if limit:
+                response['next_cursor'] = next_cursor
+                response['has_more'] = next_cursor is not None
+            if not cursor:
+                resumen = aggregate_movements_summary(movimientos_caja, movimientos_banco)
+                resumen['saldo_actual'] = response['ejercicio']['saldo_total']
+                response['resumen'] = resumen
+
+            return JsonResponse(response)
 
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
+
+    @staticmethod
+    def _merge_movements(movimientos_caja, movimientos_banco):
+        """
+        Merges two movement_values() querysets ordered by (-fecha, -id) into
+        one stream of (tipo, row) pairs, newest first.
+        """
+        return heapq.merge(
+            (('caja', row) for row in movimientos_caja),
+            (('banco', row) for row in movimientos_banco),
+            key=lambda item: (item[1]['fecha'], MOVEMENT_TYPE_RANK[item[0]], item[1]['id']),
+            reverse=True
+        )
+
+    @staticmethod
+    def _keyset_filter(tipo, cursor_values):
+        """
+        Q selecting the rows of one movement table that come after the cursor
+        in the merged (fecha, tipo, id) descending order.
+        """
+        fecha, cursor_tipo, cursor_id = cursor_values
+        fecha = parse_datetime(fecha)
+        rank, cursor_rank = MOVEMENT_TYPE_RANK[tipo], MOVEMENT_TYPE_RANK[cursor_tipo]
+        if rank < cursor_rank:
+            # Every row of this table with the cursor's fecha sorts after the cursor
+            return Q(fecha__lte=fecha)
+        if rank > cursor_rank:
+            return Q(fecha__lt=fecha)
+        return Q(fecha__lt=fecha) | Q(fecha=fecha, id__lt=cursor_id)
+
+    @staticmethod
+    def _paginate_movements(movimientos_caja, movimientos_banco, limit, cursor=None):
+        """
+        Returns one page of the merged movement stream and the cursor of the
+        next page (None on the last one). Each table is read with an indexed
+        range scan of at most limit + 1 rows, whatever the ejercicio size.
+        """
+        if cursor:
+            cursor_values = decode_keyset_cursor(cursor)
+            movimientos_caja = movimientos_caja.filter(
+                RegistroAjaxHandler._keyset_filter('caja', cursor_values)
+            )
+            movimientos_banco = movimientos_banco.filter(
+                RegistroAjaxHandler._keyset_filter('banco', cursor_values)
+            )
+
+        pagina = list(itertools.islice(RegistroAjaxHandler._merge_movements(
+            movement_values(movimientos_caja.order_by('-fecha', '-id')[:limit + 1], 'caja'),
+            movement_values(movimientos_banco.order_by('-fecha', '-id')[:limit + 1], 'banco')
+        ), limit + 1))
+
+        next_cursor = None
+        if len(pagina) > limit:
+            pagina = pagina[:limit]
+            tipo, ultimo = pagina[-1]
+            next_cursor = encode_keyset_cursor(ultimo['fecha'].isoformat(), tipo, ultimo['id'])
+        return pagina, next_cursor
     
     @staticmethod
     def handle_get_turnos(request):
@@ -143,7 +214,7 @@ class RegistroAjaxHandler:
             
             # Get the money breakdown for this movement
             desglose_data = {}
-            for mov_dinero in movimiento.movimientos_dinero.all():
+            for mov_dinero in movimiento.movimientos_dinero.select_related('denominacion'):
                 desglose_data[mov_dinero.denominacion.id] = {
                     'cantidad_entrada': mov_dinero.cantidad_entrada,
                     'cantidad_salida': mov_dinero.cantidad_salida,
@@ -180,6 +251,103 @@ class RegistroAjaxHandler:
         })
 
 
+class CajaAjaxHandler:
+    """Handles AJAX requests for the cajas view."""
+
+    # Page size limit for the paginated mode of handle_get_movimientos_dinero
+    MAX_PAGE_SIZE = 500
+
+    @staticmethod
+    def handle_get_movimientos_dinero(request):
+        """
+        Returns the money movements (per denomination) of a caja.
+        
+        With `agrupar=denominacion` the rows are aggregated server-side into
+        entrada/salida/neta totals per denomination. Otherwise the flat rows
+        are returned, newest first; with `limit` they are paginated by id and
+        the `next_cursor` of a response is passed back as `cursor`.
+        
+        Args:
+            request: Django request object with caja_id and optional
+                ejercicio_id, agrupar, limit and cursor parameters
+            
+        Returns:
+            JsonResponse with movimientos_dinero or por_denominacion data
+        """
+        caja_id = request.GET.get('caja_id')
+        if not caja_id:
+            return JsonResponse({'success': False, 'error': 'Caja ID requerido'})
+        if not Caja.objects.filter(id=caja_id).exists():
+            return JsonResponse({'success': False, 'error': 'Caja no encontrada'})
+
+        try:
+            movimientos_dinero = MovimientoDinero.de_caja(
+                caja_id, ejercicio=request.GET.get('ejercicio_id') or None
+            )
+
+            if request.GET.get('agrupar') == 'denominacion':
+                return JsonResponse({
+                    'success': True,
+                    'por_denominacion': CajaAjaxHandler._aggregate_by_denomination(movimientos_dinero)
+                })
+
+            limit = request.GET.get('limit')
+            cursor = request.GET.get('cursor')
+            if cursor:
+                cursor_id, = decode_keyset_cursor(cursor)
+                movimientos_dinero = movimientos_dinero.filter(id__lt=cursor_id)
+            movimientos_dinero = movimientos_dinero.order_by('-id').values(
+                'id', 'movimiento_caja_id', 'cantidad_entrada', 'cantidad_salida',
+                valor=F('denominacion__valor'), es_billete=F('denominacion__es_billete')
+            )
+            if limit:
+                limit = max(1, min(int(limit), CajaAjaxHandler.MAX_PAGE_SIZE))
+                movimientos_dinero = movimientos_dinero[:limit + 1]
+            filas = list(movimientos_dinero)
+
+            response = {'success': True}
+            if limit:
+                response['has_more'] = len(filas) > limit
+                filas = filas[:limit]
+                response['next_cursor'] = (
+                    encode_keyset_cursor(filas[-1]['id']) if response['has_more'] else None
+                )
+            response['movimientos_dinero'] = [{
+                'id': fila['id'],
+                'movimiento_id': fila['movimiento_caja_id'],
+                'denominacion': CajaAjaxHandler._denomination_label(fila['valor'], fila['es_billete']),
+                'cantidad_entrada': fila['cantidad_entrada'],
+                'cantidad_salida': fila['cantidad_salida']
+            } for fila in filas]
+            return JsonResponse(response)
+
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Parámetros de paginación inválidos'})
+
+    @staticmethod
+    def _aggregate_by_denomination(movimientos_dinero):
+        """Entrada/salida/neta totals per denomination in one grouped query."""
+        totales = movimientos_dinero.values(
+            'denominacion_id', valor=F('denominacion__valor'), es_billete=F('denominacion__es_billete')
+        ).annotate(
+            entrada=Sum('cantidad_entrada'), salida=Sum('cantidad_salida')
+        ).order_by('-valor')
+        return [{
+            'denominacion_id': total['denominacion_id'],
+            'denominacion': CajaAjaxHandler._denomination_label(total['valor'], total['es_billete']),
+            'valor': float(total['valor']),
+            'cantidad_entrada': total['entrada'],
+            'cantidad_salida': total['salida'],
+            'cantidad_neta': total['entrada'] - total['salida'],
+            'valor_neto': float((total['entrada'] - total['salida']) * total['valor'])
+        } for total in totales]
+
+    @staticmethod
+    def _denomination_label(valor, es_billete):
+        """Same text as str(DenominacionEuro) without loading the instance."""
+        return f"{valor}€ ({'billete' if es_billete else 'moneda'})"
+
+
 class LegacyAjaxHandler:
     """Handles legacy AJAX requests for backward compatibility."""
     
@@ -204,26 +372,20 @@ class LegacyAjaxHandler:
             ejercicio = get_object_or_404(Ejercicio, id=ejercicio_id)
             
             # Get movements for this caja and its ejercicio
-            movimientos_caja = MovimientoCaja.objects.filter(caja=caja, ejercicio=ejercicio).order_by('-id')
-            movimientos_banco = MovimientoBanco.objects.filter(
-                ejercicio=ejercicio
-            ).order_by('-id')
-            
-            # Format movements data
-            movimientos_data = []
-            
-            for mov in movimientos_caja:
-                movimientos_data.append(format_movement_data(mov, 'caja'))
-            
-            for mov in movimientos_banco:
-                movimientos_data.append(format_movement_data(mov, 'banco'))
+            movimientos_caja = MovimientoCaja.objects.filter(caja=caja, ejercicio=ejercicio)
+            movimientos_banco = MovimientoBanco.objects.filter(ejercicio=ejercicio)
             
-            # Sort by date (most recent first)
-            movimientos_data.sort(key=lambda x: x['datetime_iso'], reverse=True)
+            # Format movements data (most recent first)
+            movimientos_data = [
+                format_movement_values(row, tipo)
+                for tipo, row in RegistroAjaxHandler._merge_movements(
+                    movement_values(movimientos_caja.order_by('-fecha', '-id'), 'caja'),
+                    movement_values(movimientos_banco.order_by('-fecha', '-id'), 'banco')
+                )
+            ]
             
             # Calculate summary
-            all_movimientos = list(movimientos_caja) + list(movimientos_banco)
-            resumen = calculate_movements_summary(all_movimientos)
+            resumen = aggregate_movements_summary(movimientos_caja, movimientos_banco)
             resumen['saldo_actual'] = float(caja.saldo_caja)
             
             # Get current money breakdown
@@ -1,20 +1,301 @@
 """
 Handlers for dynamic datatable operations.
 """
+import io
 import json
 import csv
+import hashlib
+import logging
+import re
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from math import ceil
+from importlib.util import find_spec
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import Paginator, Page, PageNotAnInteger, EmptyPage
 from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files import File
 from django.views import View
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-from apps.dyn_dt.models import ModelFilter, PageItems, HideShowFilter
-from apps.dyn_dt.utils import user_filter, get_model_field_names
+from apps.dyn_dt.models import ModelFilter, PageItems, HideShowFilter, TrabajoExportacion
+from apps.dyn_dt.search import get_search_backend
+from apps.dyn_dt.utils import get_datatable_options, get_model_field_names
 from cli import name_to_class, get_model_fk_values, get_model_fk
 
+logger = logging.getLogger(__name__)
+
+# Rows fetched per database round trip while streaming an export
+EXPORT_CHUNK_SIZE = 2000
+# Bytes read per iteration when serving a finished export file
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+SETTINGS_CACHE_PREFIX = 'dyn_dt:datatable_settings'
+KEYSET_CACHE_PREFIX = 'dyn_dt:keyset'
+
+
+class DatatableSettingsCache:
+    """
+    Per model path cache of the datatable configuration: the HideShowFilter
+    rows (one per field, missing ones bulk-created on load), the ModelFilter
+    rows and the PageItems size.
+    
+    Entries live in a process-local LRU (DATATABLE_SETTINGS_CACHE['MAX_PATHS']
+    paths, each reused for 'TIMEOUT' seconds). When 'CACHE_ALIAS' names a
+    shared cache, the loaded settings are stored there under a per-path
+    version token, and invalidate() replaces the token so every process
+    reloads on its next read.
+    """
+    
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        # Bumped by every invalidation, so a load racing with one is not stored
+        self._generation = 0
+    
+    @staticmethod
+    def _config():
+        return {'MAX_PATHS': 128, 'TIMEOUT': 300, 'CACHE_ALIAS': None, **getattr(settings, 'DATATABLE_SETTINGS_CACHE', {})}
+    
+    @staticmethod
+    def _version_key(aPath):
+        return f'{SETTINGS_CACHE_PREFIX}:version:{aPath}'
+    
+    def get(self, aPath, aModelClass):
+        """
+        Returns the datatable settings of a model path.
+        
+        Args:
+            aPath: Model path string
+            aModelClass: Django model class registered for the path
+            
+        Returns:
+            Dictionary with 'columns' (field name -> HideShowFilter), 'filters'
+            (list of ModelFilter) and 'items_per_page' (int or None)
+        """
+        aPath = aPath.lower()
+        config = self._config()
+        shared = caches[config['CACHE_ALIAS']] if config['CACHE_ALIAS'] else None
+        fields = tuple(field.name for field in aModelClass._meta.fields)
+        version = shared.get(self._version_key(aPath)) if shared else None
+        
+        with self._lock:
+            generation = self._generation
+            entry = self._entries.get(aPath)
+            # A changed field list (new migration) also forces a reload
+            if entry and entry['version'] == version and entry['fields'] == fields and entry['expires'] > monotonic():
+                self._entries.move_to_end(aPath)
+                return entry['data']
+        
+        data = None
+        if version is not None:
+            data = shared.get(f'{SETTINGS_CACHE_PREFIX}:{version}:{aPath}')
+            if data is not None and set(fields) - set(data['columns']):
+                data = None
+        if data is None:
+            data = self._load(aPath, fields)
+            if shared:
+                if version is None:
+                    version = uuid4().hex
+                    shared.add(self._version_key(aPath), version, None)
+                    version = shared.get(self._version_key(aPath), version)
+                shared.set(f'{SETTINGS_CACHE_PREFIX}:{version}:{aPath}', data, config['TIMEOUT'])
+        
+        with self._lock:
+            if generation == self._generation:
+                self._entries[aPath] = {
+                    'version': version,
+                    'fields': fields,
+                    'expires': monotonic() + config['TIMEOUT'],
+                    'data': data,
+                }
+                self._entries.move_to_end(aPath)
+                while len(self._entries) > config['MAX_PATHS']:
+                    self._entries.popitem(last=False)
+        return data
+    
+    @staticmethod
+    def _load(aPath, fields):
+        """Reads the settings of a path, creating the missing HideShowFilter rows in one query."""
+        columns = {column.key: column for column in HideShowFilter.objects.filter(parent=aPath).order_by('id')}
+        missing = [HideShowFilter(key=name, parent=aPath) for name in fields if name not in columns]
+        if missing:
+            for column in HideShowFilter.objects.bulk_create(missing):
+                columns[column.key] = column
+        return {
+            'columns': columns,
+            'filters': list(ModelFilter.objects.filter(parent=aPath).order_by('id')),
+            'items_per_page': PageItems.objects.filter(parent=aPath).order_by('id').values_list(
+                'items_per_page', flat=True
+            ).last(),
+        }
+    
+    def invalidate(self, aPath):
+        """
+        Drops the cached settings of a path in this process and, through the
+        shared cache, in the others. Runs after commit so readers never
+        re-cache settings from an uncommitted transaction.
+        """
+        aPath = aPath.lower()
+        
+        def drop():
+            with self._lock:
+                self._entries.pop(aPath, None)
+                self._generation += 1
+            alias = self._config()['CACHE_ALIAS']
+            if alias:
+                caches[alias].set(self._version_key(aPath), uuid4().hex, None)
+        
+        transaction.on_commit(drop)
+    
+    def clear(self):
+        """Empties the process-local LRU."""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+datatable_settings_cache = DatatableSettingsCache()
+
+
+def cached_count(queryset, timeout, key=None):
+    """
+    Counts queryset at most once per timeout seconds.
+    
+    Args:
+        queryset: QuerySet to count
+        timeout: Seconds the count is cached
+        key: Cache key (defaults to one derived from the SQL)
+        
+    Returns:
+        Row count, possibly up to timeout seconds old
+    """
+    key = key or f'{KEYSET_CACHE_PREFIX}:{hashlib.md5(str(queryset.query).encode()).hexdigest()}:count'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPage(Page):
+    """Page of a KeysetPaginator; has_next comes from the extra row fetched."""
+    
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+    
+    def has_next(self):
+        return self._has_next
+
+
+class KeysetPaginator:
+    """
+    Count-free paginator for large datatables ('pagination': 'keyset' in the
+    DYNAMIC_DATATB entry).
+    
+    Each page is fetched with LIMIT per_page + 1, so no COUNT(*) is needed to
+    know whether there is a next one. The last (order value, pk) of every page
+    served is cached, and the following page seeks past it
+    (order_field > value OR (order_field = value AND pk > pk)) instead of using
+    OFFSET; pages reached without a cached boundary fall back to OFFSET. The
+    total shown in the page links is counted at most once per count_timeout.
+    
+    It exposes the parts of Paginator/Page the datatable template uses, so the
+    template works unchanged with either paginator.
+    """
+    
+    def __init__(self, queryset, per_page, order_field=None, count_timeout=300):
+        """
+        Args:
+            queryset: Ordered queryset; keyset seeks need it ordered by
+                (order_field, 'pk')
+            per_page: Items per page
+            order_field: Non-null concrete field the queryset is ordered by,
+                or None to always use OFFSET (e.g. relevance ordering)
+            count_timeout: Seconds the total count and page boundaries are cached
+        """
+        self.object_list = queryset
+        self.per_page = int(per_page)
+        self.order_field = order_field
+        self.count_timeout = count_timeout
+        self.key = f'{KEYSET_CACHE_PREFIX}:{hashlib.md5(str(queryset.query).encode()).hexdigest()}:{self.per_page}'
+        self._known_pages = 1
+    
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list, self.count_timeout, key=f'{self.key}:count')
+    
+    @property
+    def num_pages(self):
+        # The cached count may be stale: never show fewer pages than the ones seen
+        return max(ceil(self.count / self.per_page), self._known_pages)
+    
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+    
+    def validate_number(self, number):
+        """Validates a page number like Paginator.validate_number, without an upper bound."""
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+    
+    def page(self, number):
+        """
+        Returns a page, raising PageNotAnInteger/EmptyPage like Paginator.page.
+        """
+        number = self.validate_number(number)
+        
+        queryset = self.object_list
+        boundary = cache.get(f'{self.key}:page:{number - 1}') if self.order_field and number > 1 else None
+        if boundary is not None:
+            value, pk = boundary
+            if self.order_field == 'pk':
+                queryset = queryset.filter(pk__gt=pk)
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{self.order_field}__gt': value}) | Q(**{self.order_field: value, 'pk__gt': pk})
+                )
+            rows = list(queryset[:self.per_page + 1])
+        else:
+            offset = (number - 1) * self.per_page
+            rows = list(queryset[offset:offset + self.per_page + 1])
+        
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        
+        if self.order_field and has_next:
+            last = rows[-1]
+            cache.set(
+                f'{self.key}:page:{number}',
+                (getattr(last, self.order_field) if self.order_field != 'pk' else last.pk, last.pk),
+                self.count_timeout
+            )
+        
+        page = KeysetPage(rows, number, self, has_next)
+        self._known_pages = number + 1 if has_next else number
+        if not has_next:
+            # Last page: the count is now known exactly
+            self.__dict__['count'] = (number - 1) * self.per_page + len(rows)
+            cache.set(f'{self.key}:count', self.count, self.count_timeout)
+        return page
+
 
 class DatatableHandler:
     """Handles dynamic datatable operations."""
@@ -30,12 +311,32 @@ class DatatableHandler:
         Returns:
             Tuple of (model_name, model_class) or (None, None) if not found
         """
-        if aPath in settings.DYNAMIC_DATATB.keys():
-            aModelName = settings.DYNAMIC_DATATB[aPath]
+        options = get_datatable_options(aPath)
+        if options:
+            aModelName = options['model']
             aModelClass = name_to_class(aModelName)
             return aModelName, aModelClass
         return None, None
     
+    @staticmethod
+    def search(aPath, aModelClass, queryset, value, order_by_relevance=False):
+        """
+        Applies the datatable search box with the path's search backend.
+        
+        Args:
+            aPath: Model path string
+            aModelClass: Django model class
+            queryset: QuerySet to filter
+            value: Search string (falsy to skip searching)
+            order_by_relevance: Order by match relevance when the backend ranks results
+            
+        Returns:
+            Filtered queryset
+        """
+        if not value:
+            return queryset
+        return get_search_backend(aPath, aModelClass).search(queryset, value, order_by_relevance)
+    
     @staticmethod
     def prepare_model_context(aModelClass, aPath):
         """
@@ -62,14 +363,8 @@ class DatatableHandler:
                 choices_dict[field.name] = field.choices
         
         # Get field display settings
-        field_names = []
-        for field_name in db_fields:
-            fields, created = HideShowFilter.objects.get_or_create(
-                key=field_name, 
-                parent=aPath.lower()
-            )
-            if fields.key in db_fields:
-                field_names.append(fields)
+        columns = datatable_settings_cache.get(aPath, aModelClass)['columns']
+        field_names = [columns[field_name] for field_name in db_fields]
         
         # Get field types for proper form rendering
         field_types = {
@@ -103,9 +398,11 @@ class DatatableHandler:
         Returns:
             Paginated queryset
         """
+        datatable_settings = datatable_settings_cache.get(aPath, aModelClass)
+        
         # Apply model filters
         filter_string = {}
-        filter_instance = ModelFilter.objects.filter(parent=aPath.lower())
+        filter_instance = datatable_settings['filters']
         for filter_data in filter_instance:
             if filter_data.key in db_fields: 
                 filter_string[f'{filter_data.key}__icontains'] = filter_data.value
@@ -115,16 +412,31 @@ class DatatableHandler:
         if order_by not in db_fields:
             order_by = 'id'
         
+        options = get_datatable_options(aPath)
+        keyset = options.get('pagination') == 'keyset'
+        
         # Build queryset
         queryset = aModelClass.objects.filter(**filter_string).order_by(order_by)
-        item_list = user_filter(request, queryset, db_fields, fk_fields.keys())
+        if keyset:
+            # Seeks need a unique ordering
+            queryset = queryset.order_by(order_by, 'pk')
+        item_list = DatatableHandler.search(
+            aPath, aModelClass, queryset, request.GET.get('search'),
+            order_by_relevance='order_by' not in request.GET
+        )
         
         # Apply pagination
-        page_items = PageItems.objects.filter(parent=aPath.lower()).last()
-        p_items = page_items.items_per_page if page_items else 25
+        p_items = datatable_settings['items_per_page'] or 25
         
         page = request.GET.get('page', 1)
-        paginator = Paginator(item_list, p_items)
+        if keyset:
+            paginator = KeysetPaginator(
+                item_list, p_items,
+                order_field=DatatableHandler.keyset_field(aModelClass, item_list, order_by),
+                count_timeout=options.get('count_timeout', 300)
+            )
+        else:
+            paginator = Paginator(item_list, p_items)
         
         try:
             items = paginator.page(page)
@@ -133,6 +445,25 @@ class DatatableHandler:
             return None
         
         return items, p_items, filter_instance
+    
+    @staticmethod
+    def keyset_field(aModelClass, queryset, order_by):
+        """
+        Returns the field KeysetPaginator can seek on, or None to use OFFSET.
+        
+        Seeking needs the queryset still ordered by (order_by, pk) (a search
+        backend may have replaced it with relevance) and a non-null concrete
+        column: NULLs sort differently per database and FKs sort by the
+        related model's ordering.
+        """
+        if queryset.query.order_by not in ((order_by, 'pk'), ('pk',)):
+            return None
+        field = aModelClass._meta.get_field(order_by)
+        if field.primary_key:
+            return 'pk'
+        if field.is_relation or field.null:
+            return None
+        return field.name
 
 
 class FilterHandler:
@@ -161,6 +492,7 @@ class FilterHandler:
                     key=key,
                     defaults={'value': value}
                 )
+            datatable_settings_cache.invalidate(model_name)
         
         return redirect(reverse('model_dt', args=[model_name]))
     
@@ -184,6 +516,7 @@ class FilterHandler:
             parent=model_name
         )
         filter_instance.delete()
+        datatable_settings_cache.invalidate(model_name)
         return redirect(reverse('model_dt', args=[model_name]))
     
     @staticmethod
@@ -209,6 +542,7 @@ class FilterHandler:
                     key=data.get('key'),
                     defaults={'value': data.get('value')}
                 )
+                datatable_settings_cache.invalidate(model_name)
                 
                 return JsonResponse({'message': 'Model updated successfully'})
             except (json.JSONDecodeError, IndexError, KeyError):
@@ -235,6 +569,7 @@ class FilterHandler:
                 parent=model_name,
                 defaults={'items_per_page': items}
             )
+            datatable_settings_cache.invalidate(model_name)
         return redirect(reverse('model_dt', args=[model_name]))
 
 
@@ -337,59 +672,649 @@ class CRUDHandler:
         return redirect(request.META.get('HTTP_REFERER'))
 
 
+class _Echo:
+    """File-like object whose write() returns the value, so csv.writer yields rows."""
+
+    def write(self, value):
+        return value
+
+
 class ExportHandler:
     """Handles data export operations."""
     
     @staticmethod
     def export_csv(request, aPath):
         """
-        Exports model data as CSV.
+        Streams model data as CSV.
+        
+        Only the visible columns are read, as tuples from values_list() in
+        chunks of EXPORT_CHUNK_SIZE, so memory stays flat and the first rows
+        are sent before the whole table has been read.
         
         Args:
             request: Django request object
             aPath: Model path string
             
         Returns:
-            CSV HttpResponse
+            CSV StreamingHttpResponse
         """
         _, aModelClass = DatatableHandler.get_model_data(aPath)
         if not aModelClass:
             return HttpResponse(f' > ERR: Getting ModelClass for path: {aPath}')
         
-        # Get visible fields
-        db_field_names = [field.name for field in aModelClass._meta.get_fields()]
-        fields = []
-        show_fields = HideShowFilter.objects.filter(value=False, parent=aPath.lower())
+        fields, lookups = ExportHandler.get_export_columns(aModelClass, aPath)
+        queryset = ExportHandler.get_export_queryset(request.GET, aModelClass, aPath)
+        rows = queryset.values_list(*lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        
+        writer = csv.writer(_Echo())
         
-        for field in show_fields:
-            if field.key in db_field_names:
-                fields.append(field.key)
+        def stream():
+            yield writer.writerow(fields)  # Header
+            for row in rows:
+                yield writer.writerow(row)
         
-        # Create CSV response
-        response = HttpResponse(content_type='text/csv')
+        response = StreamingHttpResponse(stream(), content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="{aPath.lower()}.csv"'
+        return response
+    
+    @staticmethod
+    def get_export_columns(aModelClass, aPath):
+        """
+        Returns the visible column names and the values_list() lookups for them.
+        
+        Columns follow the model field order, skipping the ones hidden with
+        HideShowFilter. Foreign keys are exported through a join on the
+        display field of the related model (see get_display_field).
         
-        writer = csv.writer(response)
-        writer.writerow(fields)  # Write header
+        Args:
+            aModelClass: Django model class
+            aPath: Model path string
+            
+        Returns:
+            Tuple of (column names, lookups)
+        """
+        columns = datatable_settings_cache.get(aPath, aModelClass)['columns']
+        hidden = {key for key, column in columns.items() if column.value}
+        fields, lookups = [], []
+        for field in aModelClass._meta.fields:
+            if field.name in hidden:
+                continue
+            fields.append(field.name)
+            if field.is_relation:
+                lookups.append(f'{field.name}__{ExportHandler.get_display_field(field.related_model)}')
+            else:
+                lookups.append(field.name)
+        return fields, lookups
+    
+    @staticmethod
+    def get_display_field(aModelClass):
+        """
+        Returns the field used to represent a related model in exports.
+        
+        Args:
+            aModelClass: Django model class
+            
+        Returns:
+            Its USERNAME_FIELD for user models, else the name of its first
+            CharField, or of its primary key
+        """
+        if hasattr(aModelClass, 'USERNAME_FIELD'):
+            return aModelClass.USERNAME_FIELD
+        for field in aModelClass._meta.fields:
+            if isinstance(field, models.CharField) and not field.choices:
+                return field.name
+        return aModelClass._meta.pk.name
+    
+    @staticmethod
+    def get_export_queryset(params, aModelClass, aPath):
+        """
+        Builds the filtered and ordered queryset shown in the datatable.
+        
+        Args:
+            params: Mapping with the optional 'search' and 'order_by' values
+                (request.GET, or the parameters stored in an export job)
+            aModelClass: Django model class
+            aPath: Model path string
+            
+        Returns:
+            QuerySet
+        """
+        db_fields = [field.name for field in aModelClass._meta.fields]
         
-        # Apply filters and export data
         filter_string = {}
-        filter_instance = ModelFilter.objects.filter(parent=aPath.lower())
-        for filter_data in filter_instance:
-            filter_string[f'{filter_data.key}__icontains'] = filter_data.value
+        for filter_data in datatable_settings_cache.get(aPath, aModelClass)['filters']:
+            if filter_data.key in db_fields:
+                filter_string[f'{filter_data.key}__icontains'] = filter_data.value
+        
+        # The ordering is validated up front: an invalid field would only fail
+        # once the response has started streaming
+        order_by = params.get('order_by', 'id')
+        if order_by not in db_fields:
+            order_by = 'id'
         
-        order_by = request.GET.get('order_by', 'id')
         queryset = aModelClass.objects.filter(**filter_string).order_by(order_by)
-        items = user_filter(request, queryset, db_field_names)
-        
-        # Write data rows
-        for item in items:
-            row_data = []
-            for field in fields:
-                try:
-                    row_data.append(getattr(item, field))
-                except AttributeError:
-                    row_data.append('')
-            writer.writerow(row_data)
+        return DatatableHandler.search(
+            aPath, aModelClass, queryset, params.get('search'),
+            order_by_relevance='order_by' not in params
+        )
+    
+    @staticmethod
+    def get_lookup_field(aModelClass, lookup):
+        """
+        Returns the model field a values_list() lookup reads.
         
+        Args:
+            aModelClass: Django model class
+            lookup: Field name, optionally across a relation ('fk__name')
+            
+        Returns:
+            Django model field
+        """
+        field = None
+        for part in lookup.split('__'):
+            field = aModelClass._meta.get_field(part)
+            aModelClass = field.related_model
+        return field
+
+
+class _CsvExportWriter:
+    """Writes export chunks as UTF-8 CSV."""
+    
+    content_type = 'text/csv'
+    
+    def __init__(self, fh, columns):
+        self.text = io.TextIOWrapper(fh, encoding='utf-8', newline='')
+        self.writer = csv.writer(self.text)
+        self.writer.writerow([name for name, _ in columns])
+    
+    def write(self, rows):
+        self.writer.writerows(rows)
+    
+    def close(self):
+        self.text.flush()
+        self.text.detach()
+
+
+class _XlsxExportWriter:
+    """Writes export chunks to an Excel workbook through pandas (needs openpyxl or xlsxwriter)."""
+    
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    requires = ('openpyxl', 'xlsxwriter')
+    # Rows per sheet, header included; larger exports continue on a new sheet
+    MAX_SHEET_ROWS = 1048576
+    
+    def __init__(self, fh, columns):
+        import pandas as pd
+        
+        self.pd = pd
+        self.names = [name for name, _ in columns]
+        self.excel = pd.ExcelWriter(fh)
+        self.sheet = 0
+        self._new_sheet()
+    
+    def _new_sheet(self):
+        self.sheet += 1
+        self.sheet_rows = 0
+        self._to_excel([], header=True)
+        self.sheet_rows = 1
+    
+    def _to_excel(self, rows, header=False):
+        self.pd.DataFrame.from_records(rows, columns=self.names).to_excel(
+            self.excel, sheet_name=f'Hoja{self.sheet}', startrow=self.sheet_rows, header=header, index=False
+        )
+        self.sheet_rows += len(rows)
+    
+    def write(self, rows):
+        # Excel has no time zones: datetimes are written in the local time zone
+        rows = [
+            tuple(
+                timezone.make_naive(value) if isinstance(value, datetime) and timezone.is_aware(value) else value
+                for value in row
+            )
+            for row in rows
+        ]
+        while rows:
+            if self.sheet_rows == self.MAX_SHEET_ROWS:
+                self._new_sheet()
+            room = self.MAX_SHEET_ROWS - self.sheet_rows
+            self._to_excel(rows[:room])
+            rows = rows[room:]
+    
+    def close(self):
+        self.excel.close()
+
+
+class _ParquetExportWriter:
+    """Writes export chunks as Parquet row groups (needs pyarrow)."""
+    
+    content_type = 'application/vnd.apache.parquet'
+    requires = ('pyarrow',)
+    
+    def __init__(self, fh, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        self.pa = pa
+        # The schema comes from the model fields, so it does not depend on the
+        # values of the first chunk and empty exports still get one
+        self.schema = pa.schema([(name, self.arrow_type(pa, field)) for name, field in columns])
+        self.as_text = [pa.types.is_string(f.type) for f in self.schema]
+        self.writer = pq.ParquetWriter(fh, self.schema)
+    
+    @staticmethod
+    def arrow_type(pa, field):
+        if isinstance(field, models.BooleanField):
+            return pa.bool_()
+        if isinstance(field, (models.AutoField, models.IntegerField)):
+            return pa.int64()
+        if isinstance(field, models.FloatField):
+            return pa.float64()
+        if isinstance(field, models.DecimalField):
+            return pa.decimal128(field.max_digits, field.decimal_places)
+        if isinstance(field, models.DateTimeField):
+            return pa.timestamp('us', tz='UTC')
+        if isinstance(field, models.DateField):
+            return pa.date32()
+        return pa.string()
+    
+    def write(self, rows):
+        if not rows:
+            return
+        columns = [
+            [None if value is None else str(value) for value in values] if as_text else list(values)
+            for values, as_text in zip(zip(*rows), self.as_text)
+        ]
+        self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+    
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    TrabajoExportacion.FORMATO_CSV: _CsvExportWriter,
+    TrabajoExportacion.FORMATO_XLSX: _XlsxExportWriter,
+    TrabajoExportacion.FORMATO_PARQUET: _ParquetExportWriter,
+}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ExportJobHandler:
+    """Handles background export jobs: queueing, running, progress and downloads."""
+    
+    @staticmethod
+    def available_formats():
+        """
+        Returns the export formats whose optional dependencies are installed.
+        
+        Returns:
+            List of TrabajoExportacion format codes
+        """
+        return [
+            formato for formato, writer in EXPORT_WRITERS.items()
+            if not getattr(writer, 'requires', None) or any(find_spec(module) for module in writer.requires)
+        ]
+    
+    @staticmethod
+    def create_job(request, aPath):
+        """
+        Queues an export of the datatable with its current search and ordering.
+        
+        Args:
+            request: Django request object (POST with an optional 'formato')
+            aPath: Model path string
+            
+        Returns:
+            JsonResponse with the job status, 202 when queued
+        """
+        if request.method != 'POST':
+            return JsonResponse({'success': False, 'error': 'Método no permitido'}, status=405)
+        
+        _, aModelClass = DatatableHandler.get_model_data(aPath)
+        if not aModelClass:
+            return JsonResponse({'success': False, 'error': f'Tabla no encontrada: {aPath}'}, status=404)
+        
+        formato = request.POST.get('formato', TrabajoExportacion.FORMATO_CSV)
+        if formato not in ExportJobHandler.available_formats():
+            return JsonResponse({'success': False, 'error': f'Formato no disponible: {formato}'}, status=400)
+        
+        parametros = {
+            key: request.POST.get(key, request.GET.get(key))
+            for key in ('search', 'order_by')
+            if request.POST.get(key, request.GET.get(key))
+        }
+        trabajo = TrabajoExportacion.objects.create(
+            ruta=aPath.lower(),
+            formato=formato,
+            parametros=parametros,
+            creado_por=request.user
+        )
+        return JsonResponse(ExportJobHandler.job_data(trabajo), status=202)
+    
+    @staticmethod
+    def job_status(request, job_id):
+        """
+        Returns the progress of an export job, for polling.
+        
+        Args:
+            request: Django request object
+            job_id: TrabajoExportacion ID
+            
+        Returns:
+            JsonResponse with the job status
+        """
+        return JsonResponse(ExportJobHandler.job_data(ExportJobHandler.get_job(request, job_id)))
+    
+    @staticmethod
+    def get_job(request, job_id):
+        """Returns the job if it belongs to the user (any job for staff), else 404."""
+        jobs = TrabajoExportacion.objects.all()
+        if not request.user.is_staff:
+            jobs = jobs.filter(creado_por=request.user)
+        return get_object_or_404(jobs, pk=job_id)
+    
+    @staticmethod
+    def job_data(trabajo):
+        """Serializes a job for the status endpoints."""
+        completado = trabajo.estado == TrabajoExportacion.ESTADO_COMPLETADO
+        return {
+            'success': trabajo.estado != TrabajoExportacion.ESTADO_ERROR,
+            'id': trabajo.pk,
+            'ruta': trabajo.ruta,
+            'formato': trabajo.formato,
+            'estado': trabajo.estado,
+            'progreso': trabajo.progreso(),
+            'filas_procesadas': trabajo.filas_procesadas,
+            'total_filas': trabajo.total_filas,
+            'error': trabajo.error or None,
+            'status_url': reverse('export_job_status', args=[trabajo.pk]),
+            'download_url': reverse('export_job_download', args=[trabajo.pk]) if completado else None,
+        }
+    
+    @staticmethod
+    def run_job(trabajo):
+        """
+        Writes the export file of a claimed job in EXPORT_CHUNK_SIZE chunks,
+        updating its progress after each one. Used by procesar_exportaciones.
+        
+        Args:
+            trabajo: TrabajoExportacion in the 'en_curso' state
+            
+        Returns:
+            True if the file was written, False if the job failed
+        """
+        jobs = TrabajoExportacion.objects.filter(pk=trabajo.pk)
+        try:
+            _, aModelClass = DatatableHandler.get_model_data(trabajo.ruta)
+            if not aModelClass:
+                raise ValueError(f'La tabla {trabajo.ruta} no está en DYNAMIC_DATATB')
+            
+            fields, lookups = ExportHandler.get_export_columns(aModelClass, trabajo.ruta)
+            columns = [
+                (name, ExportHandler.get_lookup_field(aModelClass, lookup))
+                for name, lookup in zip(fields, lookups)
+            ]
+            queryset = ExportHandler.get_export_queryset(trabajo.parametros, aModelClass, trabajo.ruta)
+            trabajo.total_filas = queryset.count()
+            jobs.update(total_filas=trabajo.total_filas, latido_en=timezone.now())
+            
+            with tempfile.TemporaryFile() as fh:
+                writer = EXPORT_WRITERS[trabajo.formato](fh, columns)
+                chunk = []
+                for row in queryset.values_list(*lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                    chunk.append(row)
+                    if len(chunk) == EXPORT_CHUNK_SIZE:
+                        ExportJobHandler._write_chunk(trabajo, writer, chunk)
+                        chunk = []
+                ExportJobHandler._write_chunk(trabajo, writer, chunk)
+                writer.close()
+                
+                fh.seek(0)
+                trabajo.archivo.save(f'{trabajo.pk}-{trabajo.nombre_archivo()}', File(fh), save=False)
+        except Exception as exc:
+            logger.exception('Export job %s failed', trabajo.pk)
+            trabajo.estado = TrabajoExportacion.ESTADO_ERROR
+            trabajo.error = str(exc) or exc.__class__.__name__
+            trabajo.completado_en = timezone.now()
+            jobs.update(estado=trabajo.estado, error=trabajo.error, completado_en=trabajo.completado_en)
+            return False
+        
+        trabajo.estado = TrabajoExportacion.ESTADO_COMPLETADO
+        trabajo.completado_en = timezone.now()
+        jobs.update(estado=trabajo.estado, archivo=trabajo.archivo.name, completado_en=trabajo.completado_en)
+        return True
+    
+    @staticmethod
+    def _write_chunk(trabajo, writer, chunk):
+        """Writes a chunk and records the progress with a heartbeat (see procesar_exportaciones --reencolar-minutos)."""
+        writer.write(chunk)
+        trabajo.filas_procesadas += len(chunk)
+        trabajo.latido_en = timezone.now()
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(
+            filas_procesadas=trabajo.filas_procesadas, latido_en=trabajo.latido_en
+        )
+    
+    @staticmethod
+    def download(request, job_id):
+        """
+        Serves a finished export, honouring single byte ranges so interrupted
+        downloads can resume (Range, with If-Range against the ETag).
+        
+        Args:
+            request: Django request object
+            job_id: TrabajoExportacion ID
+            
+        Returns:
+            StreamingHttpResponse (200 or 206), 416 for unsatisfiable ranges,
+            or a 409 JsonResponse if the job has not finished
+        """
+        trabajo = ExportJobHandler.get_job(request, job_id)
+        if trabajo.estado != TrabajoExportacion.ESTADO_COMPLETADO or not trabajo.archivo:
+            return JsonResponse({'success': False, 'error': 'La exportación no ha terminado'}, status=409)
+        
+        size = trabajo.archivo.size
+        etag = f'"exportacion-{trabajo.pk}-{int(trabajo.completado_en.timestamp())}"'
+        start, end, status = 0, size - 1, 200
+        
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+            byte_range = ExportJobHandler.parse_range(range_header, size)
+            if byte_range == ():
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+            if byte_range:
+                start, end = byte_range
+                status = 206
+        
+        fh = trabajo.archivo.open('rb')
+        fh.seek(start)
+        response = StreamingHttpResponse(
+            ExportJobHandler._read_range(fh, end - start + 1),
+            status=status,
+            content_type=EXPORT_WRITERS[trabajo.formato].content_type
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{trabajo.nombre_archivo()}"'
+        if status == 206:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
         return response
+    
+    @staticmethod
+    def parse_range(header, size):
+        """
+        Parses a single-range 'bytes=' Range header.
+        
+        Args:
+            header: Range header value
+            size: File size in bytes
+            
+        Returns:
+            (start, end) inclusive, () if the range is unsatisfiable, or None to
+            ignore the header (malformed or multiple ranges) and send the whole file
+        """
+        match = _RANGE_RE.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            return (max(size - length, 0), size - 1) if length and size else ()
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            return ()
+        return start, end
+    
+    @staticmethod
+    def _read_range(fh, length):
+        try:
+            while length > 0:
+                block = fh.read(min(DOWNLOAD_BLOCK_SIZE, length))
+                if not block:
+                    break
+                length -= len(block)
+                yield block
+        finally:
+            fh.close()
+
+
+class DataTablesHandler:
+    """
+    Server-side processing endpoint for the DataTables client
+    (https://datatables.net/manual/server-side) over DYNAMIC_DATATB models.
+    """
+    
+    # Largest page served, also used for length=-1 ("All")
+    MAX_LENGTH = 1000
+    
+    @staticmethod
+    def handle(request, aPath):
+        """
+        Returns one page of the table as compact row arrays.
+        
+        Reads draw, start, length, search[value], order[i][column|dir] and
+        columns[i][data|searchable|orderable|search][value]. Column 'data'
+        values are model field names; without columns, the visible columns
+        are returned. The saved ModelFilter rows of the path still apply.
+        
+        Args:
+            request: Django request object
+            aPath: Model path string
+            
+        Returns:
+            JsonResponse with draw, recordsTotal, recordsFiltered, columns and data
+        """
+        _, aModelClass = DatatableHandler.get_model_data(aPath)
+        if not aModelClass:
+            return JsonResponse({'error': f'Unknown table: {aPath}'}, status=404)
+        
+        params = request.GET
+        try:
+            draw = int(params.get('draw', 0))
+            start = max(int(params.get('start', 0)), 0)
+            length = int(params.get('length', 10))
+            columns = DataTablesHandler.parse_columns(params, aModelClass, aPath)
+            order = DataTablesHandler.parse_order(params, columns)
+        except (TypeError, ValueError, IndexError) as exc:
+            return JsonResponse({'draw': params.get('draw'), 'error': f'Invalid parameters: {exc}'}, status=400)
+        if length < 0 or length > DataTablesHandler.MAX_LENGTH:
+            length = DataTablesHandler.MAX_LENGTH
+        
+        datatable_settings = datatable_settings_cache.get(aPath, aModelClass)
+        db_fields = [field.name for field in aModelClass._meta.fields]
+        filter_string = {
+            f'{filter_data.key}__icontains': filter_data.value
+            for filter_data in datatable_settings['filters']
+            if filter_data.key in db_fields
+        }
+        base = aModelClass.objects.filter(**filter_string)
+        
+        queryset = base
+        search = params.get('search[value]', '').strip()
+        filtered = bool(search)
+        for column in columns:
+            if column['searchable'] and column['search']:
+                queryset = queryset.filter(**{f"{column['lookup']}__icontains": column['search']})
+                filtered = True
+        queryset = queryset.order_by(*order, 'pk')
+        queryset = DatatableHandler.search(aPath, aModelClass, queryset, search, order_by_relevance=not order)
+        
+        # 'keyset' paths avoid a COUNT(*) per request here too
+        options = get_datatable_options(aPath)
+        if options.get('pagination') == 'keyset':
+            count_timeout = options.get('count_timeout', 300)
+            records_total = cached_count(base, count_timeout)
+            records_filtered = cached_count(queryset, count_timeout) if filtered else records_total
+        else:
+            records_total = base.count()
+            records_filtered = queryset.count() if filtered else records_total
+        
+        lookups = [column['lookup'] for column in columns]
+        rows = queryset.values_list(*lookups)[start:start + length]
+        return JsonResponse({
+            'draw': draw,
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'columns': [column['data'] for column in columns],
+            'data': [list(row) for row in rows],
+        })
+    
+    @staticmethod
+    def parse_columns(params, aModelClass, aPath):
+        """
+        Reads the columns[i][...] parameters.
+        
+        Returns:
+            List of dicts with data, lookup (FKs resolved to their display
+            field), searchable, orderable and search
+        """
+        fields = {field.name: field for field in aModelClass._meta.fields}
+        names = []
+        index = 0
+        while f'columns[{index}][data]' in params:
+            names.append(params[f'columns[{index}][data]'])
+            index += 1
+        if not names:
+            names = ExportHandler.get_export_columns(aModelClass, aPath)[0]
+        
+        columns = []
+        for index, name in enumerate(names):
+            if name not in fields:
+                raise ValueError(f'unknown column {name!r}')
+            field = fields[name]
+            columns.append({
+                'data': name,
+                'lookup': f'{name}__{ExportHandler.get_display_field(field.related_model)}' if field.is_relation else name,
+                'searchable': params.get(f'columns[{index}][searchable]', 'true') == 'true',
+                'orderable': params.get(f'columns[{index}][orderable]', 'true') == 'true',
+                'search': params.get(f'columns[{index}][search][value]', '').strip(),
+            })
+        return columns
+    
+    @staticmethod
+    def parse_order(params, columns):
+        """
+        Reads the order[i][column|dir] parameters.
+        
+        Returns:
+            List of order_by() expressions over the orderable columns
+        """
+        order = []
+        index = 0
+        while f'order[{index}][column]' in params:
+            col = int(params[f'order[{index}][column]'])
+            # A negative index would silently order by a column counted from the end
+            if col < 0 or col >= len(columns):
+                raise ValueError(f'Invalid order column: {col}')
+            column = columns[col]
+            if column['orderable']:
+                prefix = '-' if params.get(f'order[{index}][dir]') == 'desc' else ''
+                order.append(f"{prefix}{column['lookup']}")
+            index += 1
+        return order
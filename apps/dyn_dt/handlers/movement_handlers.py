@@ -8,11 +8,11 @@ from decimal import Decimal
 
 from apps.dyn_dt.models import (
     Caja, Concepto, MovimientoCaja, MovimientoBanco, 
-    MovimientoDinero, DesgloseCaja, Ejercicio, Turno, Campamento, CuentaBancaria, ViaMovimientoBanco
+    MovimientoDinero, Ejercicio, Turno, Campamento, CuentaBancaria, ViaMovimientoBanco,
+    sincronizacion_saldo_diferida
 )
 from apps.dyn_dt.forms import DesgloseDineroForm
 from apps.dyn_dt.utils import combine_date_time
-from django.contrib.contenttypes.models import ContentType
 
 
 
@@ -242,16 +242,7 @@ class MovementCreator:
         desglose_form = DesgloseDineroForm(request.POST)
         if desglose_form.is_valid():
             movimientos_dinero_data = desglose_form.get_movimientos_dinero_data()
-            content_type = ContentType.objects.get_for_model(movimiento)
-            for mov_data in movimientos_dinero_data:
-                MovimientoDinero.objects.create(
-                    content_type=content_type,
-                    object_id=movimiento.id,
-                    denominacion=mov_data['denominacion'],
-                    cantidad_entrada=mov_data['cantidad_entrada'],
-                    cantidad_salida=mov_data['cantidad_salida'],
-                    creado_por=request.user
-                )
+            MovimientoDinero.crear_en_bloque(movimiento, movimientos_dinero_data, usuario=request.user)
 
 
 class MovementUpdater:
@@ -320,48 +311,18 @@ class MovementUpdater:
         cantidad_real_nueva = movimiento.cantidad_real()
         diferencia = cantidad_real_nueva - cantidad_real_original
         
-        ejercicio = movimiento.ejercicio
-        ejercicio.saldo_banco += diferencia
-        ejercicio.save()
+        Ejercicio.ajustar_saldo_banco(movimiento.ejercicio_id, diferencia)
     
     @staticmethod
     def _update_cash_movement_breakdown(movimiento, request):
-        """Updates cash movement money breakdown."""
-        # Revert original money breakdown
-        for mov_dinero in movimiento.movimientos_dinero.all():
-            desglose = DesgloseCaja.objects.filter(
-                caja=movimiento.caja,
-                denominacion=mov_dinero.denominacion
-            ).first()
-            
-            if desglose:
-                desglose.cantidad -= mov_dinero.cantidad_neta()
-                if desglose.cantidad < 0:
-                    desglose.cantidad = 0
-                desglose.save()
-        
-        # Delete existing MovimientoDinero records
-        movimiento.movimientos_dinero.all().delete()
-        
-        # Create new MovimientoDinero records
+        """Replaces the money breakdown of a cash movement and re-syncs the caja saldo once."""
         desglose_form = DesgloseDineroForm(request.POST)
-        if desglose_form.is_valid():
-            movimientos_dinero_data = desglose_form.get_movimientos_dinero_data()
-            content_type = ContentType.objects.get_for_model(movimiento)
-            for mov_data in movimientos_dinero_data:
-                MovimientoDinero.objects.create(
-                    content_type=content_type,
-                    object_id=movimiento.id,
-                    denominacion=mov_data['denominacion'],
-                    cantidad_entrada=mov_data['cantidad_entrada'],
-                    cantidad_salida=mov_data['cantidad_salida'],
-                    creado_por=request.user
-                )
-        else:
+        if not desglose_form.is_valid():
             raise ValidationError('El desglose de dinero es inválido o está incompleto')
-        
-        # Recalculate caja saldo
-        movimiento.caja.recalcular_saldo_caja()
-        movimiento.caja.recalcular_saldo_caja()
-        raise ValidationError('El desglose de dinero es inválido o está incompleto')
-        
+
+        with sincronizacion_saldo_diferida():
+            # Revert and delete the original breakdown, then create the new one in bulk
+            MovimientoDinero.eliminar_de_movimiento(movimiento)
+            MovimientoDinero.crear_en_bloque(
+                movimiento, desglose_form.get_movimientos_dinero_data(), usuario=request.user
+            )
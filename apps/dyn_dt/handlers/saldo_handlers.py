@@ -0,0 +1,346 @@
+"""
+Analytics service and AJAX handler for the saldo view.
+
+The movement-derived part of the payload (movement list, totals, concept
+breakdown and running balance) is built with grouped/windowed queries and
+cached per ejercicio. Cache entries are dropped by the signal receivers at
+the bottom of this module, which are connected in DynDtConfig.ready().
+
+Invalidation only reaches the processes that share the cache named by
+SALDO_ANALYTICS_CACHE['CACHE_ALIAS']. With the default LocMemCache every
+worker keeps its own copy, so a write served by one worker leaves the others
+serving stale analytics for up to 'TIMEOUT' seconds; multi-process
+deployments must point the alias at a shared backend (Redis, Memcached,
+database cache).
+"""
+import heapq
+from decimal import Decimal
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Q, Sum, Window
+from django.db.models.signals import post_save, post_delete
+from django.http import JsonResponse
+from django.utils import timezone
+
+from apps.dyn_dt.models import (
+    Caja, Concepto, DesgloseCaja, Ejercicio, Movimiento, MovimientoBanco, MovimientoCaja, Turno
+)
+from apps.dyn_dt.utils import bucket_balance_evolution, choose_granularity, get_bucket_start
+
+
+CACHE_PREFIX = 'dyn_dt:saldo'
+CACHE_VERSION_KEY = f'{CACHE_PREFIX}:version'
+CENTS = Decimal('0.01')
+
+
+class SaldoAnalytics:
+    """Builds the JSON payload of the saldo view with a flat number of queries."""
+
+    MOVEMENT_FIELDS = (
+        'id', 'fecha', 'descripcion', 'cantidad', 'turno_id', 'turno__nombre',
+        'concepto_id', 'concepto__nombre', 'concepto__es_gasto',
+    )
+
+    @staticmethod
+    def get_payload(ejercicio, granularidad=None):
+        """
+        Returns the saldo payload for an ejercicio.
+
+        Args:
+            ejercicio: Ejercicio instance
+            granularidad: 'movimiento', 'dia', 'semana', 'mes' or None/'auto'
+                to pick it from the date span of the movements
+
+        Returns:
+            dict with the same keys the saldo view has always returned,
+            plus the granularity used for balance_evolution
+        """
+        movements = SaldoAnalytics.get_movement_analytics(ejercicio.id)
+        saldo_actual = ejercicio.calcular_saldo_total()
+        cajas = list(Caja.objects.values('id', 'nombre', 'saldo_caja'))
+
+        serie = movements['serie']
+        granularidad = choose_granularity(
+            granularidad, serie[0][0] if serie else None, serie[-1][0] if serie else None
+        )
+        if granularidad == 'movimiento':
+            # Absolute running balance = current balance + cached offset from the end
+            balance_evolution = [
+                {**point, 'balance': float(saldo_actual + point['balance'])}
+                for point in movements['balance_evolution']
+            ]
+        else:
+            balance_evolution = bucket_balance_evolution(
+                (get_bucket_start(fecha, granularidad), importe, saldo_actual + offset)
+                for fecha, importe, offset in serie
+            )
+
+        return {
+            'ejercicio': {
+                'id': ejercicio.id,
+                'nombre': ejercicio.nombre,
+                'año': ejercicio.año
+            },
+            'movimientos': movements['movimientos'],
+            'resumen': {
+                **movements['resumen'],
+                'saldo_actual': float(saldo_actual),
+            },
+            'balance_evolution': balance_evolution,
+            'granularidad': granularidad,
+            'concept_data': movements['concept_data'],
+            'desglose_actual': SaldoAnalytics.get_desglose_actual(),
+            'recent_movements': movements['movimientos'][:10],
+            'caja_info': {
+                'cajas': [{
+                    'id': caja['id'],
+                    'nombre': caja['nombre'],
+                    'saldo_actual': float(caja['saldo_caja'])
+                } for caja in cajas],
+                'saldo_banco': float(ejercicio.saldo_banco),
+                'saldo_actual': float(saldo_actual)
+            },
+        }
+
+    @staticmethod
+    def _config():
+        return {'CACHE_ALIAS': 'default', 'TIMEOUT': 60 * 60, **getattr(settings, 'SALDO_ANALYTICS_CACHE', {})}
+
+    @staticmethod
+    def _cache():
+        return caches[SaldoAnalytics._config()['CACHE_ALIAS']]
+
+    @staticmethod
+    def get_movement_analytics(ejercicio_id):
+        """Cached wrapper around build_movement_analytics."""
+        cache = SaldoAnalytics._cache()
+        key = SaldoAnalytics.cache_key(ejercicio_id)
+        data = cache.get(key)
+        if data is None:
+            data = SaldoAnalytics.build_movement_analytics(ejercicio_id)
+            cache.set(key, data, SaldoAnalytics._config()['TIMEOUT'])
+        return data
+
+    @staticmethod
+    def build_movement_analytics(ejercicio_id):
+        """
+        Builds the movement-derived part of the payload.
+
+        balance_evolution stores each point's balance as an offset from the
+        ejercicio's final balance, so the cached value stays valid when only
+        earlier ejercicios change. serie keeps (date, amount, offset) per
+        movement for the bucketed chart modes.
+        """
+        caja_rows = SaldoAnalytics._movement_rows(
+            MovimientoCaja, ejercicio_id, 'caja_id', 'caja__nombre', 'justificante'
+        )
+        banco_rows = SaldoAnalytics._movement_rows(
+            MovimientoBanco, ejercicio_id, 'referencia_bancaria'
+        )
+
+        # Both lists come ordered by (fecha, id); merge them into one timeline
+        timeline = list(heapq.merge(
+            (('caja', row) for row in caja_rows),
+            (('banco', row) for row in banco_rows),
+            key=lambda item: item[1]['fecha']
+        ))
+        total = (caja_rows[-1]['acumulado'] if caja_rows else Decimal('0.00')) + \
+            (banco_rows[-1]['acumulado'] if banco_rows else Decimal('0.00'))
+
+        balance_evolution = []
+        serie = []
+        acumulado = {'caja': Decimal('0.00'), 'banco': Decimal('0.00')}
+        movimientos = []
+        for tipo, row in timeline:
+            acumulado[tipo] = row['acumulado']
+            # SQLite returns window sums as floats; round back to cents
+            offset = (acumulado['caja'] + acumulado['banco'] - total).quantize(CENTS)
+            serie.append((timezone.localtime(row['fecha']).date(), row['importe'], offset))
+            movimiento = SaldoAnalytics._format_movement(tipo, row)
+            movimientos.append(movimiento)
+            balance_evolution.append({
+                'fecha': movimiento['fecha'],
+                'balance': offset,
+                'movimiento': float(row['importe']),
+                'tipo': tipo,
+                'concepto': movimiento['concepto'],
+            })
+        movimientos.reverse()
+
+        return {
+            'movimientos': movimientos,
+            'resumen': SaldoAnalytics._build_resumen(ejercicio_id, len(movimientos)),
+            'balance_evolution': balance_evolution,
+            'serie': serie,
+            'concept_data': SaldoAnalytics._build_concept_data(ejercicio_id),
+        }
+
+    @staticmethod
+    def get_desglose_actual():
+        """Current breakdown of every caja, in one query."""
+        rows = DesgloseCaja.objects.order_by('-caja__nombre', '-denominacion__valor').values_list(
+            'caja__nombre', 'denominacion__valor', 'denominacion__es_billete', 'cantidad'
+        )
+        return [{
+            'caja': caja,
+            'valor': float(valor),
+            'es_billete': es_billete,
+            'cantidad': cantidad,
+            'valor_total': float(cantidad * valor)
+        } for caja, valor, es_billete, cantidad in rows]
+
+    @staticmethod
+    def _movement_rows(model, ejercicio_id, *extra_fields):
+        """Movements of one table with their signed amount and running total (window)."""
+        orden = [F('fecha').asc(), F('id').asc()]
+        return list(
+            model.objects.filter(ejercicio_id=ejercicio_id)
+            .annotate(
+                importe=Movimiento.expresion_cantidad_real(),
+                acumulado=Window(Sum(Movimiento.expresion_cantidad_real()), order_by=orden),
+            )
+            .order_by(*orden)
+            .values(*SaldoAnalytics.MOVEMENT_FIELDS, *extra_fields, 'importe', 'acumulado')
+        )
+
+    @staticmethod
+    def _format_movement(tipo, row):
+        """Same dict the saldo view has always emitted for each movement."""
+        es_caja = tipo == 'caja'
+        return {
+            'id': row['id'],
+            'tipo': tipo,
+            'fecha': row['fecha'].strftime('%Y-%m-%d'),
+            'fecha_display': row['fecha'].strftime('%d/%m/%Y %H:%M'),
+            'datetime_iso': row['fecha'].isoformat(),
+            'turno': row['turno__nombre'] if row['turno_id'] or es_caja else 'N/A',
+            'turno_id': row['turno_id'],
+            'concepto': row['concepto__nombre'],
+            'concepto_id': row['concepto_id'],
+            'descripcion': row['descripcion'],
+            'cantidad': float(row['cantidad']),
+            'es_gasto': row['concepto__es_gasto'],
+            'justificante': row['justificante'] if es_caja else '',
+            'caja': row['caja__nombre'] if es_caja else None,
+            'caja_id': row['caja_id'] if es_caja else None,
+            'referencia_bancaria': None if es_caja else row['referencia_bancaria']
+        }
+
+    @staticmethod
+    def _build_resumen(ejercicio_id, total_movimientos):
+        """Income/expense totals with one conditional aggregate per table."""
+        total_ingresos = Decimal('0.00')
+        total_gastos = Decimal('0.00')
+        for model in (MovimientoCaja, MovimientoBanco):
+            totales = model.objects.filter(ejercicio_id=ejercicio_id).aggregate(
+                ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+                gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+            )
+            total_ingresos += totales['ingresos'] or 0
+            total_gastos += totales['gastos'] or 0
+        return {
+            'total_ingresos': float(total_ingresos),
+            'total_gastos': float(total_gastos),
+            'total_movimientos': total_movimientos
+        }
+
+    @staticmethod
+    def _build_concept_data(ejercicio_id):
+        """Totals per concepto with one grouped query per table."""
+        totales = {}
+        for model in (MovimientoCaja, MovimientoBanco):
+            rows = model.objects.filter(ejercicio_id=ejercicio_id).order_by().values(
+                'concepto__nombre', 'concepto__es_gasto'
+            ).annotate(total=Sum('cantidad'))
+            for row in rows:
+                clave = (row['concepto__nombre'], row['concepto__es_gasto'])
+                totales[clave] = totales.get(clave, 0) + row['total']
+
+        concept_data = {}
+        for (nombre, es_gasto), total in sorted(totales.items()):
+            if total > 0:
+                concept_data[nombre] = {
+                    'total': float(total),
+                    'tipo': 'gasto' if es_gasto else 'ingreso'
+                }
+        return concept_data
+
+    @staticmethod
+    def cache_key(ejercicio_id):
+        cache = SaldoAnalytics._cache()
+        version = cache.get(CACHE_VERSION_KEY)
+        if version is None:
+            version = uuid4().hex
+            cache.add(CACHE_VERSION_KEY, version, None)
+            version = cache.get(CACHE_VERSION_KEY, version)
+        return f'{CACHE_PREFIX}:{version}:{ejercicio_id}'
+
+    @staticmethod
+    def invalidate(ejercicio_id=None):
+        """
+        Drops the cached analytics of one ejercicio, or of all of them when
+        ejercicio_id is None. Runs after commit so readers never re-cache
+        data from an uncommitted transaction.
+        """
+        cache = SaldoAnalytics._cache()
+        if ejercicio_id is None:
+            transaction.on_commit(lambda: cache.set(CACHE_VERSION_KEY, uuid4().hex, None))
+        else:
+            transaction.on_commit(lambda: cache.delete(SaldoAnalytics.cache_key(ejercicio_id)))
+
+
+class SaldoAjaxHandler:
+    """Handles AJAX requests for the saldo view."""
+
+    @staticmethod
+    def handle_get_saldo(request):
+        """
+        Returns charts, totals and breakdowns for an ejercicio.
+
+        Args:
+            request: Django request object with ejercicio_id and optional
+                granularidad ('movimiento', 'dia', 'semana', 'mes', 'auto') parameters
+
+        Returns:
+            JsonResponse with the saldo payload
+        """
+        ejercicio_id = request.GET.get('ejercicio_id')
+        if not ejercicio_id:
+            return JsonResponse({'success': False, 'error': 'Ejercicio ID requerido'})
+
+        try:
+            ejercicio = Ejercicio.objects.get(id=ejercicio_id)
+        except Ejercicio.DoesNotExist:
+            return JsonResponse({'success': False, 'error': 'Ejercicio no encontrado'})
+
+        payload = SaldoAnalytics.get_payload(ejercicio, request.GET.get('granularidad'))
+        return JsonResponse({'success': True, **payload})
+
+
+# ================================
+# CACHE INVALIDATION
+# ================================
+
+def invalidar_saldo_movimiento(sender, instance, **kwargs):
+    """A movement only affects its own ejercicio (and the one it was moved from)."""
+    SaldoAnalytics.invalidate(instance.ejercicio_id)
+    estado_anterior = getattr(instance, '_estado_anterior', None)
+    if estado_anterior and estado_anterior['ejercicio_id'] != instance.ejercicio_id:
+        SaldoAnalytics.invalidate(estado_anterior['ejercicio_id'])
+
+
+def invalidar_saldo_catalogo(sender, instance, **kwargs):
+    """Names of conceptos, turnos, cajas or ejercicios appear in every cached payload."""
+    SaldoAnalytics.invalidate()
+
+
+def connect_signals():
+    for model in (MovimientoCaja, MovimientoBanco):
+        post_save.connect(invalidar_saldo_movimiento, sender=model, dispatch_uid=f'saldo_analytics_{model.__name__}_save')
+        post_delete.connect(invalidar_saldo_movimiento, sender=model, dispatch_uid=f'saldo_analytics_{model.__name__}_delete')
+    for model in (Concepto, Turno, Caja, Ejercicio):
+        post_save.connect(invalidar_saldo_catalogo, sender=model, dispatch_uid=f'saldo_analytics_{model.__name__}_save')
+        post_delete.connect(invalidar_saldo_catalogo, sender=model, dispatch_uid=f'saldo_analytics_{model.__name__}_delete')
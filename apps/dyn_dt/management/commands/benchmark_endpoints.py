@@ -0,0 +1,198 @@
+"""
+Comando de gestión Django para medir los endpoints con datos sintéticos y compararlos con una línea base.
+Uso: python manage.py benchmark_endpoints [--movimientos 20000] [--repeticiones 20] [--guardar-baseline]
+
+Crea una base de datos de pruebas, la llena con generar_datos_sinteticos y pide cada
+endpoint (AJAX de saldo, tablas, cajas y registro, datatable y API dinámicas) con el
+cliente de pruebas de Django. Para cada uno registra el número de consultas y las
+latencias p50/p95, y los compara con la línea base guardada.
+
+La línea base del repositorio solo guarda el número de consultas, que no depende de la
+máquina. Para vigilar también las latencias, guarda una línea base local con
+--baseline <fichero fuera del repositorio> --guardar-baseline --con-latencias.
+"""
+
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from apps.dyn_dt.models import Caja, Campamento, Ejercicio
+
+BASELINE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+
+class Command(BaseCommand):
+    help = 'Mide consultas y latencias p50/p95 de los endpoints y las compara con la línea base'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movimientos', type=int, default=20000, help='Movimientos sintéticos a generar')
+        parser.add_argument('--productos', type=int, default=2000, help='Productos para la datatable y la API')
+        parser.add_argument('--repeticiones', type=int, default=20, help='Peticiones medidas por endpoint')
+        parser.add_argument('--calentamiento', type=int, default=2, help='Peticiones previas sin medir')
+        parser.add_argument('--semilla', type=int, default=2025, help='Semilla de los datos aleatorios')
+        parser.add_argument(
+            '--baseline',
+            default=str(BASELINE),
+            help='Fichero JSON con la línea base',
+        )
+        parser.add_argument(
+            '--guardar-baseline',
+            action='store_true',
+            help='Guardar los resultados como nueva línea base',
+        )
+        parser.add_argument(
+            '--con-latencias',
+            action='store_true',
+            help='Guardar también p50/p95 en la línea base (solo para líneas base locales)',
+        )
+        parser.add_argument(
+            '--tolerancia',
+            type=float,
+            default=0.25,
+            help='Aumento relativo de p95 tolerado antes de marcar una regresión (si la línea base tiene latencias)',
+        )
+        parser.add_argument(
+            '--estricto',
+            action='store_true',
+            help='Terminar con error si hay regresiones',
+        )
+
+    def handle(self, *args, **options):
+        volumenes = {
+            'movimientos': options['movimientos'],
+            'productos': options['productos'],
+            'semilla': options['semilla'],
+        }
+
+        setup_test_environment()
+        nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command(
+                'generar_datos_sinteticos', movimientos=options['movimientos'],
+                productos=options['productos'], semilla=options['semilla'], stdout=self.stdout
+            )
+            cliente = Client()
+            cliente.force_login(User.objects.create_superuser('benchmark', password=None))
+            resultados = {
+                nombre: self.medir(cliente, url, parametros, options['calentamiento'], options['repeticiones'])
+                for nombre, url, parametros in self.endpoints()
+            }
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+
+        ruta = Path(options['baseline'])
+        baseline = json.loads(ruta.read_text()) if ruta.exists() else None
+        regresiones = self.informe(resultados, baseline, volumenes, options['tolerancia'])
+
+        if options['guardar_baseline']:
+            endpoints = resultados if options['con_latencias'] else {
+                nombre: {'consultas': actual['consultas']} for nombre, actual in resultados.items()
+            }
+            ruta.write_text(json.dumps(
+                {'volumenes': volumenes, 'endpoints': endpoints}, indent=2, ensure_ascii=False
+            ) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'✅ Línea base guardada en {ruta}'))
+        if regresiones and options['estricto']:
+            raise CommandError(f'{regresiones} regresiones respecto a la línea base')
+
+    def endpoints(self):
+        """(nombre, url, parámetros GET) de cada endpoint medido."""
+        ejercicio = Ejercicio.objects.order_by('-año').first()
+        campamento = Campamento.objects.order_by('id').first()
+        caja = Caja.objects.order_by('id').first()
+        return [
+            ('saldo', reverse('saldo'), {'ajax': 'true', 'ejercicio_id': ejercicio.pk}),
+            ('tables', reverse('tables'), {
+                'ajax': 'true', 'ejercicio_id': ejercicio.pk, 'campamento_id': campamento.pk
+            }),
+            ('cajas', reverse('cajas'), {'ajax': 'true', 'ejercicio_id': ejercicio.pk}),
+            ('cajas_movimientos_dinero', reverse('cajas'), {
+                'ajax': 'true', 'action': 'get_movimientos_dinero', 'agrupar': 'denominacion',
+                'caja_id': caja.pk, 'ejercicio_id': ejercicio.pk
+            }),
+            ('cajas_graficos', reverse('cajas'), {
+                'ajax': 'true', 'action': 'get_graficos', 'caja_id': caja.pk, 'ejercicio_id': ejercicio.pk
+            }),
+            ('registro_pagina', reverse('registro'), {
+                'ajax': 'true', 'get_ejercicio_movimientos': 'true', 'ejercicio_id': ejercicio.pk, 'limit': 100
+            }),
+            ('registro_completo', reverse('registro'), {
+                'ajax': 'true', 'get_ejercicio_movimientos': 'true', 'ejercicio_id': ejercicio.pk
+            }),
+            ('datatable_product', reverse('model_dt', args=['product']), {}),
+            ('api_product', reverse('model_api', args=['product']), {}),
+        ]
+
+    def medir(self, cliente, url, parametros, calentamiento, repeticiones):
+        for _ in range(calentamiento):
+            cliente.get(url, parametros)
+
+        tiempos, consultas = [], []
+        for _ in range(repeticiones):
+            with CaptureQueriesContext(connection) as capturadas:
+                inicio = time.perf_counter()
+                respuesta = cliente.get(url, parametros)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            if respuesta.status_code != 200:
+                raise CommandError(f'{url} respondió {respuesta.status_code}')
+            consultas.append(len(capturadas.captured_queries))
+
+        percentiles = statistics.quantiles(tiempos, n=20, method='inclusive') if len(tiempos) > 1 else tiempos * 19
+        return {
+            'consultas': max(consultas),
+            'p50_ms': round(statistics.median(tiempos), 2),
+            'p95_ms': round(percentiles[18], 2),
+        }
+
+    def informe(self, resultados, baseline, volumenes, tolerancia):
+        """Imprime los resultados frente a la línea base y devuelve el número de regresiones."""
+        if baseline is None:
+            self.stdout.write(self.style.WARNING('No hay línea base: solo se muestran los resultados'))
+        elif baseline['volumenes'] != volumenes:
+            self.stdout.write(self.style.WARNING(
+                f'La línea base se midió con otros volúmenes ({baseline["volumenes"]}): compara con cautela'
+            ))
+        anteriores = baseline['endpoints'] if baseline else {}
+
+        regresiones = 0
+        self.stdout.write(f'\n{"Endpoint":<26} {"Consultas":>10} {"p50 ms":>10} {"p95 ms":>10}')
+        for nombre, actual in resultados.items():
+            self.stdout.write(
+                f'{nombre:<26} {actual["consultas"]:>10} {actual["p50_ms"]:>10.2f} {actual["p95_ms"]:>10.2f}'
+            )
+            anterior = anteriores.get(nombre)
+            if anterior is None:
+                continue
+            if 'p95_ms' in anterior:
+                self.stdout.write(
+                    f'{"  línea base":<26} {anterior["consultas"]:>10} {anterior["p50_ms"]:>10.2f} {anterior["p95_ms"]:>10.2f}'
+                )
+            else:
+                self.stdout.write(f'{"  línea base":<26} {anterior["consultas"]:>10}')
+            if actual['consultas'] > anterior['consultas']:
+                regresiones += 1
+                self.stdout.write(self.style.ERROR(
+                    f'  ❌ {actual["consultas"] - anterior["consultas"]} consultas más que la línea base'
+                ))
+            if 'p95_ms' in anterior and actual['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia):
+                regresiones += 1
+                self.stdout.write(self.style.ERROR(
+                    f'  ❌ p95 {actual["p95_ms"] / anterior["p95_ms"] - 1:+.0%} respecto a la línea base'
+                ))
+
+        self.stdout.write('\n' + '='*50)
+        if regresiones:
+            self.stdout.write(self.style.WARNING(f'⚠️  {regresiones} regresiones encontradas'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Sin regresiones'))
+        return regresiones
@@ -0,0 +1,156 @@
+"""
+Comando de gestión Django para medir el efecto de los índices compuestos de movimientos.
+Uso: python manage.py benchmark_indices [--movimientos 1000000] [--repeticiones 5] [--base-datos ruta]
+
+Crea una base de datos SQLite desechable con generar_datos_sinteticos, ejecuta las consultas
+del registro, las cajas, el saldo y las tablas con y sin los índices declarados en
+MovimientoCaja y MovimientoBanco, y muestra el plan y la mediana de cada una.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum
+
+from apps.dyn_dt.models import Caja, Campamento, Ejercicio, MovimientoBanco, MovimientoCaja
+
+ALIAS = 'benchmark_indices'
+
+
+class Command(BaseCommand):
+    help = 'Compara planes y latencias de las consultas de movimientos con y sin índices compuestos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--movimientos',
+            type=int,
+            default=1_000_000,
+            help='Número total de movimientos sintéticos (70%% caja, 30%% banco)',
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=5,
+            help='Ejecuciones de cada consulta para calcular la mediana',
+        )
+        parser.add_argument(
+            '--base-datos',
+            help='Ruta del fichero SQLite a usar (por defecto uno temporal que se borra al terminar)',
+        )
+        parser.add_argument(
+            '--semilla',
+            type=int,
+            default=2025,
+            help='Semilla de los datos aleatorios',
+        )
+
+    def handle(self, *args, **options):
+        ruta = options.get('base_datos')
+        temporal = ruta is None
+        if temporal:
+            descriptor, ruta = tempfile.mkstemp(suffix='.sqlite3', prefix='benchmark_indices_')
+            os.close(descriptor)
+            os.remove(ruta)
+        elif os.path.exists(ruta):
+            raise CommandError(f'{ruta} ya existe; indica un fichero nuevo')
+
+        connections.databases[ALIAS] = {
+            **connections.databases['default'],
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ruta,
+        }
+        try:
+            self.stdout.write(f'Creando el esquema en {ruta}...')
+            call_command('migrate', database=ALIAS, verbosity=0)
+
+            datos = self.generar_datos(options['movimientos'], options['semilla'])
+
+            consultas = self.consultas(datos)
+            con_indices = self.medir(consultas, options['repeticiones'])
+            self.cambiar_indices(eliminar=True)
+            sin_indices = self.medir(consultas, options['repeticiones'])
+            self.cambiar_indices(eliminar=False)
+
+            self.informe(consultas, con_indices, sin_indices)
+        finally:
+            connections[ALIAS].close()
+            del connections.databases[ALIAS]
+            if temporal and os.path.exists(ruta):
+                os.remove(ruta)
+
+    def generar_datos(self, total, semilla):
+        """Datos de generar_datos_sinteticos sin desglose, que estas consultas no leen."""
+        call_command(
+            'generar_datos_sinteticos', database=ALIAS, movimientos=total, semilla=semilla,
+            campamentos=5, ejercicios=3, turnos=3, cajas=4, conceptos=20, sin_desglose=True,
+            stdout=self.stdout
+        )
+        connections[ALIAS].cursor().execute('ANALYZE')
+        return {
+            'ejercicio': Ejercicio.objects.using(ALIAS).order_by('-año').first(),
+            'campamento': Campamento.objects.using(ALIAS).order_by('id').first(),
+            'caja': Caja.objects.using(ALIAS).order_by('id').first(),
+        }
+
+    def consultas(self, datos):
+        """Las formas de consulta de views.py y los handlers que cubren los índices."""
+        db = ALIAS
+        caja = MovimientoCaja.objects.using(db)
+        banco = MovimientoBanco.objects.using(db)
+        ejercicio, campamento = datos['ejercicio'], datos['campamento']
+        return [
+            ('Registro: página de caja del ejercicio',
+             caja.filter(ejercicio=ejercicio).order_by('-fecha', '-id').values('id', 'fecha')[:100]),
+            ('Registro: página de banco del ejercicio',
+             banco.filter(ejercicio=ejercicio).order_by('-fecha', '-id').values('id', 'fecha')[:100]),
+            ('Registro: página de banco del campamento',
+             banco.filter(ejercicio=ejercicio, campamento=campamento).order_by('-fecha', '-id')
+             .values('id', 'fecha')[:100]),
+            ('Cajas: movimientos de una caja',
+             caja.filter(caja=datos['caja']).order_by('-fecha').values('id', 'fecha')[:100]),
+            ('Cajas: rango de fechas de una caja',
+             caja.filter(caja=datos['caja']).order_by('fecha').values('fecha')[:1]),
+            ('Saldo: movimientos de caja del ejercicio por fecha',
+             caja.filter(ejercicio=ejercicio).order_by('fecha', 'id').values_list('fecha', 'cantidad')),
+            ('Tablas: totales de caja por turno y concepto',
+             caja.filter(ejercicio=ejercicio, caja__campamento=campamento).order_by()
+             .values('turno_id', 'concepto_id').annotate(total=Sum('cantidad'))),
+            ('Tablas: totales de banco por turno y concepto',
+             banco.filter(ejercicio=ejercicio, campamento=campamento).order_by()
+             .values('turno_id', 'concepto_id').annotate(total=Sum('cantidad'))),
+        ]
+
+    def medir(self, consultas, repeticiones):
+        resultados = []
+        for _, queryset in consultas:
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                list(queryset.all())
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            resultados.append((statistics.median(tiempos), queryset.explain()))
+        return resultados
+
+    def cambiar_indices(self, eliminar):
+        with connections[ALIAS].schema_editor() as editor:
+            for modelo in (MovimientoCaja, MovimientoBanco):
+                for indice in modelo._meta.indexes:
+                    if eliminar:
+                        editor.remove_index(modelo, indice)
+                    else:
+                        editor.add_index(modelo, indice)
+        connections[ALIAS].cursor().execute('ANALYZE')
+
+    def informe(self, consultas, con_indices, sin_indices):
+        for (nombre, _), (con_ms, con_plan), (sin_ms, sin_plan) in zip(consultas, con_indices, sin_indices):
+            self.stdout.write(self.style.MIGRATE_HEADING(nombre))
+            self.stdout.write(f'  Con índices: {con_ms:9.2f} ms | {con_plan.replace(chr(10), " / ")}')
+            self.stdout.write(f'  Sin índices: {sin_ms:9.2f} ms | {sin_plan.replace(chr(10), " / ")}')
+            factor = sin_ms / con_ms if con_ms else 0
+            estilo = self.style.SUCCESS if factor >= 1 else self.style.WARNING
+            self.stdout.write(estilo(f'  x{factor:.1f}\n'))
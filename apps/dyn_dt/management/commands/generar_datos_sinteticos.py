@@ -0,0 +1,265 @@
+"""
+Comando de gestión Django para generar datos sintéticos a escala realista.
+Uso: python manage.py generar_datos_sinteticos [--movimientos 10000] [--campamentos 3] [--ejercicios 2] ...
+
+Inserta campamentos, ejercicios, turnos, cajas, conceptos, movimientos de caja y banco
+y su desglose en billetes y monedas con bulk_create, y después recalcula de una vez el
+estado derivado (saldo de cajas y banco, desglose de cajas y snapshots de saldo) que
+las señales mantendrían movimiento a movimiento.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from apps.dyn_dt.models import (
+    Caja, Campamento, Concepto, CuentaBancaria, DenominacionEuro, DesgloseCaja, Ejercicio,
+    MovimientoBanco, MovimientoCaja, MovimientoDinero, SaldoSnapshot, Turno, ViaMovimientoBanco
+)
+from apps.pages.models import Product
+
+# Denominaciones creadas si la base de datos no tiene ninguna (valor, es_billete)
+DENOMINACIONES = [
+    ('100.00', True), ('50.00', True), ('20.00', True), ('10.00', True), ('5.00', True),
+    ('2.00', False), ('1.00', False), ('0.50', False), ('0.20', False), ('0.10', False), ('0.05', False),
+]
+
+LOTE = 5000
+
+
+class Command(BaseCommand):
+    help = 'Genera volúmenes configurables de datos sintéticos para medir la aplicación a escala'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campamentos', type=int, default=3, help='Número de campamentos')
+        parser.add_argument('--ejercicios', type=int, default=2, help='Número de ejercicios (uno por año)')
+        parser.add_argument('--turnos', type=int, default=4, help='Turnos por ejercicio y campamento')
+        parser.add_argument('--cajas', type=int, default=2, help='Cajas por campamento')
+        parser.add_argument('--conceptos', type=int, default=15, help='Número de conceptos (un tercio son gastos)')
+        parser.add_argument('--movimientos', type=int, default=10000, help='Movimientos de caja y banco en total')
+        parser.add_argument(
+            '--proporcion-banco',
+            type=float,
+            default=0.3,
+            help='Fracción de los movimientos que son de banco',
+        )
+        parser.add_argument(
+            '--sin-desglose',
+            action='store_true',
+            help='No generar el desglose en billetes y monedas de los movimientos de caja',
+        )
+        parser.add_argument(
+            '--productos',
+            type=int,
+            default=0,
+            help='Productos para las vistas dinámicas (datatable y API)',
+        )
+        parser.add_argument(
+            '--prefijo',
+            default='Sintético',
+            help='Prefijo de los nombres generados (deben ser únicos)',
+        )
+        parser.add_argument('--semilla', type=int, default=2025, help='Semilla de los datos aleatorios')
+        parser.add_argument('--database', default='default', help='Alias de la base de datos destino')
+
+    def handle(self, *args, **options):
+        db = options['database']
+        prefijo = options['prefijo']
+        if Campamento.objects.using(db).filter(nombre__startswith=prefijo).exists():
+            raise CommandError(f'Ya hay datos con el prefijo "{prefijo}"; usa --prefijo para generar otro lote')
+
+        self.aleatorio = random.Random(options['semilla'])
+        inicio = time.perf_counter()
+
+        with transaction.atomic(using=db):
+            catalogo = self.generar_catalogo(db, prefijo, options)
+            movimientos_caja, movimientos_banco = self.generar_movimientos(db, catalogo, options)
+            movimientos_dinero = 0
+            if not options['sin_desglose']:
+                movimientos_dinero = self.generar_desglose(db, catalogo)
+            self.recalcular_estado_derivado(db, catalogo)
+            if options['productos']:
+                Product.objects.using(db).bulk_create([
+                    Product(name=f'{prefijo} producto {n}', info=f'Lote {n % 10}', price=self.aleatorio.randrange(1, 1000))
+                    for n in range(options['productos'])
+                ], batch_size=LOTE)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {len(catalogo["campamentos"])} campamentos, {len(catalogo["ejercicios"])} ejercicios, '
+            f'{len(catalogo["cajas"])} cajas, {movimientos_caja} movimientos de caja, '
+            f'{movimientos_banco} de banco, {movimientos_dinero} movimientos de dinero y '
+            f'{options["productos"]} productos en {time.perf_counter() - inicio:.1f}s'
+        ))
+
+    def generar_catalogo(self, db, prefijo, options):
+        """Crea el catálogo con bulk_create: las señales de alta escribirían fila a fila."""
+        año_actual = timezone.localdate().year
+        campamentos = Campamento.objects.using(db).bulk_create([
+            Campamento(nombre=f'{prefijo} campamento {n + 1}') for n in range(options['campamentos'])
+        ])
+        ejercicios = Ejercicio.objects.using(db).bulk_create([
+            Ejercicio(nombre=f'{prefijo} ejercicio {año_actual - n}', año=año_actual - n)
+            for n in range(options['ejercicios'])
+        ])
+        turnos = Turno.objects.using(db).bulk_create([
+            Turno(campamento=campamento, ejercicio=ejercicio, nombre=f'{campamento.nombre} turno {n + 1}')
+            for ejercicio in ejercicios for campamento in campamentos for n in range(options['turnos'])
+        ])
+        cajas = Caja.objects.using(db).bulk_create([
+            Caja(campamento=campamento, nombre=f'{campamento.nombre} caja {n + 1}')
+            for campamento in campamentos for n in range(options['cajas'])
+        ])
+        conceptos = Concepto.objects.using(db).bulk_create([
+            Concepto(nombre=f'{prefijo} concepto {n + 1}', es_gasto=n % 3 == 2) for n in range(options['conceptos'])
+        ])
+        cuenta = CuentaBancaria.objects.using(db).bulk_create([
+            CuentaBancaria(nombre=f'{prefijo} cuenta', titular=prefijo, IBAN='ES0000000000000000000000')
+        ])[0]
+        via = ViaMovimientoBanco.objects.using(db).bulk_create([ViaMovimientoBanco(nombre=f'{prefijo} vía')])[0]
+
+        if not DenominacionEuro.objects.using(db).exists():
+            DenominacionEuro.objects.using(db).bulk_create([
+                DenominacionEuro(valor=Decimal(valor), es_billete=es_billete) for valor, es_billete in DENOMINACIONES
+            ])
+        denominaciones = list(DenominacionEuro.objects.using(db).filter(activa=True).order_by('-valor'))
+        DesgloseCaja.objects.using(db).bulk_create([
+            DesgloseCaja(caja=caja, denominacion=denominacion, cantidad=0)
+            for caja in cajas for denominacion in denominaciones
+        ])
+
+        turnos_por_clave = {}
+        for turno in turnos:
+            turnos_por_clave.setdefault((turno.ejercicio_id, turno.campamento_id), []).append(turno)
+        cajas_por_campamento = {}
+        for caja in cajas:
+            cajas_por_campamento.setdefault(caja.campamento_id, []).append(caja)
+
+        if not (campamentos and ejercicios and turnos and cajas and conceptos):
+            raise CommandError('Hace falta al menos un campamento, ejercicio, turno, caja y concepto')
+        return {
+            'campamentos': campamentos, 'ejercicios': ejercicios, 'cajas': cajas,
+            'conceptos': conceptos, 'cuenta': cuenta, 'via': via, 'denominaciones': denominaciones,
+            'turnos_por_clave': turnos_por_clave, 'cajas_por_campamento': cajas_por_campamento,
+        }
+
+    def generar_movimientos(self, db, catalogo, options):
+        aleatorio = self.aleatorio
+        total = options['movimientos']
+        proporcion_banco = options['proporcion_banco']
+        movimientos_caja = movimientos_banco = 0
+
+        for desde in range(0, total, LOTE):
+            lote_caja, lote_banco = [], []
+            for _ in range(min(LOTE, total - desde)):
+                ejercicio = aleatorio.choice(catalogo['ejercicios'])
+                campamento = aleatorio.choice(catalogo['campamentos'])
+                datos = {
+                    'ejercicio': ejercicio,
+                    'turno': aleatorio.choice(catalogo['turnos_por_clave'][(ejercicio.pk, campamento.pk)]),
+                    'concepto': aleatorio.choice(catalogo['conceptos']),
+                    'fecha': timezone.make_aware(datetime(ejercicio.año, 1, 1)) + timedelta(
+                        seconds=aleatorio.randrange(365 * 24 * 3600)
+                    ),
+                    'descripcion': 'Movimiento sintético',
+                }
+                if aleatorio.random() < proporcion_banco:
+                    lote_banco.append(MovimientoBanco(
+                        campamento=campamento, cuenta_bancaria=catalogo['cuenta'], via=catalogo['via'],
+                        cantidad=Decimal(aleatorio.randrange(100, 200000)) / 100, **datos
+                    ))
+                else:
+                    # Múltiplos de 5 céntimos para que el desglose cuadre con el importe
+                    lote_caja.append(MovimientoCaja(
+                        caja=aleatorio.choice(catalogo['cajas_por_campamento'][campamento.pk]),
+                        cantidad=Decimal(aleatorio.randrange(1, 4000)) * Decimal('0.05'), **datos
+                    ))
+            MovimientoCaja.objects.using(db).bulk_create(lote_caja)
+            MovimientoBanco.objects.using(db).bulk_create(lote_banco)
+            movimientos_caja += len(lote_caja)
+            movimientos_banco += len(lote_banco)
+        return movimientos_caja, movimientos_banco
+
+    def generar_desglose(self, db, catalogo):
+        """Desglosa cada movimiento de caja de mayor a menor denominación."""
+        denominaciones = catalogo['denominaciones']
+        creados = 0
+        lote = []
+        movimientos = (
+            MovimientoCaja.objects.using(db).filter(caja__in=catalogo['cajas'])
+            .values_list('id', 'cantidad', 'concepto__es_gasto').order_by('id')
+        )
+        for movimiento_id, cantidad, es_gasto in movimientos.iterator(chunk_size=LOTE):
+            restante = cantidad
+            for denominacion in denominaciones:
+                unidades = int(restante // denominacion.valor)
+                if not unidades:
+                    continue
+                restante -= unidades * denominacion.valor
+                lote.append(MovimientoDinero(
+                    movimiento_caja_id=movimiento_id,
+                    denominacion=denominacion,
+                    cantidad_entrada=0 if es_gasto else unidades,
+                    cantidad_salida=unidades if es_gasto else 0,
+                ))
+            if len(lote) >= LOTE:
+                MovimientoDinero.objects.using(db).bulk_create(lote)
+                creados += len(lote)
+                lote = []
+        MovimientoDinero.objects.using(db).bulk_create(lote)
+        return creados + len(lote)
+
+    def recalcular_estado_derivado(self, db, catalogo):
+        """Saldos, desglose de cajas y snapshots con consultas agregadas, como harían las señales."""
+        cajas = catalogo['cajas']
+        netos = {
+            (fila['movimiento_caja__caja_id'], fila['denominacion_id']): fila['entrada'] - fila['salida']
+            for fila in MovimientoDinero.objects.using(db).filter(movimiento_caja__caja__in=cajas)
+            .values('movimiento_caja__caja_id', 'denominacion_id')
+            .annotate(entrada=Sum('cantidad_entrada'), salida=Sum('cantidad_salida'))
+        }
+        desglose = list(DesgloseCaja.objects.using(db).filter(caja__in=cajas).select_related('denominacion'))
+        for fila in desglose:
+            # El desglose no baja de cero, igual que DesgloseCaja.aplicar_delta
+            fila.cantidad = max(netos.get((fila.caja_id, fila.denominacion_id), 0), 0)
+        DesgloseCaja.objects.using(db).bulk_update(desglose, ['cantidad'], batch_size=LOTE)
+
+        if netos:
+            # Con desglose, el saldo de la caja es el valor de su desglose
+            saldos = {}
+            for fila in desglose:
+                saldos[fila.caja_id] = saldos.get(fila.caja_id, Decimal('0.00')) + fila.valor_total()
+        else:
+            saldos = {
+                fila['caja_id']: (fila['ingresos'] or Decimal('0.00')) - (fila['gastos'] or Decimal('0.00'))
+                for fila in MovimientoCaja.objects.using(db).filter(caja__in=cajas).order_by()
+                .values('caja_id').annotate(
+                    ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+                    gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+                )
+            }
+        for caja in cajas:
+            caja.saldo_caja = saldos.get(caja.pk, Decimal('0.00'))
+        Caja.objects.using(db).bulk_update(cajas, ['saldo_caja'])
+
+        ejercicios = catalogo['ejercicios']
+        saldos_banco = {
+            fila['ejercicio_id']: (fila['ingresos'] or Decimal('0.00')) - (fila['gastos'] or Decimal('0.00'))
+            for fila in MovimientoBanco.objects.using(db).filter(ejercicio__in=ejercicios).order_by()
+            .values('ejercicio_id').annotate(
+                ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+                gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+            )
+        }
+        for ejercicio in ejercicios:
+            ejercicio.saldo_banco = saldos_banco.get(ejercicio.pk, Decimal('0.00'))
+        Ejercicio.objects.using(db).bulk_update(ejercicios, ['saldo_banco'])
+
+        # Los snapshots acumulan por año y campamento: se reconstruyen todos, como rebuild_snapshots
+        SaldoSnapshot.objects.using(db).all().delete()
+        SaldoSnapshot.objects.using(db).bulk_create(SaldoSnapshot.calcular_desde_movimientos(using=db))
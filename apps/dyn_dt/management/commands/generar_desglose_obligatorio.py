@@ -9,7 +9,6 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from apps.dyn_dt.models import MovimientoCaja, DenominacionEuro, MovimientoDinero
 from decimal import Decimal
-from django.contrib.contenttypes.models import ContentType
 
 
 
@@ -67,7 +66,7 @@ class Command(BaseCommand):
                 try:
                     # Si no es dry-run y se fuerza, eliminar desglose existente
                     if force and not dry_run:
-                        movimiento.movimientos_dinero.all().delete()
+                        MovimientoDinero.eliminar_de_movimiento(movimiento)
                     
                     desglose_generado = self.generar_desglose_automatico(
                         movimiento.cantidad, denominaciones
@@ -83,8 +82,7 @@ class Command(BaseCommand):
                         for denominacion, cantidad in desglose_generado.items():
                             if cantidad > 0:
                                 MovimientoDinero.objects.create(
-                                    content_type=ContentType.objects.get_for_model(movimiento),
-                                    object_id=movimiento.id,
+                                    movimiento_caja=movimiento,
                                     denominacion=denominacion,
                                     cantidad_entrada=cantidad,
                                     cantidad_salida=0
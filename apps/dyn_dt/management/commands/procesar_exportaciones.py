@@ -0,0 +1,95 @@
+"""
+Comando de gestión Django que procesa la cola de exportaciones en segundo plano.
+Uso: python manage.py procesar_exportaciones [--una-vez] [--intervalo 5] [--max-trabajos N]
+
+Reclama los TrabajoExportacion pendientes por orden de llegada y escribe cada fichero
+(CSV, XLSX o Parquet) por bloques en el almacenamiento de ficheros, actualizando el
+progreso que consultan las vistas. No necesita ningún broker: se pueden lanzar varios
+workers a la vez, ya que cada trabajo se reclama con una actualización condicional.
+Cada bloque escrito renueva el latido del trabajo; --reencolar-minutos devuelve a la
+cola los que llevan ese tiempo sin latido.
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.dyn_dt.handlers.datatable_handlers import ExportJobHandler
+from apps.dyn_dt.models import TrabajoExportacion
+
+
+class Command(BaseCommand):
+    help = 'Genera los ficheros de las exportaciones pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Procesar los trabajos pendientes y terminar en lugar de seguir esperando',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos de espera entre consultas a la cola cuando está vacía',
+        )
+        parser.add_argument(
+            '--max-trabajos',
+            type=int,
+            help='Terminar tras procesar este número de trabajos',
+        )
+        parser.add_argument(
+            '--reencolar-minutos',
+            type=int,
+            help='Devolver a la cola los trabajos en curso sin latido desde hace más de estos minutos (worker caído)',
+        )
+
+    def handle(self, *args, **options):
+        if options['reencolar_minutos']:
+            self.reencolar(options['reencolar_minutos'])
+
+        procesados = errores = 0
+        while True:
+            trabajo = self.siguiente()
+            if trabajo is None:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            self.stdout.write(f'Exportando {trabajo.ruta} a {trabajo.get_formato_display()} (trabajo {trabajo.pk})...')
+            inicio = time.perf_counter()
+            if ExportJobHandler.run_job(trabajo):
+                self.stdout.write(self.style.SUCCESS(
+                    f'✅ {trabajo.filas_procesadas} filas en {time.perf_counter() - inicio:.1f}s: {trabajo.archivo.name}'
+                ))
+            else:
+                errores += 1
+                self.stdout.write(self.style.ERROR(f'❌ Trabajo {trabajo.pk}: {trabajo.error}'))
+
+            procesados += 1
+            if options['max_trabajos'] and procesados >= options['max_trabajos']:
+                break
+
+        self.stdout.write('\n' + '='*50)
+        if errores:
+            self.stdout.write(self.style.WARNING(f'⚠️  {procesados} trabajos procesados, {errores} con errores'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✅ {procesados} trabajos procesados'))
+
+    def siguiente(self):
+        """Reclama el trabajo pendiente más antiguo que no haya cogido otro worker."""
+        for trabajo_id in TrabajoExportacion.objects.pendientes().values_list('id', flat=True)[:10]:
+            if TrabajoExportacion.objects.reclamar(trabajo_id):
+                return TrabajoExportacion.objects.get(pk=trabajo_id)
+        return None
+
+    def reencolar(self, minutos):
+        limite = timezone.now() - timedelta(minutes=minutos)
+        reencolados = TrabajoExportacion.objects.bloqueados(limite).update(
+            estado=TrabajoExportacion.ESTADO_PENDIENTE, filas_procesadas=0, iniciado_en=None, latido_en=None
+        )
+        if reencolados:
+            self.stdout.write(self.style.WARNING(f'⚠️  {reencolados} trabajos bloqueados devueltos a la cola'))
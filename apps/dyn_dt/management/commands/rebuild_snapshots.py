@@ -0,0 +1,78 @@
+"""
+Comando de gestión Django para reconstruir los snapshots de saldo desde los movimientos.
+Uso: python manage.py rebuild_snapshots [--verificar-solo]
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.dyn_dt.models import SaldoSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero los snapshots de saldo y verifica que coinciden con los guardados'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar-solo',
+            action='store_true',
+            help='Solo verificar inconsistencias sin corregir',
+        )
+
+    def handle(self, *args, **options):
+        verificar_solo = options.get('verificar_solo')
+
+        self.stdout.write('Recalculando snapshots de saldo desde los movimientos...\n')
+
+        with transaction.atomic():
+            calculados = SaldoSnapshot.calcular_desde_movimientos()
+            guardados = {
+                (s.ejercicio_id, s.campamento_id, s.tipo): s
+                for s in SaldoSnapshot.objects.select_for_update()
+            }
+
+            inconsistencias = 0
+            for calculado in calculados:
+                clave = (calculado.ejercicio_id, calculado.campamento_id, calculado.tipo)
+                guardado = guardados.pop(clave, None)
+                if guardado is None:
+                    inconsistencias += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'Falta snapshot: ejercicio {clave[0]}, campamento {clave[1]}, {clave[2]}'
+                    ))
+                    continue
+                valores_guardados = (guardado.ingresos, guardado.gastos, guardado.saldo_cierre)
+                valores_calculados = (calculado.ingresos, calculado.gastos, calculado.saldo_cierre)
+                if valores_guardados != valores_calculados:
+                    inconsistencias += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'Snapshot ejercicio {clave[0]}, campamento {clave[1]}, {clave[2]}: '
+                        f'ingresos/gastos/cierre {guardado.ingresos}/{guardado.gastos}/{guardado.saldo_cierre}€ (actual) '
+                        f'vs {calculado.ingresos}/{calculado.gastos}/{calculado.saldo_cierre}€ (calculado)'
+                    ))
+
+            for clave in guardados:
+                inconsistencias += 1
+                self.stdout.write(self.style.WARNING(
+                    f'Snapshot sobrante: ejercicio {clave[0]}, campamento {clave[1]}, {clave[2]}'
+                ))
+
+            if inconsistencias and not verificar_solo:
+                SaldoSnapshot.objects.all().delete()
+                SaldoSnapshot.objects.bulk_create(calculados)
+
+        self.stdout.write('\n' + '='*50)
+        if inconsistencias == 0:
+            self.stdout.write(
+                self.style.SUCCESS(f'✅ Los {len(calculados)} snapshots están correctos')
+            )
+        elif verificar_solo:
+            self.stdout.write(
+                self.style.WARNING(f'⚠️  {inconsistencias} inconsistencias encontradas')
+            )
+            self.stdout.write('Ejecuta sin --verificar-solo para corregir')
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✅ {inconsistencias} inconsistencias corregidas, {len(calculados)} snapshots reconstruidos'
+                )
+            )
@@ -0,0 +1,67 @@
+"""
+Comando de gestión Django para reconstruir los índices de texto completo de la datatable.
+Uso: python manage.py reconstruir_indice_busqueda [ruta ...] [--database default]
+
+Las señales mantienen el índice de cada modelo con búsqueda 'fulltext' en DYNAMIC_DATATB,
+pero las escrituras que no las disparan (queryset.update(), bulk_create, SQL directo)
+lo dejan desfasado. Este comando lo vuelve a generar desde la tabla del modelo.
+También crea el índice que falte, por ejemplo al pasar una ruta a 'fulltext' sin volver
+a ejecutar migrate: mientras no existe, la búsqueda usa icontains.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from apps.dyn_dt.search import FullTextSearchBackend
+from apps.dyn_dt.utils import get_datatable_options
+from cli import name_to_class
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de texto completo de los modelos con búsqueda 'fulltext'"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'rutas',
+            nargs='*',
+            help='Rutas de DYNAMIC_DATATB a reconstruir (por defecto todas las que usan fulltext)',
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Base de datos a usar',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        rutas = options['rutas'] or [
+            ruta for ruta in settings.DYNAMIC_DATATB
+            if get_datatable_options(ruta).get('search') == 'fulltext'
+        ]
+        if not rutas:
+            self.stdout.write(self.style.WARNING("⚠️  Ninguna ruta de DYNAMIC_DATATB usa la búsqueda 'fulltext'"))
+            return
+
+        total = 0
+        for ruta in rutas:
+            configuracion = get_datatable_options(ruta)
+            if configuracion is None:
+                raise CommandError(f'{ruta} no está en DYNAMIC_DATATB')
+            if configuracion.get('search') != 'fulltext':
+                raise CommandError(f"{ruta} no usa la búsqueda 'fulltext'")
+
+            backend = FullTextSearchBackend(name_to_class(configuracion['model']))
+            if not backend.supported(connection):
+                self.stdout.write(self.style.WARNING(
+                    f'⚠️  {ruta}: {connection.vendor} no tiene índice de texto completo, se usa icontains'
+                ))
+                continue
+
+            with transaction.atomic(using=connection.alias):
+                filas = backend.rebuild(connection)
+            total += filas
+            self.stdout.write(f'  {ruta}: {filas} filas indexadas en {backend.table}')
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write(self.style.SUCCESS(f'✅ Índices reconstruidos: {total} filas'))
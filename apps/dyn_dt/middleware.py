@@ -1,5 +1,16 @@
-from threading import local
+import logging
+import re
+from collections import Counter, deque
+from contextlib import ExitStack
+from math import ceil
+from threading import Lock, local
+from time import perf_counter
+
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+
+logger = logging.getLogger(__name__)
 
 _thread_locals = local()
 
@@ -23,3 +34,129 @@ class CurrentUserMiddleware:
             del _thread_locals.user
         
         return response
+
+
+class RequestMetrics:
+    """
+    Rolling per-URL-name request metrics kept in process memory.
+
+    Each URL name keeps its last `window` samples (wall time, query count, DB
+    time and repeated SQL templates); histograms and percentiles are computed
+    from that window when read.
+    """
+    # Upper bounds (ms) of the wall time histogram buckets; the last one is open
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = {}
+        self._lock = Lock()
+
+    def record(self, url_name, total_ms, queries, db_ms, n_plus_one):
+        with self._lock:
+            samples = self._samples.get(url_name)
+            if samples is None:
+                samples = self._samples[url_name] = deque(maxlen=self.window)
+            samples.append((total_ms, queries, db_ms, n_plus_one))
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def snapshot(self):
+        """JSON-serializable summary per URL name."""
+        with self._lock:
+            samples = {url_name: list(values) for url_name, values in self._samples.items()}
+
+        summary = {}
+        for url_name, values in sorted(samples.items()):
+            tiempos = sorted(value[0] for value in values)
+            histogram = {f'<={bound}ms': 0 for bound in self.BUCKETS_MS}
+            histogram[f'>{self.BUCKETS_MS[-1]}ms'] = 0
+            for tiempo in tiempos:
+                bound = next((b for b in self.BUCKETS_MS if tiempo <= b), None)
+                histogram[f'<={bound}ms' if bound is not None else f'>{self.BUCKETS_MS[-1]}ms'] += 1
+            n_plus_one = {}
+            for value in values:
+                for sql, count in value[3].items():
+                    n_plus_one[sql] = max(n_plus_one.get(sql, 0), count)
+            summary[url_name] = {
+                'requests': len(values),
+                'p50_ms': round(_percentile(tiempos, 0.50), 2),
+                'p95_ms': round(_percentile(tiempos, 0.95), 2),
+                'max_ms': round(tiempos[-1], 2),
+                'avg_queries': round(sum(value[1] for value in values) / len(values), 1),
+                'max_queries': max(value[1] for value in values),
+                'avg_db_ms': round(sum(value[2] for value in values) / len(values), 2),
+                'histogram': histogram,
+                'n_plus_one': n_plus_one,
+            }
+        return summary
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, ceil(fraction * len(sorted_values)) - 1)]
+
+
+request_metrics = RequestMetrics(window=getattr(settings, 'REQUEST_METRICS', {}).get('WINDOW', 500))
+
+# Collapses IN (%s, %s, ...) lists so queries differing only in list length share a template
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class _QueryRecorder:
+    """connection.execute_wrapper callable counting queries, DB time and SQL templates."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (perf_counter() - start) * 1000
+            self.queries += 1
+            self.templates[_IN_LIST.sub('IN (...)', sql)] += 1
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records wall time, query count and DB time of every request per URL name.
+
+    SQL templates executed at least N_PLUS_ONE_THRESHOLD times in one request
+    are logged as probable N+1 patterns. The totals are added to the response
+    as a Server-Timing header when DEBUG is on or the user is staff, so timings
+    are not disclosed to other clients. Streaming bodies are produced after the
+    view returns and are not included.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.n_plus_one_threshold = getattr(settings, 'REQUEST_METRICS', {}).get('N_PLUS_ONE_THRESHOLD', 10)
+
+    def __call__(self, request):
+        recorder = _QueryRecorder()
+        start = perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total_ms = (perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = (match.view_name if match else None) or 'unresolved'
+        n_plus_one = {
+            sql: count for sql, count in recorder.templates.items() if count >= self.n_plus_one_threshold
+        }
+        for sql, count in n_plus_one.items():
+            logger.warning('Possible N+1 in %s: %d executions of %s', url_name, count, sql)
+
+        request_metrics.record(url_name, total_ms, recorder.queries, recorder.db_ms, n_plus_one)
+        if settings.DEBUG or getattr(getattr(request, 'user', None), 'is_staff', False):
+            response['Server-Timing'] = (
+                f'app;dur={total_ms:.1f}, db;dur={recorder.db_ms:.1f};desc="{recorder.queries} queries"'
+            )
+        return response
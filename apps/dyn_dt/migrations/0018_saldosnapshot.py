@@ -0,0 +1,90 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+from django.db.models import Q, Sum
+
+
+def poblar_snapshots(apps, schema_editor):
+    """Calcula los snapshots de saldo de los movimientos existentes"""
+    Ejercicio = apps.get_model('dyn_dt', 'Ejercicio')
+    Campamento = apps.get_model('dyn_dt', 'Campamento')
+    MovimientoCaja = apps.get_model('dyn_dt', 'MovimientoCaja')
+    MovimientoBanco = apps.get_model('dyn_dt', 'MovimientoBanco')
+    SaldoSnapshot = apps.get_model('dyn_dt', 'SaldoSnapshot')
+    db = schema_editor.connection.alias
+
+    cero = Decimal('0.00')
+    totales = {}
+    for modelo, campo_campamento, tipo in (
+        (MovimientoCaja, 'caja__campamento', 'caja'),
+        (MovimientoBanco, 'campamento', 'banco'),
+    ):
+        filas = modelo.objects.using(db).order_by().values('ejercicio_id', campo_campamento).annotate(
+            total_ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+            total_gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+        )
+        for fila in filas:
+            totales[(fila['ejercicio_id'], fila[campo_campamento], tipo)] = (
+                fila['total_ingresos'] or cero, fila['total_gastos'] or cero
+            )
+
+    ejercicios = list(Ejercicio.objects.using(db).order_by('año', 'id').values_list('id', 'año'))
+    años_ejercicio = dict(ejercicios)
+    campamentos = list(Campamento.objects.using(db).values_list('id', flat=True))
+
+    resultado_año = {}
+    for (ejercicio_id, campamento_id, tipo), (ingresos, gastos) in totales.items():
+        clave = (campamento_id, tipo, años_ejercicio[ejercicio_id])
+        resultado_año[clave] = resultado_año.get(clave, cero) + ingresos - gastos
+
+    snapshots = []
+    for campamento_id in campamentos:
+        for tipo in ('caja', 'banco'):
+            acumulado = cero
+            año_anterior = None
+            for ejercicio_id, año in ejercicios:
+                if año != año_anterior:
+                    acumulado += resultado_año.get((campamento_id, tipo, año), cero)
+                    año_anterior = año
+                ingresos, gastos = totales.get((ejercicio_id, campamento_id, tipo), (cero, cero))
+                snapshots.append(SaldoSnapshot(
+                    ejercicio_id=ejercicio_id,
+                    campamento_id=campamento_id,
+                    tipo=tipo,
+                    ingresos=ingresos,
+                    gastos=gastos,
+                    saldo_cierre=acumulado,
+                ))
+    SaldoSnapshot.objects.using(db).bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dyn_dt', '0017_alter_movimientodinero_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('caja', 'Caja'), ('banco', 'Banco')], max_length=5, verbose_name='Tipo de saldo')),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Ingresos del ejercicio')),
+                ('gastos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Gastos del ejercicio')),
+                ('saldo_cierre', models.DecimalField(decimal_places=2, default=0, help_text='Saldo acumulado desde el primer ejercicio hasta el final de este', max_digits=12, verbose_name='Saldo de cierre')),
+                ('actualizado_en', models.DateTimeField(auto_now=True, verbose_name='Actualizado en')),
+                ('campamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_snapshot', to='dyn_dt.campamento', verbose_name='Campamento')),
+                ('ejercicio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_snapshot', to='dyn_dt.ejercicio', verbose_name='Ejercicio')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de saldo',
+                'verbose_name_plural': 'Snapshots de saldo',
+                'ordering': ['-ejercicio__año', 'campamento__nombre', 'tipo'],
+                'unique_together': {('ejercicio', 'campamento', 'tipo')},
+            },
+        ),
+        migrations.RunPython(poblar_snapshots, reverse_code=migrations.RunPython.noop),
+    ]
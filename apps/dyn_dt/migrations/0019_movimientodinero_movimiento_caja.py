@@ -0,0 +1,75 @@
+# Generated by Django 4.2.9 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F
+
+
+def copiar_relacion_generica(apps, schema_editor):
+    """Pasa content_type/object_id a la FK movimiento_caja y descarta las filas huérfanas"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    MovimientoCaja = apps.get_model('dyn_dt', 'MovimientoCaja')
+    MovimientoDinero = apps.get_model('dyn_dt', 'MovimientoDinero')
+    db = schema_editor.connection.alias
+
+    content_type = ContentType.objects.using(db).filter(app_label='dyn_dt', model='movimientocaja').first()
+    if content_type is not None:
+        MovimientoDinero.objects.using(db).filter(
+            content_type=content_type,
+            object_id__in=MovimientoCaja.objects.using(db).values('id')
+        ).update(movimiento_caja_id=F('object_id'))
+    # Filas que apuntan a otro modelo o a un movimiento borrado: no tienen movimiento de caja
+    MovimientoDinero.objects.using(db).filter(movimiento_caja__isnull=True).delete()
+
+
+def restaurar_relacion_generica(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    MovimientoDinero = apps.get_model('dyn_dt', 'MovimientoDinero')
+    db = schema_editor.connection.alias
+
+    content_type, _ = ContentType.objects.using(db).get_or_create(app_label='dyn_dt', model='movimientocaja')
+    MovimientoDinero.objects.using(db).update(content_type=content_type, object_id=F('movimiento_caja_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('dyn_dt', '0018_saldosnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimientodinero',
+            name='movimiento_caja',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movimientos_dinero', to='dyn_dt.movimientocaja', verbose_name='Movimiento de Caja'),
+        ),
+        migrations.AlterField(
+            model_name='movimientodinero',
+            name='content_type',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='Tipo de movimiento de caja'),
+        ),
+        migrations.AlterField(
+            model_name='movimientodinero',
+            name='object_id',
+            field=models.PositiveIntegerField(null=True, verbose_name='ID del objeto'),
+        ),
+        migrations.RunPython(copiar_relacion_generica, restaurar_relacion_generica),
+        migrations.RemoveField(
+            model_name='movimientodinero',
+            name='content_type',
+        ),
+        migrations.RemoveField(
+            model_name='movimientodinero',
+            name='object_id',
+        ),
+        migrations.AlterField(
+            model_name='movimientodinero',
+            name='movimiento_caja',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_dinero', to='dyn_dt.movimientocaja', verbose_name='Movimiento de Caja'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientodinero',
+            index=models.Index(fields=['movimiento_caja', 'denominacion'], name='movdinero_mov_denom_idx'),
+        ),
+    ]
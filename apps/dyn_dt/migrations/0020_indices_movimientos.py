@@ -0,0 +1,29 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dyn_dt', '0019_movimientodinero_movimiento_caja'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientobanco',
+            index=models.Index(fields=['ejercicio', 'fecha', 'id'], name='movbanco_ejer_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientobanco',
+            index=models.Index(fields=['ejercicio', 'campamento', 'fecha'], name='movbanco_ejer_camp_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientocaja',
+            index=models.Index(fields=['ejercicio', 'fecha', 'id'], name='movcaja_ejer_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientocaja',
+            index=models.Index(fields=['caja', 'fecha', 'id'], name='movcaja_caja_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dyn_dt', '0020_indices_movimientos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoExportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ruta', models.CharField(help_text='Clave de DYNAMIC_DATATB que se exporta', max_length=255, verbose_name='Tabla')),
+                ('formato', models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'Excel (XLSX)'), ('parquet', 'Parquet')], default='csv', max_length=10, verbose_name='Formato')),
+                ('parametros', models.JSONField(blank=True, default=dict, help_text='Búsqueda y orden de la tabla en el momento de la solicitud', verbose_name='Parámetros')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=10, verbose_name='Estado')),
+                ('total_filas', models.PositiveIntegerField(blank=True, null=True, verbose_name='Total de filas')),
+                ('filas_procesadas', models.PositiveIntegerField(default=0, verbose_name='Filas procesadas')),
+                ('archivo', models.FileField(blank=True, null=True, upload_to='exportaciones/', verbose_name='Archivo')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('creado_en', models.DateTimeField(auto_now_add=True, verbose_name='Creado en')),
+                ('iniciado_en', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado en')),
+                ('completado_en', models.DateTimeField(blank=True, null=True, verbose_name='Completado en')),
+                ('creado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos_exportacion', to=settings.AUTH_USER_MODEL, verbose_name='Creado por')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de exportación',
+                'verbose_name_plural': 'Trabajos de exportación',
+                'ordering': ['-creado_en'],
+                'indexes': [models.Index(fields=['estado', 'creado_en'], name='trabajoexp_estado_idx')],
+            },
+        ),
+    ]
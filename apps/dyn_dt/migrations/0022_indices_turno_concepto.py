@@ -0,0 +1,21 @@
+# Generated by Django 4.2.9 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dyn_dt', '0021_trabajoexportacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientobanco',
+            index=models.Index(fields=['ejercicio', 'campamento', 'turno', 'concepto'], name='movbanco_ejer_camp_tc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientocaja',
+            index=models.Index(fields=['ejercicio', 'turno', 'concepto'], name='movcaja_ejer_tur_con_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dyn_dt', '0022_indices_turno_concepto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoexportacion',
+            name='latido_en',
+            field=models.DateTimeField(blank=True, help_text='Última vez que el worker informó de progreso; sin latido reciente se reencola', null=True, verbose_name='Último latido'),
+        ),
+    ]
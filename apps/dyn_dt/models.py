@@ -1,16 +1,18 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, When, F, Q, Sum, Count, Value
+from django.db.models import ExpressionWrapper, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from contextlib import contextmanager
+from threading import local
 from decimal import Decimal
 from django.utils.translation import gettext_lazy as _
 from datetime import date
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save, pre_delete, post_delete
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 import os
 from .mixins import UserTrackingMixin
-from django.contrib.contenttypes.models import ContentType
-from django.contrib.contenttypes.fields import GenericForeignKey
-from django.contrib.contenttypes.fields import GenericRelation
 
 
 
@@ -37,6 +39,42 @@ class ModelFilter(models.Model):
 		return self.key
 
 
+def _filtrar_por_campamento(movimientos, campo_campamento, campamento):
+    """Filtra los movimientos por campamento; None significa todos los campamentos"""
+    if campamento is None:
+        return movimientos
+    return movimientos.filter(**{campo_campamento: campamento})
+
+
+def _sumar_cantidad_real(movimientos):
+    """Suma en la base de datos la cantidad con signo de los movimientos"""
+    total = movimientos.aggregate(total=Sum(Movimiento.expresion_cantidad_real()))['total']
+    return total if total is not None else Decimal('0.00')
+
+
+class EjercicioQuerySet(models.QuerySet):
+
+    def con_saldos(self, campamento=None):
+        """
+        Anota saldo_cajas_acumulado, saldo_banco_acumulado y saldo_total_acumulado
+        leyendo los snapshots de saldo en la misma consulta que obtiene los ejercicios.
+        """
+        filtro = Q() if campamento is None else Q(saldos_snapshot__campamento=campamento)
+        decimal = models.DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            saldo_cajas_acumulado=Coalesce(
+                Sum('saldos_snapshot__saldo_cierre', filter=filtro & Q(saldos_snapshot__tipo='caja')),
+                Value(Decimal('0.00')), output_field=decimal
+            ),
+            saldo_banco_acumulado=Coalesce(
+                Sum('saldos_snapshot__saldo_cierre', filter=filtro & Q(saldos_snapshot__tipo='banco')),
+                Value(Decimal('0.00')), output_field=decimal
+            ),
+        ).annotate(
+            saldo_total_acumulado=F('saldo_cajas_acumulado') + F('saldo_banco_acumulado')
+        )
+
+
 class Ejercicio(UserTrackingMixin, models.Model):
     """
     Representa un ejercicio económico que agrupa varias cajas.
@@ -90,29 +128,58 @@ class Ejercicio(UserTrackingMixin, models.Model):
         verbose_name="Creado en",
         help_text="Fecha y hora de creación del ejercicio"
     )
+
+    objects = EjercicioQuerySet.as_manager()
     
+    def _totales_snapshot(self, campamento=None, tipo=None):
+        """
+        Lee de SaldoSnapshot los totales del ejercicio en una sola consulta.
+        Devuelve None si el ejercicio aún no tiene snapshots.
+        """
+        snapshots = SaldoSnapshot.objects.filter(ejercicio=self)
+        if tipo is not None:
+            snapshots = snapshots.filter(tipo=tipo)
+        if campamento is not None:
+            snapshots = snapshots.filter(campamento=campamento)
+        totales = snapshots.aggregate(
+            filas=Count('id'),
+            ingresos=Sum('ingresos'),
+            gastos=Sum('gastos'),
+            saldo_cierre=Sum('saldo_cierre'),
+        )
+        return totales if totales['filas'] else None
+
     def calcular_resultado_caja_ejercicio(self, campamento=None):
         """
         Calcula la suma del importe de todos los movimientos de caja asociados a este ejercicio.
         """
-        total = Decimal('0.00')
-        for movimiento_caja in MovimientoCaja.objects.filter(ejercicio=self, caja__campamento=campamento):
-            total += movimiento_caja.cantidad_real()
-        return total
+        totales = self._totales_snapshot(campamento, SaldoSnapshot.TIPO_CAJA)
+        if totales:
+            return totales['ingresos'] - totales['gastos']
+        movimientos = _filtrar_por_campamento(
+            MovimientoCaja.objects.filter(ejercicio=self), MovimientoCaja.CAMPO_CAMPAMENTO, campamento
+        )
+        return _sumar_cantidad_real(movimientos)
 
     def calcular_resultado_banco_ejercicio(self, campamento=None):
         """
         Calcula la suma del importe de todos los movimientos bancarios asociados a este ejercicio.
         """
-        total = Decimal('0.00')
-        for movimiento_banco in MovimientoBanco.objects.filter(ejercicio=self, campamento=campamento):
-            total += movimiento_banco.cantidad_real()
-        return total
+        totales = self._totales_snapshot(campamento, SaldoSnapshot.TIPO_BANCO)
+        if totales:
+            return totales['ingresos'] - totales['gastos']
+        movimientos = _filtrar_por_campamento(
+            MovimientoBanco.objects.filter(ejercicio=self), MovimientoBanco.CAMPO_CAMPAMENTO, campamento
+        )
+        return _sumar_cantidad_real(movimientos)
 
     def calcular_resultado_ejercicio(self, campamento=None):
         """
         Calcula el resultado total del ejercicio como la suma de los resultados de caja y banco.
         """
+        totales = self._totales_snapshot(campamento)
+        if totales:
+            return totales['ingresos'] - totales['gastos']
         resultado_caja = self.calcular_resultado_caja_ejercicio(campamento=campamento)
         resultado_banco = self.calcular_resultado_banco_ejercicio(campamento=campamento)
         return resultado_caja + resultado_banco
@@ -121,28 +188,73 @@ class Ejercicio(UserTrackingMixin, models.Model):
         """
         Calcula la suma de todos los resultados de caja de los ejercicios desde el primero año hasta el actual.
         """
-        total = Decimal('0.00')
-        for ejercicio in Ejercicio.objects.filter(año__lte=self.año):
-            total += ejercicio.calcular_resultado_caja_ejercicio(campamento=campamento)
-        return total
+        if campamento is None and hasattr(self, 'saldo_cajas_acumulado'):
+            return self.saldo_cajas_acumulado
+        totales = self._totales_snapshot(campamento, SaldoSnapshot.TIPO_CAJA)
+        if totales:
+            return totales['saldo_cierre']
+        movimientos = _filtrar_por_campamento(
+            MovimientoCaja.objects.filter(ejercicio__año__lte=self.año), MovimientoCaja.CAMPO_CAMPAMENTO, campamento
+        )
+        return _sumar_cantidad_real(movimientos)
 
     def calcular_saldo_banco(self, campamento=None):
         """
         Calcula la suma de todos los resultados de banco de los ejercicios desde el primero año hasta el actual.
         """
-        total = Decimal('0.00')
-        for ejercicio in Ejercicio.objects.filter(año__lte=self.año):
-            total += ejercicio.calcular_resultado_banco_ejercicio(campamento=campamento)
-        return total
+        if campamento is None and hasattr(self, 'saldo_banco_acumulado'):
+            return self.saldo_banco_acumulado
+        totales = self._totales_snapshot(campamento, SaldoSnapshot.TIPO_BANCO)
+        if totales:
+            return totales['saldo_cierre']
+        movimientos = _filtrar_por_campamento(
+            MovimientoBanco.objects.filter(ejercicio__año__lte=self.año), MovimientoBanco.CAMPO_CAMPAMENTO, campamento
+        )
+        return _sumar_cantidad_real(movimientos)
 
     def calcular_saldo_total(self, campamento=None):
         """
         Calcula el saldo total del banco para el ejercicio actual.
         """
+        if campamento is None and hasattr(self, 'saldo_total_acumulado'):
+            return self.saldo_total_acumulado
+        totales = self._totales_snapshot(campamento)
+        if totales:
+            return totales['saldo_cierre']
         calcular_saldo_cajas = self.calcular_saldo_cajas(campamento=campamento)
         calcular_saldo_banco = self.calcular_saldo_banco(campamento=campamento)
         return calcular_saldo_cajas + calcular_saldo_banco
 
+    @classmethod
+    def calcular_saldos_por_año(cls, campamento=None):
+        """
+        Calcula los saldos acumulados de caja, banco y total para cada año con movimientos.
+        Usa una consulta agrupada por año para la caja y otra para el banco.
+
+        Returns:
+            Diccionario ordenado por año: {año: {'caja': ..., 'banco': ..., 'total': ...}}
+        """
+        resultados = {}
+        for modelo in (MovimientoCaja, MovimientoBanco):
+            clave = modelo.TIPO_SALDO
+            movimientos = _filtrar_por_campamento(modelo.objects.all(), modelo.CAMPO_CAMPAMENTO, campamento)
+            por_año = (
+                movimientos.order_by()
+                .values('ejercicio__año')
+                .annotate(total=Sum(Movimiento.expresion_cantidad_real()))
+            )
+            for fila in por_año:
+                resultados.setdefault(fila['ejercicio__año'], {'caja': Decimal('0.00'), 'banco': Decimal('0.00')})
+                resultados[fila['ejercicio__año']][clave] = fila['total'] or Decimal('0.00')
+
+        saldos = {}
+        saldo_caja = saldo_banco = Decimal('0.00')
+        for año in sorted(resultados):
+            saldo_caja += resultados[año]['caja']
+            saldo_banco += resultados[año]['banco']
+            saldos[año] = {'caja': saldo_caja, 'banco': saldo_banco, 'total': saldo_caja + saldo_banco}
+        return saldos
+
     @property
     def saldo_total(self):
         """
@@ -150,6 +262,14 @@ class Ejercicio(UserTrackingMixin, models.Model):
         """
         return self.calcular_saldo_total()
 
+    @classmethod
+    def ajustar_saldo_banco(cls, ejercicio_id, importe):
+        """
+        Suma el importe al saldo bancario del ejercicio con un UPDATE atómico (F()),
+        sin leer ni guardar la fila completa.
+        """
+        cls.objects.filter(pk=ejercicio_id).update(saldo_banco=F('saldo_banco') + importe)
+
     def recalcular_saldos_cajas(self):
         """
         Recalcula los saldos de todas las cajas asociadas
@@ -264,6 +384,27 @@ class Concepto(UserTrackingMixin, models.Model):
 
         
 
+class CajaQuerySet(models.QuerySet):
+
+    def con_totales(self, ejercicio=None):
+        """
+        Anota ingresos_caja y gastos_caja (suma de los movimientos de cada caja,
+        opcionalmente solo de un ejercicio) en la misma consulta que obtiene las cajas.
+        """
+        filtro = Q() if ejercicio is None else Q(movimientos__ejercicio=ejercicio)
+        decimal = models.DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            ingresos_caja=Coalesce(
+                Sum('movimientos__cantidad', filter=filtro & Q(movimientos__concepto__es_gasto=False)),
+                Value(Decimal('0.00')), output_field=decimal
+            ),
+            gastos_caja=Coalesce(
+                Sum('movimientos__cantidad', filter=filtro & Q(movimientos__concepto__es_gasto=True)),
+                Value(Decimal('0.00')), output_field=decimal
+            ),
+        )
+
+
 class Caja(UserTrackingMixin, models.Model):
     """
     Representa una caja general
@@ -319,6 +460,8 @@ class Caja(UserTrackingMixin, models.Model):
         help_text="Fecha y hora de creación de la caja"
     )
 
+    objects = CajaQuerySet.as_manager()
+
     def clean(self):
         """Validación que evita modificar los saldos de una caja existente"""
         if self.pk:  # La caja ya existe
@@ -373,34 +516,22 @@ class Caja(UserTrackingMixin, models.Model):
         Inicializa el desglose de la caja con todas las denominaciones activas en 0
         """
         denominaciones = DenominacionEuro.objects.filter(activa=True)
-        for denominacion in denominaciones:
-            DesgloseCaja.objects.get_or_create(
-                caja=self,
-                denominacion=denominacion,
-                defaults={'cantidad': 0},
-                creado_por=self.creado_por
-            )
+        with sincronizacion_saldo_diferida():
+            for denominacion in denominaciones:
+                DesgloseCaja.objects.get_or_create(
+                    caja=self,
+                    denominacion=denominacion,
+                    defaults={'cantidad': 0},
+                    creado_por=self.creado_por
+                )
 
     def actualizar_desglose_movimiento(self, movimiento_caja):
         """
         Actualiza el desglose de la caja basándose en un movimiento específico
         """
-        for mov_dinero in movimiento_caja.movimientos_dinero.all():
-            desglose, created = DesgloseCaja.objects.get_or_create(
-                caja=self,
-                denominacion=mov_dinero.denominacion,
-                defaults={'cantidad': 0}
-            )
-            
-            # Aplicar el cambio neto
-            cantidad_neta = mov_dinero.cantidad_neta()
-            desglose.cantidad += cantidad_neta
-            
-            # Asegurar que no sea negativo
-            if desglose.cantidad < 0:
-                desglose.cantidad = 0
-            
-            desglose.save()
+        with sincronizacion_saldo_diferida():
+            for mov_dinero in movimiento_caja.movimientos_dinero.all():
+                DesgloseCaja.aplicar_delta(self.pk, mov_dinero.denominacion_id, mov_dinero.cantidad_neta())
 
     def obtener_desglose_actual(self):
         """
@@ -408,26 +539,49 @@ class Caja(UserTrackingMixin, models.Model):
         """
         return self.desglose.select_related('denominacion').order_by('-denominacion__valor')
 
+    @classmethod
+    def ajustar_saldo(cls, caja_id, importe):
+        """
+        Suma el importe al saldo de la caja con un UPDATE atómico (F()),
+        sin leer ni guardar la fila completa. No pasa por full_clean().
+        """
+        cls.objects.filter(pk=caja_id).update(saldo_caja=F('saldo_caja') + importe)
+
     def calcular_saldo_desde_desglose(self):
         """
         Calcula el saldo total basándose en el desglose actual
         """
-        total = Decimal('0.00')
-        for desglose in self.desglose.all():
-            total += desglose.valor_total()
-        return total
+        total = self.desglose.aggregate(total=Sum(DesgloseCaja.expresion_valor_total()))['total']
+        return total if total is not None else Decimal('0.00')
+
+    @classmethod
+    def sincronizar_saldo_desde_desglose(cls, caja_id):
+        """
+        Fija el saldo de la caja al valor de su desglose con un único UPDATE
+        (la suma se calcula en una subconsulta, sin cargar filas en Python).
+        """
+        total = DesgloseCaja.objects.filter(caja=OuterRef('pk')).values('caja').annotate(
+            total=Sum(DesgloseCaja.expresion_valor_total())
+        ).values('total')
+        cls.objects.filter(pk=caja_id).update(
+            saldo_caja=Coalesce(
+                Subquery(total, output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+                Value(Decimal('0.00'))
+            )
+        )
 
     def recalcular_desglose_completo(self):
         """
         Recalcula todo el desglose desde cero basándose en todos los movimientos
         """
-        # Reinicializar desglose
-        self.desglose.all().delete()
-        self.inicializar_desglose()
-        
-        # Aplicar todos los movimientos en orden cronológico
-        for movimiento in self.movimientos.order_by('fecha'):
-            self.actualizar_desglose_movimiento(movimiento)
+        with sincronizacion_saldo_diferida():
+            # Reinicializar desglose
+            self.desglose.all().delete()
+            self.inicializar_desglose()
+
+            # Aplicar todos los movimientos en orden cronológico
+            for movimiento in self.movimientos.order_by('fecha'):
+                self.actualizar_desglose_movimiento(movimiento)
 
     class Meta:
         verbose_name = "Caja"
@@ -487,8 +641,21 @@ class Movimiento(UserTrackingMixin, models.Model):
         """Devuelve la cantidad con signo correcto para cálculos de saldo"""
         return -self.cantidad if self.es_gasto() else self.cantidad
 
+    @staticmethod
+    def expresion_cantidad_real():
+        """Expresión equivalente a cantidad_real() para usar en consultas agregadas"""
+        return Case(
+            When(concepto__es_gasto=True, then=-F('cantidad')),
+            default=F('cantidad'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        )
+
 
 class MovimientoCaja(Movimiento):
+
+    # Ruta hasta el campamento y tipo de saldo usados por los agregados y los snapshots
+    CAMPO_CAMPAMENTO = 'caja__campamento'
+    TIPO_SALDO = 'caja'
         
     ejercicio = models.ForeignKey(
         'Ejercicio',
@@ -564,6 +731,9 @@ class MovimientoCaja(Movimiento):
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
 
+    def campamento_saldo_id(self):
+        return self.caja.campamento_id
+
     def __str__(self):
         signo = "-" if self.es_gasto() else "+"
         return f"{self.fecha.strftime('%Y-%m-%d %H:%M')} | {self.caja.nombre} | {self.turno} | {signo}{self.cantidad:.2f}€ | {self.concepto}"
@@ -572,6 +742,14 @@ class MovimientoCaja(Movimiento):
         verbose_name = "Movimiento de caja"
         verbose_name_plural = "Movimientos de caja"
         ordering = ['-fecha']
+        indexes = [
+            # Listado del registro (paginado por fecha, id), evolución del saldo y agregados del ejercicio
+            models.Index(fields=['ejercicio', 'fecha', 'id'], name='movcaja_ejer_fecha_idx'),
+            # Movimientos y gráficos de una caja
+            models.Index(fields=['caja', 'fecha', 'id'], name='movcaja_caja_fecha_idx'),
+            # Tablas: totales del ejercicio agrupados por turno y concepto
+            models.Index(fields=['ejercicio', 'turno', 'concepto'], name='movcaja_ejer_tur_con_idx'),
+        ]
         
         
 class MovimientoCajaDeposito(UserTrackingMixin, models.Model):
@@ -730,6 +908,9 @@ class MovimientoBanco(Movimiento):
     Representa un movimiento bancario asociado a un ejercicio.
     Los movimientos bancarios afectan el saldo_banco del ejercicio, no de una caja específica.
     """
+
+    CAMPO_CAMPAMENTO = 'campamento'
+    TIPO_SALDO = 'banco'
     
     campamento = models.ForeignKey(
         'Campamento',
@@ -813,6 +994,9 @@ class MovimientoBanco(Movimiento):
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
 
+    def campamento_saldo_id(self):
+        return self.campamento_id
+
     def __str__(self):
         signo = "-" if self.es_gasto() else "+"
         return f"{self.fecha.strftime('%Y-%m-%d %H:%M')} | {self.ejercicio.nombre} | {signo}{self.cantidad:.2f}€ | {self.concepto}"
@@ -821,6 +1005,14 @@ class MovimientoBanco(Movimiento):
         verbose_name = "Movimiento de banco"
         verbose_name_plural = "Movimientos de banco"
         ordering = ['-fecha']
+        indexes = [
+            # Listado del registro (paginado por fecha, id), evolución del saldo y agregados del ejercicio
+            models.Index(fields=['ejercicio', 'fecha', 'id'], name='movbanco_ejer_fecha_idx'),
+            # Mismo listado y tablas filtrados por campamento
+            models.Index(fields=['ejercicio', 'campamento', 'fecha'], name='movbanco_ejer_camp_fecha_idx'),
+            # Tablas: totales del campamento agrupados por turno y concepto
+            models.Index(fields=['ejercicio', 'campamento', 'turno', 'concepto'], name='movbanco_ejer_camp_tc_idx'),
+        ]
 
 
 class DenominacionEuro(UserTrackingMixin, models.Model):
@@ -911,6 +1103,58 @@ class DesgloseCaja(UserTrackingMixin, models.Model):
     def valor_total(self):
         """Calcula el valor total de esta denominación"""
         return self.cantidad * self.denominacion.valor
+
+    @staticmethod
+    def expresion_valor_total():
+        """Expresión equivalente a valor_total() para usar en consultas agregadas"""
+        return ExpressionWrapper(
+            F('cantidad') * F('denominacion__valor'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        )
+
+    @classmethod
+    def aplicar_delta(cls, caja_id, denominacion_id, unidades):
+        """
+        Suma (o resta) unidades a una denominación de la caja con un UPDATE atómico,
+        sin bajar de 0, y solicita la sincronización del saldo de la caja.
+        """
+        fila = cls.objects.filter(caja_id=caja_id, denominacion_id=denominacion_id)
+        if not fila.update(cantidad=Greatest(F('cantidad') + unidades, Value(0))):
+            _, creado = cls.objects.get_or_create(
+                caja_id=caja_id,
+                denominacion_id=denominacion_id,
+                defaults={'cantidad': max(unidades, 0)}
+            )
+            if creado:
+                # El post_save del desglose ya ha solicitado la sincronización
+                return
+            fila.update(cantidad=Greatest(F('cantidad') + unidades, Value(0)))
+        solicitar_sincronizacion_saldo(caja_id)
+
+    @classmethod
+    def aplicar_deltas(cls, caja_id, deltas):
+        """
+        Aplica de una vez los cambios de unidades {denominacion_id: unidades} de una caja:
+        una lectura bloqueante, un único bulk_update (UPDATE ... CASE) y una sincronización del saldo.
+        """
+        deltas = {denominacion_id: unidades for denominacion_id, unidades in deltas.items() if unidades}
+        if not deltas:
+            return
+
+        with transaction.atomic():
+            existentes = list(
+                cls.objects.select_for_update().filter(caja_id=caja_id, denominacion_id__in=deltas)
+            )
+            for desglose in existentes:
+                desglose.cantidad = max(desglose.cantidad + deltas.pop(desglose.denominacion_id), 0)
+            cls.objects.bulk_update(existentes, ['cantidad'])
+
+            # Denominaciones que la caja todavía no tenía en su desglose
+            cls.objects.bulk_create([
+                cls(caja_id=caja_id, denominacion_id=denominacion_id, cantidad=max(unidades, 0))
+                for denominacion_id, unidades in deltas.items()
+            ])
+            solicitar_sincronizacion_saldo(caja_id)
     
     def __str__(self):
         return f"{self.caja.nombre} - {self.cantidad}x {self.denominacion}"
@@ -926,18 +1170,15 @@ class MovimientoDinero(UserTrackingMixin, models.Model):
     """
     Representa el movimiento específico de denominaciones en un movimiento de caja
     """
-    content_type = models.ForeignKey(
-        ContentType,
+    # Al borrar un MovimientoCaja su desglose se revierte en bloque en el pre_delete
+    # (revertir_desglose_on_movimiento_caja_delete) y el CASCADE borra estas filas
+    movimiento_caja = models.ForeignKey(
+        'MovimientoCaja',
         on_delete=models.CASCADE,
-        verbose_name="Tipo de movimiento de caja"
+        related_name='movimientos_dinero',
+        verbose_name="Movimiento de Caja"
     )
     
-    object_id = models.PositiveIntegerField(
-        verbose_name="ID del objeto"
-    )
-    
-    movimiento_caja = GenericForeignKey('content_type', 'object_id')
-    
     denominacion = models.ForeignKey(
         DenominacionEuro,
         on_delete=models.CASCADE,
@@ -978,18 +1219,74 @@ class MovimientoDinero(UserTrackingMixin, models.Model):
     def valor_neto(self):
         """Calcula el valor neto del movimiento"""
         return self.cantidad_neta() * self.denominacion.valor
+
+    @classmethod
+    def crear_en_bloque(cls, movimiento_caja, datos, usuario=None):
+        """
+        Crea el desglose de un movimiento de caja con un único bulk_create y aplica
+        los cambios al desglose de la caja en bloque (sin señales por denominación).
+        `datos` es la lista devuelta por DesgloseDineroForm.get_movimientos_dinero_data().
+        """
+        movimientos = [
+            cls(
+                movimiento_caja=movimiento_caja,
+                denominacion=dato['denominacion'],
+                cantidad_entrada=dato['cantidad_entrada'],
+                cantidad_salida=dato['cantidad_salida'],
+                creado_por=usuario
+            )
+            for dato in datos
+        ]
+        deltas = {}
+        for movimiento in movimientos:
+            deltas[movimiento.denominacion_id] = deltas.get(movimiento.denominacion_id, 0) + movimiento.cantidad_neta()
+
+        with transaction.atomic():
+            cls.objects.bulk_create(movimientos)
+            DesgloseCaja.aplicar_deltas(movimiento_caja.caja_id, deltas)
+        return movimientos
+
+    @classmethod
+    def de_caja(cls, caja_id, ejercicio=None):
+        """
+        Movimientos de dinero de los movimientos de una caja (opcionalmente de un
+        ejercicio), con un join en lugar de recorrer cada movimiento.
+        """
+        movimientos = cls.objects.filter(movimiento_caja__caja_id=caja_id)
+        if ejercicio is not None:
+            movimientos = movimientos.filter(movimiento_caja__ejercicio=ejercicio)
+        return movimientos
+
+    @classmethod
+    def revertir_desglose(cls, movimiento_caja):
+        """Resta del desglose de la caja, en bloque, las denominaciones de un movimiento de caja"""
+        deltas = {}
+        for denominacion_id, entrada, salida in cls.objects.filter(movimiento_caja=movimiento_caja).values_list(
+            'denominacion_id', 'cantidad_entrada', 'cantidad_salida'
+        ):
+            deltas[denominacion_id] = deltas.get(denominacion_id, 0) - (entrada - salida)
+        DesgloseCaja.aplicar_deltas(movimiento_caja.caja_id, deltas)
+
+    @classmethod
+    def eliminar_de_movimiento(cls, movimiento_caja):
+        """
+        Elimina el desglose de un movimiento de caja y lo revierte en el desglose
+        de la caja en bloque.
+        """
+        with transaction.atomic(), desglose_revertido_en_bloque(movimiento_caja.pk):
+            # El desglose se revierte aquí de una vez, no en el post_delete de cada fila
+            cls.revertir_desglose(movimiento_caja)
+            cls.objects.filter(movimiento_caja=movimiento_caja).delete()
     
     def __str__(self):
         return f"{self.movimiento_caja} - {self.denominacion}: +{self.cantidad_entrada}/-{self.cantidad_salida}"
     
-    def debug(self):
-        print("Generic FK resolved as:", self.movimiento_caja)
-        print("content_type:", self.content_type)
-        print("object_id:", self.object_id)
-
     class Meta:
         verbose_name = "Movimiento de Dinero"
         verbose_name_plural = "Movimientos de Dinero"
+        indexes = [
+            models.Index(fields=['movimiento_caja', 'denominacion'], name='movdinero_mov_denom_idx'),
+        ]
 
 
 class ViaMovimientoBanco(UserTrackingMixin, models.Model):
@@ -1116,77 +1413,606 @@ class Campamento(UserTrackingMixin, models.Model):
         ordering = ['nombre']
 
 
+class SaldoSnapshot(models.Model):
+    """
+    Saldo materializado por ejercicio, campamento y tipo (caja o banco).
+    Se mantiene de forma incremental desde las señales de los movimientos, de modo que
+    leer un saldo no requiere recorrer el histórico. saldo_cierre es el saldo acumulado
+    de todos los ejercicios hasta el año de este, igual que Ejercicio.calcular_saldo_cajas.
+    """
+    TIPO_CAJA = 'caja'
+    TIPO_BANCO = 'banco'
+    TIPOS = [
+        (TIPO_CAJA, 'Caja'),
+        (TIPO_BANCO, 'Banco'),
+    ]
+
+    ejercicio = models.ForeignKey(
+        'Ejercicio',
+        on_delete=models.CASCADE,
+        verbose_name="Ejercicio",
+        related_name="saldos_snapshot"
+    )
+
+    campamento = models.ForeignKey(
+        'Campamento',
+        on_delete=models.CASCADE,
+        verbose_name="Campamento",
+        related_name="saldos_snapshot"
+    )
+
+    tipo = models.CharField(
+        max_length=5,
+        choices=TIPOS,
+        verbose_name="Tipo de saldo"
+    )
+
+    ingresos = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name="Ingresos del ejercicio"
+    )
+
+    gastos = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name="Gastos del ejercicio"
+    )
+
+    saldo_cierre = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name="Saldo de cierre",
+        help_text="Saldo acumulado desde el primer ejercicio hasta el final de este"
+    )
+
+    actualizado_en = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Actualizado en"
+    )
+
+    def resultado(self):
+        """Resultado del ejercicio (ingresos - gastos)"""
+        return self.ingresos - self.gastos
+
+    def __str__(self):
+        return f"{self.ejercicio.nombre} | {self.campamento.nombre} | {self.get_tipo_display()}: {self.saldo_cierre:.2f}€"
+
+    @classmethod
+    def registrar_movimiento(cls, ejercicio_id, año, campamento_id, tipo, cantidad, es_gasto, signo=1):
+        """
+        Aplica (signo=1) o revierte (signo=-1) un movimiento en el snapshot de su ejercicio
+        y en el saldo de cierre de ese ejercicio y de todos los posteriores.
+        """
+        importe = cantidad * signo
+        neto = -importe if es_gasto else importe
+        campo = 'gastos' if es_gasto else 'ingresos'
+
+        with transaction.atomic():
+            snapshot = cls._obtener_o_crear(ejercicio_id, año, campamento_id, tipo)
+            cls.objects.filter(pk=snapshot.pk).update(**{campo: F(campo) + importe})
+            cls.objects.filter(
+                campamento_id=campamento_id,
+                tipo=tipo,
+                ejercicio__año__gte=año
+            ).update(saldo_cierre=F('saldo_cierre') + neto)
+
+    @classmethod
+    def _obtener_o_crear(cls, ejercicio_id, año, campamento_id, tipo):
+        """
+        Obtiene el snapshot o lo crea arrastrando el saldo de los ejercicios anteriores.
+        Debe llamarse dentro de una transacción.
+        """
+        snapshot = cls.objects.filter(ejercicio_id=ejercicio_id, campamento_id=campamento_id, tipo=tipo).first()
+        if snapshot:
+            return snapshot
+        # Bloquear los snapshots anteriores para que el saldo arrastrado no cambie mientras se crea
+        anteriores = cls.objects.select_for_update(of=('self',)).filter(
+            campamento_id=campamento_id,
+            tipo=tipo,
+            ejercicio__año__lte=año
+        ).values_list('ingresos', 'gastos')
+        saldo_previo = sum((ingresos - gastos for ingresos, gastos in anteriores), Decimal('0.00'))
+        snapshot, _ = cls.objects.get_or_create(
+            ejercicio_id=ejercicio_id,
+            campamento_id=campamento_id,
+            tipo=tipo,
+            defaults={'saldo_cierre': saldo_previo}
+        )
+        return snapshot
+
+    @classmethod
+    def crear_faltantes(cls, ejercicios=None, campamentos=None):
+        """
+        Crea los snapshots que falten para cada combinación de ejercicio, campamento y tipo,
+        de forma que cualquier lectura de saldo sea una consulta directa a esta tabla.
+        """
+        ejercicios = list(ejercicios if ejercicios is not None else Ejercicio.objects.all())
+        campamentos = list(campamentos if campamentos is not None else Campamento.objects.all())
+        if not ejercicios or not campamentos:
+            return []
+
+        existentes = set(cls.objects.filter(
+            ejercicio__in=ejercicios,
+            campamento__in=campamentos
+        ).values_list('ejercicio_id', 'campamento_id', 'tipo'))
+
+        nuevos = []
+        for ejercicio in ejercicios:
+            acumulados = {
+                (fila['campamento_id'], fila['tipo']): fila['total']
+                for fila in cls.objects.filter(ejercicio__año__lte=ejercicio.año)
+                .values('campamento_id', 'tipo')
+                .annotate(total=Sum(F('ingresos') - F('gastos')))
+            }
+            for campamento in campamentos:
+                for tipo, _ in cls.TIPOS:
+                    if (ejercicio.id, campamento.id, tipo) in existentes:
+                        continue
+                    nuevos.append(cls(
+                        ejercicio=ejercicio,
+                        campamento=campamento,
+                        tipo=tipo,
+                        saldo_cierre=acumulados.get((campamento.id, tipo)) or Decimal('0.00')
+                    ))
+        return cls.objects.bulk_create(nuevos, ignore_conflicts=True)
+
+    @classmethod
+    def recalcular_cierres(cls):
+        """
+        Recalcula el saldo de cierre de todos los snapshots a partir de sus ingresos y gastos.
+        Hace falta cuando cambia el año de un ejercicio, porque cambia qué ejercicios
+        se acumulan en cada cierre.
+        """
+        resultados = {}
+        filas = cls.objects.order_by().values('campamento_id', 'tipo', 'ejercicio__año').annotate(
+            resultado=Sum(F('ingresos') - F('gastos'))
+        )
+        for fila in filas:
+            resultados.setdefault((fila['campamento_id'], fila['tipo']), {})[fila['ejercicio__año']] = (
+                (fila['resultado'] or Decimal('0.00')).quantize(Decimal('0.01'))
+            )
+
+        with transaction.atomic():
+            for (campamento_id, tipo), por_año in resultados.items():
+                acumulado = Decimal('0.00')
+                for año in sorted(por_año):
+                    acumulado += por_año[año]
+                    cls.objects.filter(
+                        campamento_id=campamento_id, tipo=tipo, ejercicio__año=año
+                    ).update(saldo_cierre=acumulado)
+
+    @classmethod
+    def calcular_desde_movimientos(cls, using=None):
+        """
+        Recalcula desde cero todos los snapshots a partir de los movimientos.
+        Devuelve instancias sin guardar, una por ejercicio, campamento y tipo.
+        """
+        totales = {}
+        for modelo in (MovimientoCaja, MovimientoBanco):
+            filas = modelo.objects.using(using).order_by().values('ejercicio_id', modelo.CAMPO_CAMPAMENTO).annotate(
+                total_ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+                total_gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+            )
+            for fila in filas:
+                clave = (fila['ejercicio_id'], fila[modelo.CAMPO_CAMPAMENTO], modelo.TIPO_SALDO)
+                # SQLite suma los decimales en coma flotante: se redondea a céntimos
+                totales[clave] = (
+                    (fila['total_ingresos'] or Decimal('0.00')).quantize(Decimal('0.01')),
+                    (fila['total_gastos'] or Decimal('0.00')).quantize(Decimal('0.01')),
+                )
+
+        ejercicios = list(Ejercicio.objects.using(using).order_by('año', 'id').values_list('id', 'año'))
+        años_ejercicio = dict(ejercicios)
+        campamentos = list(Campamento.objects.using(using).values_list('id', flat=True))
+
+        # Resultado de cada año (puede haber varios ejercicios con el mismo año)
+        resultado_año = {}
+        for (ejercicio_id, campamento_id, tipo), (ingresos, gastos) in totales.items():
+            clave = (campamento_id, tipo, años_ejercicio[ejercicio_id])
+            resultado_año[clave] = resultado_año.get(clave, Decimal('0.00')) + ingresos - gastos
+
+        años = sorted({año for _, año in ejercicios})
+        cierre = {}
+        for campamento_id in campamentos:
+            for tipo, _ in cls.TIPOS:
+                acumulado = Decimal('0.00')
+                for año in años:
+                    acumulado += resultado_año.get((campamento_id, tipo, año), Decimal('0.00'))
+                    cierre[(campamento_id, tipo, año)] = acumulado
+
+        snapshots = []
+        for ejercicio_id, año in ejercicios:
+            for campamento_id in campamentos:
+                for tipo, _ in cls.TIPOS:
+                    ingresos, gastos = totales.get((ejercicio_id, campamento_id, tipo), (Decimal('0.00'), Decimal('0.00')))
+                    snapshots.append(cls(
+                        ejercicio_id=ejercicio_id,
+                        campamento_id=campamento_id,
+                        tipo=tipo,
+                        ingresos=ingresos,
+                        gastos=gastos,
+                        saldo_cierre=cierre[(campamento_id, tipo, año)]
+                    ))
+        return snapshots
+
+    class Meta:
+        verbose_name = "Snapshot de saldo"
+        verbose_name_plural = "Snapshots de saldo"
+        unique_together = [['ejercicio', 'campamento', 'tipo']]
+        ordering = ['-ejercicio__año', 'campamento__nombre', 'tipo']
+
+
+
+class TrabajoExportacionQuerySet(models.QuerySet):
+    def pendientes(self):
+        return self.filter(estado=TrabajoExportacion.ESTADO_PENDIENTE).order_by('creado_en', 'id')
+
+    def reclamar(self, trabajo_id):
+        """
+        Marca el trabajo como en curso si sigue pendiente. Devuelve False si otro
+        worker ya lo ha reclamado, de modo que varios workers pueden compartir la cola.
+        """
+        ahora = timezone.now()
+        return self.filter(pk=trabajo_id, estado=TrabajoExportacion.ESTADO_PENDIENTE).update(
+            estado=TrabajoExportacion.ESTADO_EN_CURSO,
+            iniciado_en=ahora,
+            latido_en=ahora
+        ) == 1
+
+    def bloqueados(self, limite):
+        """
+        Trabajos en curso cuyo worker no ha dado señales de vida desde `limite`.
+        Se mira el último latido, no el inicio, para no reencolar exportaciones
+        largas que siguen avanzando.
+        """
+        return self.filter(estado=TrabajoExportacion.ESTADO_EN_CURSO).filter(
+            models.Q(latido_en__lt=limite) | models.Q(latido_en__isnull=True, iniciado_en__lt=limite)
+        )
+
+
+class TrabajoExportacion(models.Model):
+    """
+    Exportación de una tabla de DYNAMIC_DATATB solicitada desde la web y generada en
+    segundo plano por el comando procesar_exportaciones, que escribe el fichero por
+    bloques en el almacenamiento de ficheros y va actualizando el progreso.
+    """
+    FORMATO_CSV = 'csv'
+    FORMATO_XLSX = 'xlsx'
+    FORMATO_PARQUET = 'parquet'
+    FORMATOS = [
+        (FORMATO_CSV, 'CSV'),
+        (FORMATO_XLSX, 'Excel (XLSX)'),
+        (FORMATO_PARQUET, 'Parquet'),
+    ]
+
+    ESTADO_PENDIENTE = 'pendiente'
+    ESTADO_EN_CURSO = 'en_curso'
+    ESTADO_COMPLETADO = 'completado'
+    ESTADO_ERROR = 'error'
+    ESTADOS = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_EN_CURSO, 'En curso'),
+        (ESTADO_COMPLETADO, 'Completado'),
+        (ESTADO_ERROR, 'Error'),
+    ]
+
+    ruta = models.CharField(
+        max_length=255,
+        verbose_name="Tabla",
+        help_text="Clave de DYNAMIC_DATATB que se exporta"
+    )
+
+    formato = models.CharField(
+        max_length=10,
+        choices=FORMATOS,
+        default=FORMATO_CSV,
+        verbose_name="Formato"
+    )
+
+    parametros = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Parámetros",
+        help_text="Búsqueda y orden de la tabla en el momento de la solicitud"
+    )
+
+    estado = models.CharField(
+        max_length=10,
+        choices=ESTADOS,
+        default=ESTADO_PENDIENTE,
+        verbose_name="Estado"
+    )
+
+    total_filas = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Total de filas"
+    )
+
+    filas_procesadas = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Filas procesadas"
+    )
+
+    archivo = models.FileField(
+        upload_to='exportaciones/',
+        blank=True,
+        null=True,
+        verbose_name="Archivo"
+    )
+
+    error = models.TextField(
+        blank=True,
+        verbose_name="Error"
+    )
+
+    creado_por = models.ForeignKey(
+        'auth.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="Creado por",
+        related_name="trabajos_exportacion"
+    )
+
+    creado_en = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Creado en"
+    )
+
+    iniciado_en = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Iniciado en"
+    )
+
+    completado_en = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Completado en"
+    )
+
+    latido_en = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Último latido",
+        help_text="Última vez que el worker informó de progreso; sin latido reciente se reencola"
+    )
+
+    objects = TrabajoExportacionQuerySet.as_manager()
+
+    def progreso(self):
+        """Porcentaje de filas escritas (100 cuando el trabajo ha terminado)"""
+        if self.estado == self.ESTADO_COMPLETADO:
+            return 100
+        if not self.total_filas:
+            return 0
+        return min(99, self.filas_procesadas * 100 // self.total_filas)
+
+    def nombre_archivo(self):
+        """Nombre con el que se descarga el fichero"""
+        return f"{self.ruta.lower()}.{self.formato}"
+
+    def __str__(self):
+        return f"{self.ruta} ({self.get_formato_display()}) - {self.get_estado_display()}"
+
+    class Meta:
+        verbose_name = "Trabajo de exportación"
+        verbose_name_plural = "Trabajos de exportación"
+        ordering = ['-creado_en']
+        indexes = [
+            models.Index(fields=['estado', 'creado_en'], name='trabajoexp_estado_idx'),
+        ]
+
+# Cajas cuyo saldo está pendiente de sincronizar con el desglose, por hilo
+_sincronizacion_diferida = local()
+
+
+@contextmanager
+def sincronizacion_saldo_diferida():
+    """
+    Agrupa varias escrituras del desglose en una transacción y sincroniza el saldo
+    de cada caja afectada una sola vez al final, en lugar de tras cada denominación.
+    Admite anidamiento: solo sincroniza el bloque más externo.
+    """
+    if getattr(_sincronizacion_diferida, 'cajas', None) is not None:
+        yield
+        return
+
+    _sincronizacion_diferida.cajas = set()
+    try:
+        with transaction.atomic():
+            yield
+            cajas = _sincronizacion_diferida.cajas
+            _sincronizacion_diferida.cajas = None
+            for caja_id in cajas:
+                Caja.sincronizar_saldo_desde_desglose(caja_id)
+    finally:
+        _sincronizacion_diferida.cajas = None
+
+
+def marcar_desglose_revertido(movimiento_caja_id):
+    """
+    Marca el desglose de un movimiento de caja como revertido en bloque para que el
+    post_delete de cada MovimientoDinero no vuelva a aplicarlo fila a fila.
+    """
+    revertidos = getattr(_sincronizacion_diferida, 'desgloses_revertidos', None)
+    if revertidos is None:
+        revertidos = _sincronizacion_diferida.desgloses_revertidos = set()
+    revertidos.add(movimiento_caja_id)
+
+
+def desmarcar_desglose_revertido(movimiento_caja_id):
+    getattr(_sincronizacion_diferida, 'desgloses_revertidos', set()).discard(movimiento_caja_id)
+
+
+@contextmanager
+def desglose_revertido_en_bloque(movimiento_caja_id):
+    """Marca el desglose del movimiento de caja como revertido mientras dura el bloque"""
+    marcar_desglose_revertido(movimiento_caja_id)
+    try:
+        yield
+    finally:
+        desmarcar_desglose_revertido(movimiento_caja_id)
+
+
+def desglose_revertido(movimiento_caja_id):
+    """Indica si el desglose del movimiento de caja se está revirtiendo en bloque"""
+    return movimiento_caja_id in getattr(_sincronizacion_diferida, 'desgloses_revertidos', ())
+
+
+def solicitar_sincronizacion_saldo(caja_id):
+    """Sincroniza el saldo de la caja ahora o al final del bloque diferido en curso"""
+    cajas = getattr(_sincronizacion_diferida, 'cajas', None)
+    if cajas is not None:
+        cajas.add(caja_id)
+    else:
+        Caja.sincronizar_saldo_desde_desglose(caja_id)
+
+
+def _actualizar_snapshot_on_save(instance, created):
+    """Refleja en SaldoSnapshot el alta o la edición de un movimiento"""
+    if not created:
+        anterior = getattr(instance, '_estado_anterior', None)
+        if not anterior:
+            return
+        actual = (instance.ejercicio_id, instance.campamento_saldo_id(), instance.cantidad, instance.es_gasto())
+        if actual == (anterior['ejercicio_id'], anterior['campamento_saldo_id'], anterior['cantidad'], anterior['concepto__es_gasto']):
+            return
+        SaldoSnapshot.registrar_movimiento(
+            anterior['ejercicio_id'], anterior['ejercicio__año'], anterior['campamento_saldo_id'],
+            instance.TIPO_SALDO, anterior['cantidad'], anterior['concepto__es_gasto'], signo=-1
+        )
+
+    SaldoSnapshot.registrar_movimiento(
+        instance.ejercicio_id, instance.ejercicio.año, instance.campamento_saldo_id(),
+        instance.TIPO_SALDO, instance.cantidad, instance.es_gasto()
+    )
+
+
+def _actualizar_snapshot_on_delete(instance):
+    """Revierte en SaldoSnapshot un movimiento que se elimina"""
+    SaldoSnapshot.registrar_movimiento(
+        instance.ejercicio_id, instance.ejercicio.año, instance.campamento_saldo_id(),
+        instance.TIPO_SALDO, instance.cantidad, instance.es_gasto(), signo=-1
+    )
+
+
+@receiver(pre_save, sender=MovimientoBanco)
+@receiver(pre_save, sender=MovimientoCaja)
+def guardar_estado_anterior_movimiento(sender, instance, **kwargs):
+    """Guarda los valores previos de un movimiento editado para poder ajustar los snapshots"""
+    instance._estado_anterior = None
+    if instance.pk:
+        instance._estado_anterior = sender.objects.filter(pk=instance.pk).values(
+            'ejercicio_id', 'ejercicio__año', 'cantidad', 'concepto__es_gasto',
+            campamento_saldo_id=F(sender.CAMPO_CAMPAMENTO)
+        ).first()
+
+
 @receiver(post_save, sender=MovimientoBanco)
 def actualizar_saldo_banco_on_save(sender, instance, created, **kwargs):
-    """Actualiza el saldo bancario del ejercicio cuando se crea un movimiento de banco"""
-    if created:
-        # Actualizar saldo bancario del ejercicio
-        instance.ejercicio.saldo_banco += instance.cantidad_real()
-        instance.ejercicio.save()
+    """Actualiza el saldo bancario del ejercicio y su snapshot cuando se guarda un movimiento de banco"""
+    with transaction.atomic():
+        if created:
+            # Incremento atómico en la base de datos, seguro con varios workers
+            Ejercicio.ajustar_saldo_banco(instance.ejercicio_id, instance.cantidad_real())
+        _actualizar_snapshot_on_save(instance, created)
 
 
 @receiver(pre_delete, sender=MovimientoBanco)
 def actualizar_saldo_banco_on_delete(sender, instance, **kwargs):
     """Actualiza el saldo bancario del ejercicio cuando se elimina un movimiento de banco"""
-    # Revertir el movimiento bancario del ejercicio
-    instance.ejercicio.saldo_banco -= instance.cantidad_real()
-    instance.ejercicio.save()
+    with transaction.atomic():
+        # Revertir el movimiento bancario del ejercicio
+        Ejercicio.ajustar_saldo_banco(instance.ejercicio_id, -instance.cantidad_real())
+        _actualizar_snapshot_on_delete(instance)
 
 
 # Señales Django para actualizar el saldo de la caja automáticamente
 @receiver(post_save, sender=MovimientoCaja)
 def actualizar_saldo_caja_on_save(sender, instance, created, **kwargs):
-    """Actualiza el saldo de caja cuando se crea un movimiento de caja"""
-    if created:
-        # Actualizar saldo de caja
-        instance.caja.saldo_caja += instance.cantidad_real()
-        instance.caja.save(skip_validation=True)
+    """Actualiza el saldo de caja y su snapshot cuando se guarda un movimiento de caja"""
+    with transaction.atomic():
+        if created:
+            # Incremento atómico en la base de datos, seguro con varios workers
+            Caja.ajustar_saldo(instance.caja_id, instance.cantidad_real())
+        _actualizar_snapshot_on_save(instance, created)
 
 
 @receiver(pre_delete, sender=MovimientoCaja)
 def actualizar_saldo_caja_on_delete(sender, instance, **kwargs):
     """Actualiza el saldo de caja cuando se elimina un movimiento de caja""" 
-    # Actualizar saldo de caja
-    instance.caja.saldo_caja -= instance.cantidad_real()
-    instance.caja.save(skip_validation=True)
+    with transaction.atomic():
+        # Revertir el movimiento de la caja
+        Caja.ajustar_saldo(instance.caja_id, -instance.cantidad_real())
+        _actualizar_snapshot_on_delete(instance)
+
+
+@receiver(pre_save, sender=Ejercicio)
+def guardar_año_anterior_ejercicio(sender, instance, **kwargs):
+    """Guarda el año previo de un ejercicio editado para detectar si cambia"""
+    instance._año_anterior = None
+    if instance.pk:
+        instance._año_anterior = sender.objects.filter(pk=instance.pk).values_list('año', flat=True).first()
+
+
+@receiver(post_save, sender=Ejercicio)
+def recalcular_cierres_on_cambio_año(sender, instance, created, **kwargs):
+    """Al cambiar el año de un ejercicio cambian los saldos de cierre acumulados"""
+    anterior = getattr(instance, '_año_anterior', None)
+    if not created and anterior is not None and anterior != instance.año:
+        SaldoSnapshot.recalcular_cierres()
+
+
+@receiver(post_save, sender=Ejercicio)
+@receiver(post_save, sender=Campamento)
+def crear_snapshots_saldo(sender, instance, created, **kwargs):
+    """Crea los snapshots de saldo de un ejercicio o campamento nuevo"""
+    if created:
+        if sender is Ejercicio:
+            SaldoSnapshot.crear_faltantes(ejercicios=[instance])
+        else:
+            SaldoSnapshot.crear_faltantes(campamentos=[instance])
     
 
 @receiver(pre_delete, sender=MovimientoCaja)
-def eliminar_movimientos_dinero_relacionados(sender, instance, **kwargs):
-    ct = ContentType.objects.get_for_model(instance)
-    MovimientoDinero.objects.filter(content_type=ct, object_id=instance.id).delete()
+def revertir_desglose_on_movimiento_caja_delete(sender, instance, **kwargs):
+    """
+    Revierte de una vez el desglose del movimiento de caja. El CASCADE borra después
+    sus MovimientoDinero, y el post_delete de cada fila no vuelve a aplicarlo.
+    """
+    MovimientoDinero.revertir_desglose(instance)
+    marcar_desglose_revertido(instance.pk)
+
+
+@receiver(post_delete, sender=MovimientoCaja)
+def desmarcar_desglose_on_movimiento_caja_delete(sender, instance, **kwargs):
+    desmarcar_desglose_revertido(instance.pk)
 
 
 @receiver(post_save, sender=MovimientoDinero)
 def actualizar_desglose_on_movimiento_dinero_save(sender, instance, created, **kwargs):
     if created:
         movimiento_caja = instance.movimiento_caja
-
-        desglose, created_desglose = DesgloseCaja.objects.get_or_create(
-            caja=movimiento_caja.caja,
-            denominacion=instance.denominacion,
-            defaults={'cantidad': 0}
-        )
-        desglose.cantidad += instance.cantidad_neta()
-        if desglose.cantidad < 0:
-            desglose.cantidad = 0
-        desglose.save()
+        DesgloseCaja.aplicar_delta(movimiento_caja.caja_id, instance.denominacion_id, instance.cantidad_neta())
 
 
 @receiver(post_delete, sender=MovimientoDinero)
 def actualizar_desglose_on_movimiento_dinero_delete(sender, instance, **kwargs):
     """Actualiza el desglose cuando se elimina un MovimientoDinero"""
+    if desglose_revertido(instance.movimiento_caja_id):
+        return
     movimiento_caja = instance.movimiento_caja
-
-    desglose = DesgloseCaja.objects.filter(
-        caja=movimiento_caja.caja,
-        denominacion=instance.denominacion
-    ).first()
-    if desglose:
-        desglose.cantidad -= instance.cantidad_neta()
-        if desglose.cantidad < 0:
-            desglose.cantidad = 0
-        desglose.save()
+    DesgloseCaja.objects.filter(
+        caja_id=movimiento_caja.caja_id,
+        denominacion_id=instance.denominacion_id
+    ).update(cantidad=Greatest(F('cantidad') - instance.cantidad_neta(), Value(0)))
+    solicitar_sincronizacion_saldo(movimiento_caja.caja_id)
 
 
 @receiver(post_save, sender=Caja)
@@ -1199,22 +2025,10 @@ def inicializar_desglose_caja(sender, instance, created, **kwargs):
 @receiver(post_save, sender=DesgloseCaja)
 def actualizar_saldo_on_desglose_save(sender, instance, created, **kwargs):
     """Actualiza el saldo de caja cuando se modifica el desglose"""
-    # Calcular el nuevo saldo basado en el desglose total
-    nuevo_saldo_caja = instance.caja.calcular_saldo_desde_desglose()
-    
-    # Actualizar el saldo de caja
-    if instance.caja.saldo_caja != nuevo_saldo_caja:
-        instance.caja.saldo_caja = nuevo_saldo_caja
-        instance.caja.save(skip_validation=True)
+    solicitar_sincronizacion_saldo(instance.caja_id)
 
 
 @receiver(post_delete, sender=DesgloseCaja)
 def actualizar_saldo_on_desglose_delete(sender, instance, **kwargs):
     """Actualiza el saldo de caja cuando se elimina un desglose"""
-    # Calcular el nuevo saldo basado en el desglose restante
-    nuevo_saldo_caja = instance.caja.calcular_saldo_desde_desglose()
-    
-    # Actualizar el saldo de caja
-    if instance.caja.saldo_caja != nuevo_saldo_caja:
-        instance.caja.saldo_caja = nuevo_saldo_caja
-        instance.caja.save(skip_validation=True)
+    solicitar_sincronizacion_saldo(instance.caja_id)
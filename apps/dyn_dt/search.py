@@ -0,0 +1,379 @@
+"""
+Search backends for the dynamic datatable search box.
+
+Each DYNAMIC_DATATB entry picks one with its 'search' option:
+
+    'icontains' (default)  ORs an icontains lookup over the non-FK fields.
+    'fulltext'             Matches the text fields through a full-text index
+                           (an FTS5 table on SQLite, a tsvector column with a GIN
+                           index on PostgreSQL), numeric fields by equality and
+                           date fields by day, month or year range, and can order
+                           the results by relevance. Other databases, and models
+                           without an integer primary key, fall back to 'icontains'.
+
+The full-text index of each model lives in a side table ("<db_table>_fts").
+It is created and filled after `migrate` (the post_migrate receiver
+create_missing_indexes) or by the reconstruir_indice_busqueda management
+command, never while serving a request. Searches and saves only check that it
+exists, caching the answer per database once it is committed; while it is
+missing, searches fall back to 'icontains' and saves skip the index. The
+post_save/post_delete receivers connected in DynDtConfig.ready() keep it up
+to date. Writes that skip signals (queryset.update(), bulk_create) need the
+reconstruir_indice_busqueda command.
+"""
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from apps.dyn_dt.utils import get_datatable_options, search_filter
+from cli import name_to_class
+
+
+TEXT_FIELDS = (models.CharField, models.TextField)
+# Rows read per query while (re)building an index
+INDEX_CHUNK_SIZE = 2000
+# Accepted date formats and the span each one covers
+DATE_FORMATS = (
+    ('%Y-%m-%d', 'day'),
+    ('%d/%m/%Y', 'day'),
+    ('%Y-%m', 'month'),
+    ('%m/%Y', 'month'),
+    ('%Y', 'year'),
+)
+_TOKEN_RE = re.compile(r'\w+')
+_NUMBER_RE = re.compile(r'-?\d+(?:[.,]\d+)?')
+# Index tables known to exist, per database: {(alias, database name): {table, ...}}
+_existing_indexes = {}
+
+
+def parse_number(value):
+    """Returns value as a Decimal if it is a plain number ('12', '-3,5'), else None."""
+    if _NUMBER_RE.fullmatch(value):
+        return Decimal(value.replace(',', '.'))
+    return None
+
+
+def parse_date_range(value):
+    """
+    Parses a day, month or year.
+
+    Returns:
+        (first day, day after the last one) or None
+    """
+    for date_format, span in DATE_FORMATS:
+        try:
+            start = datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+        if span == 'day':
+            return start, start + timedelta(days=1)
+        if span == 'month':
+            return start, (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start, start.replace(year=start.year + 1)
+    return None
+
+
+class IcontainsSearchBackend:
+    """ORs an icontains lookup over the non-FK fields."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def search(self, queryset, value, order_by_relevance=False):
+        """
+        Filters queryset to the rows matching value.
+
+        Args:
+            queryset: QuerySet of the backend's model
+            value: Search string
+            order_by_relevance: Ignored, this backend has no ranking
+
+        Returns:
+            Filtered queryset
+        """
+        fields = [field.name for field in self.model._meta.fields]
+        fk_fields = [field.name for field in self.model._meta.fields if field.is_relation]
+        return search_filter(queryset, value, fields, fk_fields)
+
+
+class FullTextSearchBackend:
+    """Full-text index on the text fields plus typed matching on numbers and dates."""
+
+    VENDORS = ('sqlite', 'postgresql')
+
+    def __init__(self, model):
+        self.model = model
+        self.table = f'{model._meta.db_table}_fts'
+        self.text_fields = [field.name for field in model._meta.fields if isinstance(field, TEXT_FIELDS)]
+
+    def supported(self, connection):
+        return connection.vendor in self.VENDORS and isinstance(self.model._meta.pk, models.IntegerField)
+
+    # ---- Index maintenance ----
+
+    @staticmethod
+    def _known_indexes(connection):
+        return _existing_indexes.setdefault((connection.alias, connection.settings_dict['NAME']), set())
+
+    def index_exists(self, connection):
+        """
+        Whether the index table exists. A positive answer is cached for the
+        database once no transaction that could still drop it is open, so the
+        request paths run the catalog query only while the index is missing.
+        """
+        known = self._known_indexes(connection)
+        if self.table in known:
+            return True
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+                exists = cursor.fetchone() is not None
+            else:
+                cursor.execute('SELECT to_regclass(%s)', [self.table])
+                exists = cursor.fetchone()[0] is not None
+        if exists:
+            transaction.on_commit(lambda: known.add(self.table), using=connection.alias)
+        return exists
+
+    def rebuild(self, connection):
+        """
+        Drops and rebuilds the index from the model table.
+
+        Returns:
+            Number of rows indexed
+        """
+        table = connection.ops.quote_name(self.table)
+        self.drop(connection)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {table} USING fts5(contenido, tokenize='unicode61 remove_diacritics 2')"
+                )
+            else:
+                cursor.execute(f'CREATE TABLE {table} (id bigint PRIMARY KEY, documento tsvector NOT NULL)')
+                cursor.execute(
+                    f'CREATE INDEX {connection.ops.quote_name(self.table + "_gin")} ON {table} USING GIN (documento)'
+                )
+
+        rows = self.model._default_manager.using(connection.alias).order_by().values_list('pk', *self.text_fields)
+        total, chunk = 0, []
+        for row in rows.iterator(chunk_size=INDEX_CHUNK_SIZE):
+            chunk.append((row[0], self.document(row[1:])))
+            if len(chunk) == INDEX_CHUNK_SIZE:
+                total += self._insert(connection, chunk)
+                chunk = []
+        total += self._insert(connection, chunk)
+        transaction.on_commit(lambda: self._known_indexes(connection).add(self.table), using=connection.alias)
+        return total
+
+    def drop(self, connection):
+        """Drops the index; searches fall back to 'icontains' until it is rebuilt."""
+        self._known_indexes(connection).discard(self.table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(self.table)}')
+
+    def _insert(self, connection, rows):
+        if not rows:
+            return 0
+        table = connection.ops.quote_name(self.table)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.executemany(f'INSERT INTO {table} (rowid, contenido) VALUES (%s, %s)', rows)
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {table} (id, documento) VALUES (%s, to_tsvector('simple', %s)) "
+                    f"ON CONFLICT (id) DO UPDATE SET documento = EXCLUDED.documento",
+                    rows
+                )
+        return len(rows)
+
+    @staticmethod
+    def document(values):
+        return ' '.join(str(value) for value in values if value)
+
+    def index_object(self, instance, connection):
+        """Adds or refreshes one row of the index. Does nothing while the index does not exist."""
+        if not self.index_exists(connection):
+            return
+        self._delete(instance.pk, connection)
+        self._insert(connection, [(instance.pk, self.document(getattr(instance, name) for name in self.text_fields))])
+
+    def remove_object(self, pk, connection):
+        if self.index_exists(connection):
+            self._delete(pk, connection)
+
+    def _delete(self, pk, connection):
+        column = 'rowid' if connection.vendor == 'sqlite' else 'id'
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(self.table)} WHERE {column} = %s', [pk])
+
+    # ---- Querying ----
+
+    def search(self, queryset, value, order_by_relevance=False):
+        """
+        Filters queryset to the rows whose text fields match every word of
+        value (as prefixes), or whose numeric/date fields equal it.
+
+        Args:
+            queryset: QuerySet of the backend's model
+            value: Search string
+            order_by_relevance: Order by full-text rank (best first), then pk
+
+        Returns:
+            Filtered queryset
+        """
+        value = (value or '').strip()
+        if not value:
+            return queryset
+        connection = connections[queryset.db]
+        if not self.supported(connection) or not self.index_exists(connection):
+            return IcontainsSearchBackend(self.model).search(queryset, value)
+
+        condition = self.typed_condition(value)
+        tokens = _TOKEN_RE.findall(value)
+        if tokens:
+            match_sql, rank_sql, params = self.match_sql(connection, tokens)
+            condition |= Q(pk__in=RawSQL(match_sql, params))
+        if not condition:
+            return queryset.none()
+
+        queryset = queryset.filter(condition)
+        if order_by_relevance and tokens:
+            queryset = queryset.annotate(search_rank=RawSQL(rank_sql, params)).order_by(
+                F('search_rank').desc(nulls_last=True), 'pk'
+            )
+        return queryset
+
+    def match_sql(self, connection, tokens):
+        """Returns the SQL of the matching ids, of the rank of the outer row, and their params."""
+        table = connection.ops.quote_name(self.table)
+        outer_pk = f'{connection.ops.quote_name(self.model._meta.db_table)}.{connection.ops.quote_name(self.model._meta.pk.column)}'
+        if connection.vendor == 'sqlite':
+            query = ' '.join(f'"{token}"*' for token in tokens)
+            return (
+                f'SELECT rowid FROM {table} WHERE {table} MATCH %s',
+                # bm25() is lower for better matches
+                f'SELECT -bm25({table}) FROM {table} WHERE {table} MATCH %s AND rowid = {outer_pk}',
+                [query]
+            )
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        return (
+            f"SELECT id FROM {table} WHERE documento @@ to_tsquery('simple', %s)",
+            f"SELECT ts_rank(documento, to_tsquery('simple', %s)) FROM {table} WHERE id = {outer_pk}",
+            [query]
+        )
+
+    def typed_condition(self, value):
+        """Equality on numeric fields and range on date fields, when value parses as such."""
+        condition = Q()
+        number = parse_number(value)
+        date_range = parse_date_range(value)
+        for field in self.model._meta.fields:
+            if field.is_relation or field.choices:
+                continue
+            if number is not None and isinstance(field, (models.DecimalField, models.FloatField)):
+                condition |= Q(**{field.name: number})
+            elif number is not None and isinstance(field, models.IntegerField) and number == number.to_integral_value():
+                condition |= Q(**{field.name: int(number)})
+            elif date_range and isinstance(field, models.DateTimeField):
+                start, end = (datetime.combine(day, datetime.min.time()) for day in date_range)
+                if settings.USE_TZ:
+                    start, end = timezone.make_aware(start), timezone.make_aware(end)
+                condition |= Q(**{f'{field.name}__gte': start, f'{field.name}__lt': end})
+            elif date_range and isinstance(field, models.DateField):
+                condition |= Q(**{f'{field.name}__gte': date_range[0], f'{field.name}__lt': date_range[1]})
+        return condition
+
+
+SEARCH_BACKENDS = {
+    'icontains': IcontainsSearchBackend,
+    'fulltext': FullTextSearchBackend,
+}
+
+
+def get_search_backend(aPath, aModelClass):
+    """
+    Returns the search backend configured for a DYNAMIC_DATATB path.
+
+    Args:
+        aPath: Model path string
+        aModelClass: Django model class registered for the path
+
+    Returns:
+        Search backend instance
+    """
+    options = get_datatable_options(aPath) or {}
+    name = options.get('search', 'icontains')
+    if name not in SEARCH_BACKENDS:
+        raise ImproperlyConfigured(f"DYNAMIC_DATATB['{aPath}']: unknown search backend '{name}'")
+    return SEARCH_BACKENDS[name](aModelClass)
+
+
+def fulltext_models():
+    """Models of the DYNAMIC_DATATB entries using the 'fulltext' backend."""
+    indexed = []
+    for aPath in settings.DYNAMIC_DATATB:
+        options = get_datatable_options(aPath)
+        aModelClass = name_to_class(options['model'])
+        if options.get('search') == 'fulltext' and aModelClass and aModelClass not in indexed:
+            indexed.append(aModelClass)
+    return indexed
+
+
+def create_missing_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate receiver: creates and fills the index of every 'fulltext'
+    model whose table exists and whose index does not yet.
+    """
+    connection = connections[using]
+    tables = None
+    for model in fulltext_models():
+        backend = FullTextSearchBackend(model)
+        if not backend.supported(connection):
+            continue
+        if tables is None:
+            tables = set(connection.introspection.table_names())
+        if model._meta.db_table in tables and backend.table not in tables:
+            with transaction.atomic(using=using):
+                backend.rebuild(connection)
+
+
+def update_index_on_save(sender, instance, using, **kwargs):
+    backend = FullTextSearchBackend(sender)
+    if backend.supported(connections[using]):
+        backend.index_object(instance, connections[using])
+
+
+def update_index_on_delete(sender, instance, using, **kwargs):
+    backend = FullTextSearchBackend(sender)
+    if backend.supported(connections[using]):
+        backend.remove_object(instance.pk, connections[using])
+
+
+_connected_models = []
+
+
+def connect_signals(**kwargs):
+    """(Re)connects the index receivers to the current 'fulltext' models."""
+    if kwargs.get('setting') not in (None, 'DYNAMIC_DATATB'):
+        return
+    for model in _connected_models:
+        post_save.disconnect(sender=model, dispatch_uid='dyn_dt_search_save')
+        post_delete.disconnect(sender=model, dispatch_uid='dyn_dt_search_delete')
+    _connected_models[:] = fulltext_models()
+    for model in _connected_models:
+        post_save.connect(update_index_on_save, sender=model, dispatch_uid='dyn_dt_search_save')
+        post_delete.connect(update_index_on_delete, sender=model, dispatch_uid='dyn_dt_search_delete')
+
+
+# Keeps the receivers in sync when tests override DYNAMIC_DATATB
+setting_changed.connect(connect_signals)
@@ -14,9 +14,15 @@ urlpatterns = [
     path('update/<str:aPath>/<int:id>/', views.update, name="update"),
 
     path('export-csv/<str:aPath>/', views.export_csv, name='export_csv'),
+    path('export-jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('export-jobs/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
+    path('export-jobs/create/<str:aPath>/', views.create_export_job, name='create_export_job'),
 
     path('dynamic-dt/<str:aPath>/', views.model_dt, name="model_dt"),
+    path('dynamic-dt/<str:aPath>/data/', views.model_dt_data, name="model_dt_data"),
     path('tables/', views.tables, name='tables'),
     path('saldo/', views.saldo, name='saldo'),
     path('cajas/', views.cajas, name='cajas'),
+
+    path('metricas/', views.request_metrics_view, name='request_metrics'),
 ]
@@ -1,8 +1,42 @@
-from django.db.models import Q
+import base64
+import json
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate, TruncWeek, TruncMonth
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 
+
+# Balance chart granularities accepted in the `granularidad` query parameter
+GRANULARITIES = ('movimiento', 'dia', 'semana', 'mes')
+TRUNC_FUNCTIONS = {'dia': TruncDate, 'semana': TruncWeek, 'mes': TruncMonth}
+# Largest span (in days) charted with each granularity when picking it automatically
+AUTO_GRANULARITY_MAX_DAYS = (('dia', 92), ('semana', 731))
+# Tie-break between cash and bank movements with the same fecha in merged listings
+MOVEMENT_TYPE_RANK = {'banco': 0, 'caja': 1}
+
+def get_datatable_options(aPath):
+    """
+    Returns the DYNAMIC_DATATB entry of a model path as a dict.
+    
+    Entries are either the model import path or a dict with a 'model' key
+    plus per-model options (e.g. 'search').
+    
+    Args:
+        aPath: Model path string
+    
+    Returns:
+        Dictionary with at least 'model', or None if the path is not registered
+    """
+    entry = settings.DYNAMIC_DATATB.get(aPath)
+    if entry is None:
+        return None
+    return dict(entry) if isinstance(entry, dict) else {'model': entry}
+
+
 def user_filter(request, queryset, fields, fk_fields=[]):
     """
     Filters a queryset based on search parameter in request.
@@ -16,8 +50,22 @@ def user_filter(request, queryset, fields, fk_fields=[]):
     Returns:
         Filtered queryset
     """
-    value = request.GET.get('search')
+    return search_filter(queryset, request.GET.get('search'), fields, fk_fields)
+
+
+def search_filter(queryset, value, fields, fk_fields=[]):
+    """
+    Filters a queryset to the rows where any of the fields contains value.
     
+    Args:
+        queryset: QuerySet to filter
+        value: Search string (falsy to skip filtering)
+        fields: List of fields to search in
+        fk_fields: List of foreign key fields to exclude from search
+    
+    Returns:
+        Filtered queryset
+    """
     if value:
         dynamic_q = Q()
         for field in fields:
@@ -107,6 +155,90 @@ def format_movement_data(movement, tipo='caja'):
     return base_data
 
 
+# Columns read by format_movement_values, per movement type
+MOVEMENT_VALUES_FIELDS = (
+    'id', 'fecha', 'cantidad', 'descripcion', 'archivo_justificante',
+    'concepto_id', 'concepto__nombre', 'concepto__es_gasto',
+    'turno_id', 'turno__nombre', 'turno__ejercicio__nombre', 'turno__campamento__nombre',
+)
+MOVEMENT_VALUES_FIELDS_BY_TYPE = {
+    'caja': ('caja_id', 'caja__nombre', 'caja__activa', 'caja__saldo_caja', 'justificante'),
+    'banco': ('ejercicio__nombre', 'referencia_bancaria'),
+}
+
+
+def movement_values(queryset, tipo='caja'):
+    """
+    Projects a movement queryset onto the columns format_movement_values needs,
+    so a whole listing is read in a single query without model instances.
+    
+    Args:
+        queryset: MovimientoCaja or MovimientoBanco queryset
+        tipo: Type of movement ('caja' or 'banco')
+    
+    Returns:
+        values() queryset
+    """
+    return queryset.values(*MOVEMENT_VALUES_FIELDS, *MOVEMENT_VALUES_FIELDS_BY_TYPE[tipo])
+
+
+def format_movement_values(row, tipo='caja'):
+    """
+    Formats a row of movement_values() exactly like format_movement_data
+    formats the model instance.
+    
+    Args:
+        row: Dictionary from movement_values()
+        tipo: Type of movement ('caja' or 'banco')
+    
+    Returns:
+        Dictionary with formatted movement data
+    """
+    fecha = row['fecha']
+    archivo = row['archivo_justificante']
+    # Same text as Turno.__str__
+    turno = f"{row['turno__nombre']} ({row['turno__ejercicio__nombre']}) - {row['turno__campamento__nombre']})"
+    base_data = {
+        'id': row['id'],
+        'tipo': tipo,
+        'fecha': fecha.strftime('%Y-%m-%d'),
+        'fecha_completa': fecha.strftime('%Y-%m-%d %H:%M:%S'),
+        'fecha_display': fecha.strftime('%d/%m/%Y %H:%M'),
+        'datetime_iso': fecha.isoformat(),
+        'concepto': row['concepto__nombre'],
+        'concepto_id': row['concepto_id'],
+        'cantidad': float(row['cantidad']),
+        'es_gasto': row['concepto__es_gasto'],
+        'tiene_archivo': bool(archivo),
+        'archivo_url': default_storage.url(archivo) if archivo else None,
+        'descripcion': row['descripcion'] or ''
+    }
+    
+    if tipo == 'caja':
+        # Same text as Caja.__str__
+        caja = (
+            f"{row['caja__nombre']} - {'Activa' if row['caja__activa'] else 'Inactiva'} - "
+            f"Saldo: {row['caja__saldo_caja']:.2f}€"
+        )
+        base_data.update({
+            'caja': caja,
+            'caja_id': row['caja_id'],
+            'turno': turno,
+            'turno_id': row['turno_id'],
+            'justificante': row['justificante'] or '',
+        })
+    else:  # banco
+        base_data.update({
+            'caja': f"Banco - {row['ejercicio__nombre']}",
+            'caja_id': None,
+            'turno': turno,
+            'turno_id': row['turno_id'],
+            'referencia_bancaria': row['referencia_bancaria'] or ''
+        })
+    
+    return base_data
+
+
 def calculate_movements_summary(movimientos):
     """
     Calculates summary statistics for a list of movements.
@@ -123,4 +255,158 @@ def calculate_movements_summary(movimientos):
     return {
         'total_ingresos': float(total_ingresos),
         'total_gastos': float(total_gastos),
-    }
\ No newline at end of file
+        'total_movimientos': len(movimientos),
+    }
+
+
+def aggregate_movements_summary(*querysets):
+    """
+    Same result as calculate_movements_summary, computed with one aggregate
+    query per queryset instead of loading the movements.
+    
+    Args:
+        querysets: MovimientoCaja/MovimientoBanco querysets
+    
+    Returns:
+        Dictionary with summary statistics
+    """
+    total_ingresos = Decimal('0.00')
+    total_gastos = Decimal('0.00')
+    total_movimientos = 0
+    for queryset in querysets:
+        totals = queryset.order_by().aggregate(
+            ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+            gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+            movimientos=Count('pk'),
+        )
+        total_ingresos += totals['ingresos'] or 0
+        total_gastos += totals['gastos'] or 0
+        total_movimientos += totals['movimientos']
+    
+    return {
+        'total_ingresos': float(total_ingresos),
+        'total_gastos': float(total_gastos),
+        'total_movimientos': total_movimientos,
+    }
+
+
+def encode_keyset_cursor(*values):
+    """
+    Encodes the sort key of the last returned row as an opaque cursor.
+    
+    Args:
+        values: JSON-serializable key values
+    
+    Returns:
+        URL-safe cursor string
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_keyset_cursor(cursor):
+    """
+    Decodes a cursor created by encode_keyset_cursor.
+    
+    Args:
+        cursor: Cursor string from the request
+    
+    Returns:
+        List of key values
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Cursor inválido') from e
+    if not isinstance(values, list):
+        raise ValueError('Cursor inválido')
+    return values
+
+
+def choose_granularity(requested, first_date=None, last_date=None):
+    """
+    Resolves the granularity of a balance chart.
+    
+    Args:
+        requested: Value of the `granularidad` query parameter ('auto' or missing to pick it)
+        first_date: Date of the first charted movement
+        last_date: Date of the last charted movement
+    
+    Returns:
+        One of GRANULARITIES
+    """
+    if requested in GRANULARITIES:
+        return requested
+    if not first_date or not last_date:
+        return 'dia'
+    span = (last_date - first_date).days
+    for granularity, max_days in AUTO_GRANULARITY_MAX_DAYS:
+        if span <= max_days:
+            return granularity
+    return 'mes'
+
+
+def get_bucket_start(fecha, granularity):
+    """
+    Python counterpart of TRUNC_FUNCTIONS for already loaded dates.
+    
+    Args:
+        fecha: date of the movement (in the current timezone)
+        granularity: One of GRANULARITIES except 'movimiento'
+    
+    Returns:
+        date where the bucket starts
+    """
+    if granularity == 'semana':
+        return fecha - timedelta(days=fecha.weekday())
+    if granularity == 'mes':
+        return fecha.replace(day=1)
+    return fecha
+
+
+def bucket_balance_evolution(points):
+    """
+    Folds a chronological balance series into open/close/min/max buckets.
+    
+    Args:
+        points: Iterable of (bucket, amount, balance) tuples ordered by date, where
+            amount is the signed movement and balance the running balance after it
+    
+    Returns:
+        List of dicts with fecha, apertura, cierre, minimo, maximo, ingresos, gastos
+        and movimientos, plus balance (= cierre) and movimiento (= net amount) so
+        consumers of the per-movement series keep working
+    """
+    buckets = []
+    current = None
+    for bucket, amount, balance in points:
+        if current is None or current['bucket'] != bucket:
+            opening = balance - amount
+            current = {
+                'bucket': bucket, 'apertura': opening, 'minimo': opening, 'maximo': opening,
+                'ingresos': Decimal('0.00'), 'gastos': Decimal('0.00'), 'movimientos': 0,
+            }
+            buckets.append(current)
+        current['cierre'] = balance
+        current['minimo'] = min(current['minimo'], balance)
+        current['maximo'] = max(current['maximo'], balance)
+        if amount >= 0:
+            current['ingresos'] += amount
+        else:
+            current['gastos'] -= amount
+        current['movimientos'] += 1
+
+    return [{
+        'fecha': bucket['bucket'].strftime('%Y-%m-%d'),
+        'balance': float(bucket['cierre']),
+        'movimiento': float(bucket['ingresos'] - bucket['gastos']),
+        'apertura': float(bucket['apertura']),
+        'cierre': float(bucket['cierre']),
+        'minimo': float(bucket['minimo']),
+        'maximo': float(bucket['maximo']),
+        'ingresos': float(bucket['ingresos']),
+        'gastos': float(bucket['gastos']),
+        'movimientos': bucket['movimientos'],
+    } for bucket in buckets]
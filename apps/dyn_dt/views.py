@@ -5,18 +5,25 @@ This module coordinates between different handlers to provide
 a clean, modular architecture for the application.
 """
 from django.shortcuts import render, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, set_response_etag
 from datetime import datetime
+from decimal import Decimal
 
 # Import modular handlers
-from apps.dyn_dt.handlers.ajax_handlers import RegistroAjaxHandler, LegacyAjaxHandler
+from apps.dyn_dt.handlers.ajax_handlers import RegistroAjaxHandler, CajaAjaxHandler, LegacyAjaxHandler
 from apps.dyn_dt.handlers.movement_handlers import MovementHandler
+from apps.dyn_dt.handlers.saldo_handlers import SaldoAjaxHandler
 from apps.dyn_dt.handlers.datatable_handlers import (
-    DatatableHandler, FilterHandler, CRUDHandler, ExportHandler
+    DatatableHandler, DataTablesHandler, FilterHandler, CRUDHandler, ExportHandler, ExportJobHandler
 )
-from apps.dyn_dt.models import Ejercicio, Caja, Concepto, MovimientoCaja, MovimientoBanco, Campamento, DenominacionEuro, CuentaBancaria, ViaMovimientoBanco
+from apps.dyn_dt.middleware import request_metrics
+from apps.dyn_dt.models import Ejercicio, Caja, Concepto, Movimiento, MovimientoCaja, MovimientoBanco, Campamento, DenominacionEuro, CuentaBancaria, ViaMovimientoBanco
+from apps.dyn_dt.utils import TRUNC_FUNCTIONS, bucket_balance_evolution, choose_granularity
 
 
 # ================================
@@ -76,154 +83,7 @@ def saldo(request):
     agregadas de movimientos de caja y banco, así como desgloses.
     """
     if request.method == 'GET' and request.GET.get('ajax') == 'true':
-        from django.http import JsonResponse
-        from django.db.models import Sum, Q, F
-
-        ejercicio_id = request.GET.get('ejercicio_id')
-        if not ejercicio_id:
-            return JsonResponse({'success': False, 'error': 'Ejercicio ID requerido'})
-
-        try:
-            ejercicio = Ejercicio.objects.get(id=ejercicio_id)
-        except Ejercicio.DoesNotExist:
-            return JsonResponse({'success': False, 'error': 'Ejercicio no encontrado'})
-
-        # Movimientos de caja y banco
-        movimientos_caja = MovimientoCaja.objects.filter(ejercicio=ejercicio).select_related('caja', 'turno', 'concepto').order_by('-fecha')
-        movimientos_banco = MovimientoBanco.objects.filter(ejercicio=ejercicio).select_related('turno', 'concepto').order_by('-fecha')
-
-        # Unificar movimientos para gráficos de evolución
-        all_movimientos = []
-        for mov in movimientos_caja:
-            all_movimientos.append({
-                'id': mov.id,
-                'tipo': 'caja',
-                'fecha': mov.fecha.strftime('%Y-%m-%d'),
-                'fecha_display': mov.fecha.strftime('%d/%m/%Y %H:%M'),
-                'datetime_iso': mov.fecha.isoformat(),
-                'turno': mov.turno.nombre,
-                'turno_id': mov.turno.id,
-                'concepto': mov.concepto.nombre,
-                'concepto_id': mov.concepto.id,
-                'descripcion': mov.descripcion,
-                'cantidad': float(mov.cantidad),
-                'es_gasto': mov.concepto.es_gasto,
-                'justificante': mov.justificante,
-                'caja': mov.caja.nombre,
-                'caja_id': mov.caja.id,
-                'referencia_bancaria': None
-            })
-        for mov in movimientos_banco:
-            all_movimientos.append({
-                'id': mov.id,
-                'tipo': 'banco',
-                'fecha': mov.fecha.strftime('%Y-%m-%d'),
-                'fecha_display': mov.fecha.strftime('%d/%m/%Y %H:%M'),
-                'datetime_iso': mov.fecha.isoformat(),
-                'turno': mov.turno.nombre if mov.turno else 'N/A',
-                'turno_id': mov.turno.id if mov.turno else None,
-                'concepto': mov.concepto.nombre,
-                'concepto_id': mov.concepto.id,
-                'descripcion': mov.descripcion,
-                'cantidad': float(mov.cantidad),
-                'es_gasto': mov.concepto.es_gasto,
-                'justificante': '',
-                'caja': None,
-                'caja_id': None,
-                'referencia_bancaria': mov.referencia_bancaria
-            })
-        # Ordenar por fecha descendente
-        all_movimientos.sort(key=lambda x: x['datetime_iso'], reverse=True)
-
-        # Resumen de totales
-        total_ingresos_caja = movimientos_caja.filter(concepto__es_gasto=False).aggregate(total=Sum('cantidad'))['total'] or 0
-        total_gastos_caja = movimientos_caja.filter(concepto__es_gasto=True).aggregate(total=Sum('cantidad'))['total'] or 0
-        total_ingresos_banco = movimientos_banco.filter(concepto__es_gasto=False).aggregate(total=Sum('cantidad'))['total'] or 0
-        total_gastos_banco = movimientos_banco.filter(concepto__es_gasto=True).aggregate(total=Sum('cantidad'))['total'] or 0
-
-        total_ingresos = float(total_ingresos_caja + total_ingresos_banco)
-        total_gastos = float(total_gastos_caja + total_gastos_banco)
-        saldo_actual = float(ejercicio.saldo_total)
-        total_movimientos = len(all_movimientos)
-
-        resumen = {
-            'total_ingresos': total_ingresos,
-            'total_gastos': total_gastos,
-            'saldo_actual': saldo_actual,
-            'total_movimientos': total_movimientos
-        }
-
-        # Evolución del saldo (por día)
-        balance_evolution = []
-        movimientos_sorted = sorted(all_movimientos, key=lambda x: x['datetime_iso'])
-        running_balance = saldo_actual
-        for mov in reversed(movimientos_sorted):
-            balance_evolution.append({
-                'fecha': mov['fecha'],
-                'balance': running_balance,
-                'movimiento': mov['cantidad'] if not mov['es_gasto'] else -mov['cantidad'],
-                'tipo': mov['tipo'],
-                'concepto': mov['concepto'],
-            })
-            running_balance -= mov['cantidad'] if not mov['es_gasto'] else -mov['cantidad']
-
-        balance_evolution = list(reversed(balance_evolution))
-
-        # Desglose por conceptos (ingresos/gastos por concepto)
-        concept_data = {}
-        conceptos = Concepto.objects.all()
-        for concepto in conceptos:
-            total_caja = movimientos_caja.filter(concepto=concepto).aggregate(total=Sum('cantidad'))['total'] or 0
-            total_banco = movimientos_banco.filter(concepto=concepto).aggregate(total=Sum('cantidad'))['total'] or 0
-            total = float(total_caja + total_banco)
-            if total > 0:
-                concept_data[concepto.nombre] = {
-                    'total': total,
-                    'tipo': 'gasto' if concepto.es_gasto else 'ingreso'
-                }
-
-        # Desglose actual de todas las cajas del ejercicio
-        desglose_actual = []
-        cajas = Caja.objects.all()
-        for caja in cajas:
-            for desglose in caja.obtener_desglose_actual():
-                desglose_actual.append({
-                    'caja': caja.nombre,
-                    'valor': float(desglose.denominacion.valor),
-                    'es_billete': desglose.denominacion.es_billete,
-                    'cantidad': desglose.cantidad,
-                    'valor_total': float(desglose.valor_total())
-                })
-
-        # Movimientos recientes (últimos 10)
-        recent_movements = all_movimientos[:10]
-
-        # Info de cajas y banco
-        caja_info = {
-            'cajas': [{
-                'id': caja.id,
-                'nombre': caja.nombre,
-                'saldo_actual': float(caja.saldo_caja)
-            } for caja in cajas],
-            'saldo_banco': float(ejercicio.saldo_banco),
-            'saldo_actual': saldo_actual
-        }
-
-        return JsonResponse({
-            'success': True,
-            'ejercicio': {
-                'id': ejercicio.id,
-                'nombre': ejercicio.nombre,
-                'año': ejercicio.año
-            },
-            'movimientos': all_movimientos,
-            'resumen': resumen,
-            'balance_evolution': balance_evolution,
-            'concept_data': concept_data,
-            'desglose_actual': desglose_actual,
-            'recent_movements': recent_movements,
-            'caja_info': caja_info,
-        })
+        return SaldoAjaxHandler.handle_get_saldo(request)
 
     # --- FIN AJAX ---
     context = {
@@ -271,22 +131,29 @@ def cajas(request):
     También responde a AJAX para datos de cajas, desglose, movimientos, etc.
     """
     from django.http import JsonResponse
-    from django.db.models import Sum
+    from django.db.models import F, Max, Min, Sum, Window
     # AJAX handler
     if request.method == 'GET' and request.GET.get('ajax') == 'true':
         action = request.GET.get('action')
 
         if not action:
-            cajas = Caja.objects.all()
+            # One annotated query; the totals can be limited to an ejercicio and the
+            # cajas to a campamento
+            cajas = Caja.objects.con_totales(ejercicio=request.GET.get('ejercicio_id') or None)
+            if request.GET.get('campamento_id'):
+                cajas = cajas.filter(campamento_id=request.GET.get('campamento_id'))
             cajas_data = [{
-                'id': caja.id,
-                'nombre': caja.nombre,
-                'activa': caja.activa,
-                'saldo_caja': float(caja.saldo_caja),
-                'ingresos_caja': float(caja.movimientos.filter(concepto__es_gasto=False).aggregate(Sum('cantidad'))['cantidad__sum'] or 0),
-                'gastos_caja': float(caja.movimientos.filter(concepto__es_gasto=True).aggregate(Sum('cantidad'))['cantidad__sum'] or 0)
-            } for caja in cajas]
-            return JsonResponse({'success': True, 'cajas': cajas_data})
+                'id': caja['id'],
+                'nombre': caja['nombre'],
+                'activa': caja['activa'],
+                'saldo_caja': float(caja['saldo_caja']),
+                'ingresos_caja': float(caja['ingresos_caja']),
+                'gastos_caja': float(caja['gastos_caja'])
+            } for caja in cajas.values('id', 'nombre', 'activa', 'saldo_caja', 'ingresos_caja', 'gastos_caja')]
+            response = JsonResponse({'success': True, 'cajas': cajas_data})
+            # Answer 304 when the client already has this listing
+            set_response_etag(response)
+            return get_conditional_response(request, etag=response['ETag'], response=response)
         # Desglose de caja
         elif action == 'get_desglose':
             caja_id = request.GET.get('caja_id')
@@ -324,22 +191,7 @@ def cajas(request):
             return JsonResponse({'success': True, 'movimientos': movimientos_data})
         # Movimientos de dinero
         elif action == 'get_movimientos_dinero':
-            caja_id = request.GET.get('caja_id')
-            if not caja_id:
-                return JsonResponse({'success': False, 'error': 'Caja ID requerido'})
-            try:
-                caja = Caja.objects.get(id=caja_id)
-            except Caja.DoesNotExist:
-                return JsonResponse({'success': False, 'error': 'Caja no encontrada'})
-            movimientos_dinero = []
-            for mov in caja.movimientos.all():
-                for md in mov.movimientos_dinero.all():
-                    movimientos_dinero.append({
-                        'denominacion': str(md.denominacion),
-                        'cantidad_entrada': md.cantidad_entrada,
-                        'cantidad_salida': md.cantidad_salida
-                    })
-            return JsonResponse({'success': True, 'movimientos_dinero': movimientos_dinero})
+            return CajaAjaxHandler.handle_get_movimientos_dinero(request)
         # Gráficos de utilidad (ejemplo: saldo por día)
         elif action == 'get_graficos':
             caja_id = request.GET.get('caja_id')
@@ -349,15 +201,38 @@ def cajas(request):
                 caja = Caja.objects.get(id=caja_id)
             except Caja.DoesNotExist:
                 return JsonResponse({'success': False, 'error': 'Caja no encontrada'})
-            movimientos = caja.movimientos.order_by('fecha')
-            labels = []
-            saldos = []
-            saldo = 0
-            for mov in movimientos:
-                saldo += mov.cantidad_real()
-                labels.append(mov.fecha.strftime('%d/%m'))
-                saldos.append(float(saldo))
-            return JsonResponse({'success': True, 'grafico': {'labels': labels, 'saldos': saldos}})
+            movimientos = caja.movimientos.all()
+            rango = movimientos.aggregate(desde=Min('fecha'), hasta=Max('fecha'))
+            granularidad = choose_granularity(
+                request.GET.get('granularidad'),
+                rango['desde'] and timezone.localtime(rango['desde']).date(),
+                rango['hasta'] and timezone.localtime(rango['hasta']).date()
+            )
+            orden = [F('fecha').asc(), F('id').asc()]
+            movimientos = movimientos.annotate(
+                periodo=TRUNC_FUNCTIONS[granularidad]('fecha') if granularidad != 'movimiento' else F('fecha'),
+                importe=Movimiento.expresion_cantidad_real(),
+                saldo=Window(Sum(Movimiento.expresion_cantidad_real()), order_by=orden),
+            ).order_by(*orden).values_list('periodo', 'importe', 'saldo')
+            # SQLite returns window sums as floats; round back to cents
+            puntos = [
+                (periodo, importe, Decimal(saldo).quantize(Decimal('0.01')))
+                for periodo, importe, saldo in movimientos
+            ]
+            if granularidad == 'movimiento':
+                return JsonResponse({'success': True, 'granularidad': granularidad, 'grafico': {
+                    'labels': [periodo.strftime('%d/%m') for periodo, _, _ in puntos],
+                    'saldos': [float(saldo) for _, _, saldo in puntos],
+                }})
+            buckets = bucket_balance_evolution(puntos)
+            formato = '%m/%Y' if granularidad == 'mes' else '%d/%m'
+            return JsonResponse({'success': True, 'granularidad': granularidad, 'grafico': {
+                'labels': [datetime.strptime(b['fecha'], '%Y-%m-%d').strftime(formato) for b in buckets],
+                'saldos': [b['cierre'] for b in buckets],
+                'apertura': [b['apertura'] for b in buckets],
+                'minimo': [b['minimo'] for b in buckets],
+                'maximo': [b['maximo'] for b in buckets],
+            }})
         else:
             return JsonResponse({'success': False, 'error': 'Acción no válida'})
     # Render HTML
@@ -512,111 +387,70 @@ def _handle_campamento_ejercicio_tables_request(request, ejercicio_id, campament
         movimientos_caja = MovimientoCaja.objects.filter(ejercicio=ejercicio, caja__campamento=campamento)
         movimientos_banco = MovimientoBanco.objects.filter(ejercicio=ejercicio, campamento=campamento)
 
-        # Calculate conceptos data
-        conceptos_data = []
-        
-        # Process concepto data from caja movements
-        conceptos_caja = movimientos_caja.values('concepto__id', 'concepto__nombre', 'concepto__es_gasto').annotate(
-            total=Sum('cantidad'),
-            count=Count('id')
-        )
-        
-        # Process concepto data from banco movements
-        conceptos_banco = movimientos_banco.values('concepto__id', 'concepto__nombre', 'concepto__es_gasto').annotate(
-            total=Sum('cantidad'),
-            count=Count('id')
-        )
-        
-        # Combine concepto data
-        conceptos_dict = {}
-        
-        for concepto in conceptos_caja:
-            concepto_id = concepto['concepto__id']
-            if concepto_id not in conceptos_dict:
-                conceptos_dict[concepto_id] = {
-                    'id': concepto_id,
-                    'nombre': concepto['concepto__nombre'],
-                    'es_gasto': concepto['concepto__es_gasto'],
-                    'total': 0,
-                    'count': 0
-                }
-            conceptos_dict[concepto_id]['total'] += float(concepto['total'] or 0)
-            conceptos_dict[concepto_id]['count'] += concepto['count']
-        
-        for concepto in conceptos_banco:
-            concepto_id = concepto['concepto__id']
-            if concepto_id not in conceptos_dict:
-                conceptos_dict[concepto_id] = {
-                    'id': concepto_id,
-                    'nombre': concepto['concepto__nombre'],
-                    'es_gasto': concepto['concepto__es_gasto'],
-                    'total': 0,
-                    'count': 0
-                }
-            conceptos_dict[concepto_id]['total'] += float(concepto['total'] or 0)
-            conceptos_dict[concepto_id]['count'] += concepto['count']
-        
-        conceptos_data = list(conceptos_dict.values())
-        
-        # Calculate turnos data (combine both caja and banco movements)
-        turnos_data = []
-        
-        # Get all turnos for the currento ejercicio of the campamento
-        turnos_ejercicio_campamento = ejercicio.turnos.filter(campamento=campamento)
-
-        for turno in turnos_ejercicio_campamento:
-            # Calculate totals for this turno from caja movements
-            caja_ingresos = movimientos_caja.filter(
-                turno=turno, concepto__es_gasto=False
-            ).aggregate(total=Sum('cantidad'))['total'] or 0
-            
-            caja_gastos = movimientos_caja.filter(
-                turno=turno, concepto__es_gasto=True
-            ).aggregate(total=Sum('cantidad'))['total'] or 0
-            
-            caja_count = movimientos_caja.filter(turno=turno).count()
-            
-            # Calculate totals for this turno from banco movements
-            banco_ingresos = movimientos_banco.filter(
-                turno=turno, concepto__es_gasto=False
-            ).aggregate(total=Sum('cantidad'))['total'] or 0
-            
-            banco_gastos = movimientos_banco.filter(
-                turno=turno, concepto__es_gasto=True
-            ).aggregate(total=Sum('cantidad'))['total'] or 0
-            
-            banco_count = movimientos_banco.filter(turno=turno).count()
-            
-            # Combine totals
-            total_ingresos = float(caja_ingresos + banco_ingresos)
-            total_gastos = float(caja_gastos + banco_gastos)
-            total_count = caja_count + banco_count
-            
-            # Only include turnos that have movements
-            if total_count > 0:
-                turnos_data.append({
-                    'id': turno.id,
-                    'nombre': turno.nombre,
-                    'ingresos': total_ingresos,
-                    'gastos': total_gastos,
-                    'count': total_count
-                })
-        
-        # Calculate resumen
-        total_ingresos_caja = movimientos_caja.filter(concepto__es_gasto=False).aggregate(Sum('cantidad'))['cantidad__sum'] or 0
-        total_gastos_caja = movimientos_caja.filter(concepto__es_gasto=True).aggregate(Sum('cantidad'))['cantidad__sum'] or 0
-        
-        total_ingresos_banco = movimientos_banco.filter(concepto__es_gasto=False).aggregate(Sum('cantidad'))['cantidad__sum'] or 0
-        total_gastos_banco = movimientos_banco.filter(concepto__es_gasto=True).aggregate(Sum('cantidad'))['cantidad__sum'] or 0
-        
-        total_ingresos = float(total_ingresos_caja + total_ingresos_banco)
-        total_gastos = float(total_gastos_caja + total_gastos_banco)
-        saldo_actual = float(ejercicio.calcular_resultado_ejercicio(campamento=campamento))
+        # One grouped query (UNION ALL of both sides) with ingresos/gastos/count
+        # per (turno, concepto); the three blocks below are folded from its rows
+        grupos = [
+            movimientos.order_by().values(
+                'turno_id', 'turno__nombre', 'turno__campamento_id', 'turno__ejercicio_id',
+                'concepto_id', 'concepto__nombre', 'concepto__es_gasto'
+            ).annotate(
+                ingresos=Sum('cantidad', filter=Q(concepto__es_gasto=False)),
+                gastos=Sum('cantidad', filter=Q(concepto__es_gasto=True)),
+                count=Count('id')
+            )
+            for movimientos in (movimientos_caja, movimientos_banco)
+        ]
+        filas = grupos[0].union(grupos[1], all=True)
 
+        conceptos_dict = {}
+        turnos_dict = {}
+        total_ingresos = Decimal('0.00')
+        total_gastos = Decimal('0.00')
+        for fila in filas:
+            ingresos = fila['ingresos'] or Decimal('0.00')
+            gastos = fila['gastos'] or Decimal('0.00')
+            total_ingresos += ingresos
+            total_gastos += gastos
+
+            concepto = conceptos_dict.setdefault(fila['concepto_id'], {
+                'id': fila['concepto_id'],
+                'nombre': fila['concepto__nombre'],
+                'es_gasto': fila['concepto__es_gasto'],
+                'total': Decimal('0.00'),
+                'count': 0
+            })
+            concepto['total'] += ingresos + gastos
+            concepto['count'] += fila['count']
+
+            # Only turnos of this ejercicio and campamento are listed
+            if fila['turno__campamento_id'] != campamento.id or fila['turno__ejercicio_id'] != ejercicio.id:
+                continue
+            turno = turnos_dict.setdefault(fila['turno_id'], {
+                'id': fila['turno_id'],
+                'nombre': fila['turno__nombre'],
+                'ingresos': Decimal('0.00'),
+                'gastos': Decimal('0.00'),
+                'count': 0
+            })
+            turno['ingresos'] += ingresos
+            turno['gastos'] += gastos
+            turno['count'] += fila['count']
+
+        conceptos_data = [
+            {**concepto, 'total': float(concepto['total'])}
+            for concepto in sorted(conceptos_dict.values(), key=lambda c: c['nombre'])
+        ]
+        # Same order as the Turno model (the ejercicio is fixed, so by nombre)
+        turnos_data = [
+            {**turno, 'ingresos': float(turno['ingresos']), 'gastos': float(turno['gastos'])}
+            for turno in sorted(turnos_dict.values(), key=lambda t: t['nombre'])
+        ]
+
+        # The ejercicio result for the campamento is ingresos - gastos of the same rows
         resumen = {
-            'total_ingresos': total_ingresos,
-            'total_gastos': total_gastos,
-            'saldo_actual': saldo_actual
+            'total_ingresos': float(total_ingresos),
+            'total_gastos': float(total_gastos),
+            'saldo_actual': float(total_ingresos - total_gastos)
         }
         
         return JsonResponse({
@@ -728,6 +562,11 @@ def model_dt(request, aPath):
     return render(request, 'dyn_dt/model.html', context)
 
 
+def model_dt_data(request, aPath):
+    """Server-side DataTables JSON endpoint for a dynamic datatable."""
+    return DataTablesHandler.handle(request, aPath)
+
+
 # ================================
 # FILTER MANAGEMENT VIEWS
 # ================================
@@ -780,4 +619,39 @@ def delete(request, aPath, id):
 # ================================
 def export_csv(request, aPath):
     """Handles CSV export requests."""
-    return ExportHandler.export_csv(request, aPath)
\ No newline at end of file
+    return ExportHandler.export_csv(request, aPath)
+
+
+@login_required(login_url='/accounts/login/')
+def create_export_job(request, aPath):
+    """Queues a background export (see procesar_exportaciones)."""
+    return ExportJobHandler.create_job(request, aPath)
+
+
+@login_required(login_url='/accounts/login/')
+def export_job_status(request, job_id):
+    """Returns the progress of a background export."""
+    return ExportJobHandler.job_status(request, job_id)
+
+
+@login_required(login_url='/accounts/login/')
+def export_job_download(request, job_id):
+    """Downloads a finished background export, with Range support."""
+    return ExportJobHandler.download(request, job_id)
+
+
+# ================================
+# INSTRUMENTATION VIEWS
+# ================================
+
+@staff_member_required
+def request_metrics_view(request):
+    """
+    Staff-only JSON with the rolling per-URL-name latency histograms, query
+    counts and N+1 patterns recorded by QueryInstrumentationMiddleware.
+    """
+    return JsonResponse({
+        'success': True,
+        'window': request_metrics.window,
+        'endpoints': request_metrics.snapshot()
+    })
@@ -78,6 +78,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "apps.dyn_dt.middleware.QueryInstrumentationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -188,9 +189,20 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # ### DYNAMIC_DATATB Settings ###
 DYNAMIC_DATATB = {
-    # SLUG -> Import_PATH 
+    # SLUG -> Import_PATH, or a dict with the import path under 'model' plus per-model options:
+    #   'search'        : 'icontains' (default) or 'fulltext' (see apps.dyn_dt.search)
+    #   'pagination'    : 'page' (default, Paginator with COUNT(*)) or 'keyset' (count-free seek pagination)
+    #   'count_timeout' : seconds the keyset total count and page boundaries are cached (default 300)
+    # e.g. 'product' : {'model': "apps.pages.models.Product", 'search': 'fulltext'},
     'product'  : "apps.pages.models.Product",
 }
+
+# Per model path cache of the datatable settings (HideShowFilter, ModelFilter, PageItems)
+DATATABLE_SETTINGS_CACHE = {
+    'MAX_PATHS'   : 128,   # Paths kept in the process-local LRU
+    'TIMEOUT'     : 300,   # Seconds an entry is reused without checking the database
+    'CACHE_ALIAS' : None,  # Shared cache (e.g. 'default' on Redis/Memcached) to propagate invalidations between processes
+}
 ########################################
 
 # Syntax: URI -> Import_PATH
@@ -199,6 +211,33 @@ DYNAMIC_API = {
     'product'  : "apps.pages.models.Product",
 }
 
+# Cursor pagination of the DYNAMIC_API list endpoints (apps.dyn_api.helpers.DynamicCursorPagination)
+DYNAMIC_API_PAGINATION = {
+    'PAGE_SIZE'     : 100,   # Rows per page when ?page_size= is not given
+    'MAX_PAGE_SIZE' : 1000,  # Upper bound of ?page_size=
+}
+
+# Batch writes of api/<model>/bulk/ (apps.dyn_api.helpers.BulkWriter)
+DYNAMIC_API_BULK = {
+    'MAX_ITEMS'  : 5000,  # Items accepted per request
+    'BATCH_SIZE' : 500,   # Rows per INSERT/UPDATE of bulk_create/bulk_update
+}
+
+# Cached movement analytics of the saldo view (apps.dyn_dt.handlers.saldo_handlers.SaldoAnalytics).
+# Invalidations are written to this cache only: with the default LocMemCache each worker process
+# keeps its own entries and may serve stale analytics until 'TIMEOUT'. Point 'CACHE_ALIAS' at a
+# shared backend (Redis/Memcached/database) whenever more than one process serves the site.
+SALDO_ANALYTICS_CACHE = {
+    'CACHE_ALIAS' : 'default',  # Alias of settings.CACHES holding the analytics and their version token
+    'TIMEOUT'     : 3600,       # Seconds an ejercicio's analytics are reused
+}
+
+# Per-request query/latency metrics (apps.dyn_dt.middleware.QueryInstrumentationMiddleware)
+REQUEST_METRICS = {
+    'WINDOW'               : 500,  # Samples kept per URL name
+    'N_PLUS_ONE_THRESHOLD' : 10,   # Executions of one SQL template in a request flagged as N+1
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
@@ -261,17 +261,19 @@ function loadMovimientosDineroCaja(cajaId) {
         data: {
             'ajax': 'true',
             'action': 'get_movimientos_dinero',
+            'agrupar': 'denominacion',
             'caja_id': cajaId,
             'ejercicio_id': $('#ejercicioSelect').val()
         },
         success: function(data) {
-            if (data.success && data.movimientos_dinero && data.movimientos_dinero.length > 0) {
-                let html = '<table class="table table-sm"><thead><tr><th>Denominación</th><th>Entrada</th><th>Salida</th></tr></thead><tbody>';
-                data.movimientos_dinero.forEach(function(mov) {
+            if (data.success && data.por_denominacion && data.por_denominacion.length > 0) {
+                let html = '<table class="table table-sm"><thead><tr><th>Denominación</th><th>Entrada</th><th>Salida</th><th>Neto</th></tr></thead><tbody>';
+                data.por_denominacion.forEach(function(mov) {
                     html += `<tr>
                         <td>${mov.denominacion}</td>
                         <td>${mov.cantidad_entrada}</td>
                         <td>${mov.cantidad_salida}</td>
+                        <td>${mov.cantidad_neta}</td>
                     </tr>`;
                 });
                 html += '</tbody></table>';